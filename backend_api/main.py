@@ -1,70 +1,217 @@
-from fastapi import FastAPI, HTTPException, status, Depends
-from fastapi.security import APIKeyHeader, HTTPBearer
-from google.cloud import storage
-import os
-from dotenv import load_dotenv
-import logging
-import firebase_admin
-from firebase_admin import credentials, auth
+import asyncio
+import datetime
+import functools
 import json
+import logging
+import math
+import os
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List, Optional
 
+import firebase_admin
+from dotenv import load_dotenv
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, status
+from fastapi.responses import JSONResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from firebase_admin import auth, credentials
+from google.api_core.exceptions import NotFound
+from google.cloud import bigquery, firestore, storage
+from google.oauth2 import service_account
+from pydantic import BaseModel, Field
+from review_queue import (
+    APPROVED,
+    PENDING,
+    FirestoreReviewStore,
+    SQLiteReviewStore,
+    approve_items,
+    decode_page_token,
+    encode_page_token,
+)
+from token_cache import TokenCache
+from ttl_cache import TTLCache
 
 # Load environment variables from .env file
 load_dotenv()
 
-app = FastAPI()
-
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-# Initialize Firebase Admin SDK
-# The service account key is now loaded from a Secret Manager environment variable
-FIREBASE_SERVICE_ACCOUNT_KEY_JSON = os.environ.get("FIREBASE_SERVICE_ACCOUNT_KEY")
+# Configure Google Cloud Storage
+BUCKET_NAME = os.environ.get(
+    "GCS_BUCKET_NAME", "ai-invoice-processor-0707-invoices"
+)
 
-if not FIREBASE_SERVICE_ACCOUNT_KEY_JSON:
-    logger.error("Firebase service account key not found in environment variables.")
-    raise ValueError("Firebase service account key environment variable is missing.")
+# Low-confidence records waiting for a reviewer. "firestore" in production;
+# "sqlite" keeps the queue in a local file
+REVIEW_STORE = os.environ.get("REVIEW_STORE", "firestore")
+REVIEW_COLLECTION = os.environ.get("REVIEW_COLLECTION", "review_queue")
+REVIEW_SQLITE_PATH = os.environ.get("REVIEW_SQLITE_PATH", "/tmp/review_queue.db")
+# Table that approved records are written to
+BQ_TABLE_ID = os.environ.get("BQ_TABLE_ID")
 
-try:
-    # Load the service account key JSON
-    service_account_info = json.loads(FIREBASE_SERVICE_ACCOUNT_KEY_JSON)
-    cred = credentials.Certificate(service_account_info)
-    firebase_admin.initialize_app(cred)
-    logger.info("Firebase Admin SDK initialized successfully.")
+# Built once per instance by initialize_clients()
+storage_client = None
+bigquery_client = None
+review_store = None
+clients_task = None
 
-    # Set GOOGLE_APPLICATION_CREDENTIALS for other Google Cloud client libraries
-    # Create a temporary file for the credentials
-    with open("/tmp/firebase_credentials.json", "w") as f:
-        json.dump(service_account_info, f)
-    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "/tmp/firebase_credentials.json"
-    logger.info("GOOGLE_APPLICATION_CREDENTIALS set for other Google Cloud libraries.")
 
-except json.JSONDecodeError as e:
-    logger.error(f"Error decoding Firebase service account key JSON: {e}", exc_info=True)
-    raise ValueError("Invalid Firebase service account key JSON format.") from e
-except Exception as e:
-    logger.error(f"Error initializing Firebase Admin SDK or setting GAC: {e}", exc_info=True)
-    raise
+# Dedicated thread pool for blocking Storage and Firebase calls, so that
+# RSA signing and token verification never run on the event loop. Created
+# and shut down by lifespan(), so the app can be started again in the same
+# process.
+BLOCKING_IO_THREADS = int(os.environ.get("BLOCKING_IO_THREADS", 32))
+blocking_executor = None
 
 
-# Configure Google Cloud Storage
-BUCKET_NAME = os.environ.get(
-    "GCS_BUCKET_NAME", "ai-invoice-processor-0707-invoices"
-)
-storage_client = storage.Client()
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking callable on the dedicated thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        blocking_executor, functools.partial(func, *args, **kwargs)
+    )
+
+
+def initialize_clients():
+    """Initialize the Firebase Admin SDK and the Storage, BigQuery and queue clients.
+
+    They are built from the service account key, which is loaded from a Secret
+    Manager environment variable. The credentials are passed in memory, never
+    via a file.
+    """
+    global storage_client, bigquery_client, review_store
+
+    service_account_key_json = os.environ.get("FIREBASE_SERVICE_ACCOUNT_KEY")
+    if not service_account_key_json:
+        logger.error("Firebase service account key not found in environment variables.")
+        raise ValueError(
+            "Firebase service account key environment variable is missing."
+        )
+
+    try:
+        service_account_info = json.loads(service_account_key_json)
+    except json.JSONDecodeError as e:
+        logger.error(
+            f"Error decoding Firebase service account key JSON: {e}", exc_info=True
+        )
+        raise ValueError("Invalid Firebase service account key JSON format.") from e
+
+    try:
+        # The default app survives a failed attempt or a restart of the app
+        try:
+            firebase_admin.get_app()
+        except ValueError:
+            firebase_admin.initialize_app(
+                credentials.Certificate(service_account_info)
+            )
+        logger.info("Firebase Admin SDK initialized successfully.")
+
+        project_id = service_account_info.get("project_id")
+        google_credentials = service_account.Credentials.from_service_account_info(
+            service_account_info
+        )
+        storage_client = storage.Client(
+            project=project_id, credentials=google_credentials
+        )
+        logger.info("Storage client initialized successfully.")
+
+        bigquery_client = bigquery.Client(
+            project=project_id, credentials=google_credentials
+        )
+        if REVIEW_STORE == "sqlite":
+            review_store = SQLiteReviewStore(REVIEW_SQLITE_PATH)
+        else:
+            review_store = FirestoreReviewStore(
+                REVIEW_COLLECTION,
+                client=firestore.Client(
+                    project=project_id, credentials=google_credentials
+                ),
+            )
+        logger.info("BigQuery and review queue clients initialized successfully.")
+    except Exception as e:
+        logger.error(f"Error initializing Google Cloud clients: {e}", exc_info=True)
+        raise
+
+
+def start_client_initialization():
+    """Start initialize_clients() in the background unless it is running or done.
+
+    A failed attempt is replaced, so the next request retries it.
+    """
+    global clients_task
+    if clients_task is None or (
+        clients_task.done()
+        and (clients_task.cancelled() or clients_task.exception() is not None)
+    ):
+        clients_task = asyncio.ensure_future(run_blocking(initialize_clients))
+    return clients_task
+
+
+async def ensure_clients():
+    """Wait until the clients are ready, raising 503 if initialization failed."""
+    try:
+        await asyncio.shield(start_client_initialization())
+    except Exception as e:
+        # The cause stays in the logs; callers may not be authenticated yet
+        logger.error("Clients are not ready", exc_info=e)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service is not ready.",
+        )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the blocking I/O thread pool and start client initialization.
+
+    Startup does not wait for the clients, so the port is bound and /health
+    answers while they are still being built.
+    """
+    global blocking_executor, clients_task
+    blocking_executor = ThreadPoolExecutor(
+        max_workers=BLOCKING_IO_THREADS, thread_name_prefix="blocking-io"
+    )
+    start_client_initialization()
+    try:
+        yield
+    finally:
+        # The task belongs to this event loop; a restart initializes again
+        clients_task = None
+        executor, blocking_executor = blocking_executor, None
+        executor.shutdown(wait=False)
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 # OAuth2 scheme for Firebase ID token
 oauth2_scheme = HTTPBearer()
 
+# Cache of verified ID tokens, valid until each token's own expiry
+token_cache = TokenCache(max_size=int(os.environ.get("TOKEN_CACHE_MAX_SIZE", 10000)))
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    try:
-        decoded_token = auth.verify_id_token(token)
+
+async def get_current_user(
+    token: HTTPAuthorizationCredentials = Depends(oauth2_scheme),
+):
+    """Return the caller's decoded Firebase ID token, or raise 401."""
+    await ensure_clients()
+
+    id_token = token.credentials
+    decoded_token = token_cache.get(id_token)
+    if decoded_token is not None:
         return decoded_token
+
+    try:
+        # Verification is blocking, so keep it off the event loop
+        decoded_token = await run_blocking(auth.verify_id_token, id_token)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -72,77 +219,670 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    token_cache.put(id_token, decoded_token)
+    return decoded_token
+
+
+# Custom claim that grants access to the review queue. Anyone can create an
+# account in the frontend, so being signed in is not enough to read every
+# client's queued invoices or approve rows into BigQuery. Grant it with
+# set_reviewer_claim.py.
+REVIEWER_CLAIM = os.environ.get("REVIEWER_CLAIM", "reviewer")
+
+
+async def get_current_reviewer(current_user: dict = Depends(get_current_user)):
+    """Return the current user if their ID token carries the reviewer claim.
+
+    Raises 403 otherwise.
+    """
+    if current_user.get(REVIEWER_CLAIM) is not True:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="The review queue requires the reviewer role.",
+        )
+    return current_user
+
+
+# Lifetime of generated upload URLs, in seconds
+SIGNED_URL_EXPIRATION = 3600
+
+# Opt-in reuse of still-valid signed URLs for retried uploads. Entries are
+# keyed by (uid, bucket, object, content_type, method), and a URL is only
+# reused while enough of its validity is left for the upload to finish.
+SIGNED_URL_CACHE_ENABLED = (
+    os.environ.get("SIGNED_URL_CACHE_ENABLED", "false").lower() == "true"
+)
+signed_url_cache = TTLCache(
+    max_size=int(os.environ.get("SIGNED_URL_CACHE_MAX_SIZE", 10000)),
+    min_remaining_seconds=int(
+        os.environ.get("SIGNED_URL_CACHE_MIN_REMAINING_SECONDS", 600)
+    ),
+)
+
+# Upper bound on the number of files accepted by /generate-signed-urls/
+MAX_SIGNED_URL_BATCH_SIZE = int(os.environ.get("MAX_SIGNED_URL_BATCH_SIZE", 500))
+
+# Size guidance for large uploads. Files above SINGLE_UPLOAD_MAX_BYTES should
+# use a resumable session or a parallel composite upload.
+SINGLE_UPLOAD_MAX_BYTES = int(
+    os.environ.get("SINGLE_UPLOAD_MAX_BYTES", 16 * 1024 * 1024)
+)
+MAX_UPLOAD_SIZE_BYTES = int(
+    os.environ.get("MAX_UPLOAD_SIZE_BYTES", 512 * 1024 * 1024)
+)
+# Resumable chunks must be a multiple of 256 KiB
+RESUMABLE_CHUNK_SIZE = int(os.environ.get("RESUMABLE_CHUNK_SIZE", 8 * 1024 * 1024))
+COMPOSITE_PART_SIZE = int(os.environ.get("COMPOSITE_PART_SIZE", 16 * 1024 * 1024))
+# A single GCS compose request accepts at most 32 source objects
+MAX_COMPOSITE_PARTS = 32
+# Part objects live under this prefix; trigger_workflow ignores it
+UPLOAD_PARTS_PREFIX = "_upload_parts/"
+
+# Whitelist of allowed content types
+ALLOWED_CONTENT_TYPES = [
+    "application/pdf",
+    "image/jpeg",
+    "image/png",
+    "image/gif",
+]
+
+
+class SignedUrlRequestItem(BaseModel):
+    """One file of a batch signed URL request."""
+
+    file_name: str
+    content_type: str
+
+
+class BatchSignedUrlRequest(BaseModel):
+    """Files to generate signed upload URLs for in one request."""
+
+    files: List[SignedUrlRequestItem]
+
+
+def validate_upload_request(file_name: str, content_type: str):
+    """Return an error message if the upload request is invalid, otherwise None."""
+    if not file_name or not content_type:
+        return "File name and content type are required."
+
+    # Basic validation for file_name to prevent path traversal
+    if ".." in file_name or "/" in file_name or "\\" in file_name:
+        return "Invalid file name."
+
+    if content_type not in ALLOWED_CONTENT_TYPES:
+        return (
+            f"Unsupported content type: {content_type}. Allowed types are: "
+            f"{', '.join(ALLOWED_CONTENT_TYPES)}"
+        )
+
+    return None
+
+
+class ResumableUploadRequest(BaseModel):
+    """A file to upload through a resumable upload session."""
+
+    file_name: str
+    content_type: str
+    size: Optional[int] = None
+
+
+class CompositeUploadRequest(BaseModel):
+    """A file to upload as parallel parts; `parts` is derived from `size` if unset."""
+
+    file_name: str
+    content_type: str
+    size: int
+    parts: Optional[int] = None
+
+
+class CompleteCompositeUploadRequest(BaseModel):
+    """A parallel composite upload whose parts have all been uploaded."""
+
+    file_name: str
+    content_type: str
+    upload_id: str
+    parts: int
+
+
+def validate_upload_size(size: Optional[int]):
+    """Return an error message if the declared upload size is invalid, else None."""
+    if size is None:
+        return None
+    if size <= 0:
+        return "File size must be positive."
+    if size > MAX_UPLOAD_SIZE_BYTES:
+        return (
+            f"File size {size} exceeds the maximum of {MAX_UPLOAD_SIZE_BYTES} bytes."
+        )
+    return None
+
+
+def upload_part_name(uid: str, upload_id: str, part_number: int) -> str:
+    """Return the object name of one part of a parallel composite upload."""
+    return f"{UPLOAD_PARTS_PREFIX}{uid}/{upload_id}/part-{part_number:05d}"
+
+
+def plan_composite_parts(size: int, requested_parts: Optional[int] = None):
+    """Return (part_size, parts) for a parallel composite upload of `size` bytes.
+
+    The number of parts is recomputed from the part size, so every part holds
+    at least one byte; e.g. 5 bytes asked for as 4 parts become 3 parts of at
+    most 2 bytes.
+    """
+    if requested_parts is None:
+        requested_parts = math.ceil(size / COMPOSITE_PART_SIZE)
+    max_parts = min(MAX_COMPOSITE_PARTS, size)
+    if not 1 <= requested_parts <= max_parts:
+        raise ValueError(f"Number of parts must be between 1 and {max_parts}.")
+    part_size = math.ceil(size / requested_parts)
+    return part_size, math.ceil(size / part_size)
+
+
+def sign_upload_url(file_name: str, content_type: str) -> str:
+    """Generate a V4 signed URL that allows a PUT upload of a single object."""
+    bucket = storage_client.bucket(BUCKET_NAME)
+    blob = bucket.blob(file_name)
+
+    # Generate a V4 signed URL for uploading a file
+    return blob.generate_signed_url(
+        version="v4",
+        expiration=SIGNED_URL_EXPIRATION,  # This URL will be valid for 1 hour
+        method="PUT",
+        content_type=content_type,
+    )
+
+
+async def get_upload_url(uid: str, file_name: str, content_type: str) -> str:
+    """Return a signed upload URL, reusing a cached one where possible.
+
+    A cached URL is used when the signed URL cache is enabled and a still-valid
+    URL exists for the same request.
+    """
+    if not SIGNED_URL_CACHE_ENABLED:
+        return await run_blocking(sign_upload_url, file_name, content_type)
+
+    key = (uid, BUCKET_NAME, file_name, content_type, "PUT")
+    signed_url = signed_url_cache.get(key)
+    if signed_url is not None:
+        return signed_url
+
+    expires_at = time.time() + SIGNED_URL_EXPIRATION
+    signed_url = await run_blocking(sign_upload_url, file_name, content_type)
+    signed_url_cache.put(key, signed_url, expires_at)
+    return signed_url
+
 
 @app.post("/generate-signed-url/")
 async def generate_signed_url(
     file_name: str, content_type: str, current_user: dict = Depends(get_current_user)
 ):
-    """
-    Generates a signed URL for direct file upload to Google Cloud Storage.
+    """Generate a signed URL for direct file upload to Google Cloud Storage.
+
     Requires Firebase authentication.
     """
     # You can access user info from current_user, e.g., current_user['uid']
     logger.info(f"User {current_user['uid']} requesting signed URL for {file_name}")
 
-    if not file_name or not content_type:
+    error = validate_upload_request(file_name, content_type)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+
+    try:
+        signed_url = await get_upload_url(
+            current_user["uid"], file_name, content_type
+        )
+        logger.info(
+            f"Generated signed URL for {file_name} with content type "
+            f"{content_type}"
+        )
+        return {"signed_url": signed_url, "file_name": file_name}
+
+    except Exception as e:
+        logger.error(f"Error generating signed URL: {e}")
         raise HTTPException(
-            status_code=400, detail="File name and content type are required."
+            status_code=500, detail=f"An error occurred: {e}"
         )
 
-    # Basic validation for file_name to prevent path traversal
-    if ".." in file_name or "/" in file_name or "\" in file_name:
-        raise HTTPException(status_code=400, detail="Invalid file name.")
-
-    # Whitelist of allowed content types
-    ALLOWED_CONTENT_TYPES = [
-        "application/pdf",
-        "image/jpeg",
-        "image/png",
-        "image/gif",
-    ]
-    if content_type not in ALLOWED_CONTENT_TYPES:
+
+@app.post("/generate-signed-urls/")
+async def generate_signed_urls(
+    request: BatchSignedUrlRequest, current_user: dict = Depends(get_current_user)
+):
+    """Generate signed upload URLs for a batch of files in a single request.
+
+    The caller is authenticated once and the URLs are signed concurrently.
+    Invalid items are reported individually and do not fail the whole batch.
+    """
+    logger.info(
+        f"User {current_user['uid']} requesting {len(request.files)} signed URLs"
+    )
+
+    if not request.files:
+        raise HTTPException(status_code=400, detail="At least one file is required.")
+
+    if len(request.files) > MAX_SIGNED_URL_BATCH_SIZE:
         raise HTTPException(
-            status_code=400,
+            status_code=413,
             detail=(
-                f"Unsupported content type: {content_type}. Allowed types are: "
-                f"{', '.join(ALLOWED_CONTENT_TYPES)}"
+                f"Batch of {len(request.files)} files exceeds the maximum of "
+                f"{MAX_SIGNED_URL_BATCH_SIZE}."
             ),
         )
 
+    results = []
+    errors = []
+    pending = []
+    for index, item in enumerate(request.files):
+        error = validate_upload_request(item.file_name, item.content_type)
+        if error:
+            errors.append(
+                {"index": index, "file_name": item.file_name, "error": error}
+            )
+        else:
+            pending.append((index, item))
+
+    signed_urls = await asyncio.gather(
+        *(
+            get_upload_url(current_user["uid"], item.file_name, item.content_type)
+            for _, item in pending
+        ),
+        return_exceptions=True,
+    )
+
+    for (index, item), signed_url in zip(pending, signed_urls):
+        if isinstance(signed_url, Exception):
+            logger.error(
+                f"Error generating signed URL for {item.file_name}: {signed_url}"
+            )
+            errors.append(
+                {
+                    "index": index,
+                    "file_name": item.file_name,
+                    "error": f"An error occurred: {signed_url}",
+                }
+            )
+        else:
+            results.append(
+                {
+                    "index": index,
+                    "file_name": item.file_name,
+                    "signed_url": signed_url,
+                }
+            )
+
+    errors.sort(key=lambda e: e["index"])
+    logger.info(
+        f"Generated {len(results)} signed URLs ({len(errors)} errors) for "
+        f"user {current_user['uid']}"
+    )
+    return {"results": results, "errors": errors}
+
+
+def create_resumable_session(file_name: str, content_type: str, size, origin):
+    """Start a GCS resumable upload session and return its session URI."""
+    bucket = storage_client.bucket(BUCKET_NAME)
+    blob = bucket.blob(file_name)
+    return blob.create_resumable_upload_session(
+        content_type=content_type, size=size, origin=origin
+    )
+
+
+def compose_upload_parts(
+    uid: str, upload_id: str, file_name: str, content_type: str, parts: int
+):
+    """Compose the uploaded parts into the final object and delete the parts."""
+    bucket = storage_client.bucket(BUCKET_NAME)
+    sources = [
+        bucket.blob(upload_part_name(uid, upload_id, part_number))
+        for part_number in range(1, parts + 1)
+    ]
+    destination = bucket.blob(file_name)
+    destination.content_type = content_type
+    destination.compose(sources)
+    bucket.delete_blobs(sources, on_error=lambda blob: None)
+
+
+@app.post("/upload-sessions/resumable/")
+async def start_resumable_upload(
+    upload: ResumableUploadRequest,
+    request: Request,
+    current_user: dict = Depends(get_current_user),
+):
+    """Start a resumable upload session for a large file.
+
+    The client uploads the file in chunks to the returned session URL and can
+    resume from the last committed byte after a failure.
+    """
+    logger.info(
+        f"User {current_user['uid']} starting resumable upload for "
+        f"{upload.file_name}"
+    )
+
+    error = validate_upload_request(
+        upload.file_name, upload.content_type
+    ) or validate_upload_size(upload.size)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+
+    try:
+        session_url = await run_blocking(
+            create_resumable_session,
+            upload.file_name,
+            upload.content_type,
+            upload.size,
+            request.headers.get("origin"),
+        )
+    except Exception as e:
+        logger.error(f"Error starting resumable upload session: {e}")
+        raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
+
+    return {
+        "session_url": session_url,
+        "file_name": upload.file_name,
+        "chunk_size": RESUMABLE_CHUNK_SIZE,
+    }
+
+
+@app.post("/upload-sessions/composite/")
+async def start_composite_upload(
+    upload: CompositeUploadRequest, current_user: dict = Depends(get_current_user)
+):
+    """Return signed URLs for uploading a large file as parallel parts.
+
+    Once every part is uploaded, the client calls
+    /upload-sessions/composite/complete/ to compose them into the final
+    object.
+    """
+    uid = current_user["uid"]
+    logger.info(f"User {uid} starting composite upload for {upload.file_name}")
+
+    error = validate_upload_request(
+        upload.file_name, upload.content_type
+    ) or validate_upload_size(upload.size)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+
     try:
-        bucket = storage_client.bucket(BUCKET_NAME)
-        blob = bucket.blob(file_name)
+        part_size, parts = plan_composite_parts(upload.size, upload.parts)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        # Generate a V4 signed URL for uploading a file
-        # The URL is valid for 15 minutes
-        signed_url = blob.generate_signed_url(
-            version="v4",
-            expiration=3600,  # This URL will be valid for 1 hour
-            method="PUT",
-            content_type=content_type,
+    upload_id = uuid.uuid4().hex
+    try:
+        signed_urls = await asyncio.gather(
+            *(
+                run_blocking(
+                    sign_upload_url,
+                    upload_part_name(uid, upload_id, part_number),
+                    "application/octet-stream",
+                )
+                for part_number in range(1, parts + 1)
+            )
         )
-        logger.info(
-            f"Generated signed URL for {file_name} with content type "
-            f"{content_type}"
+    except Exception as e:
+        logger.error(f"Error generating signed URLs for upload parts: {e}")
+        raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
+
+    return {
+        "upload_id": upload_id,
+        "file_name": upload.file_name,
+        "part_content_type": "application/octet-stream",
+        "parts": [
+            {
+                "part_number": part_number,
+                "offset": (part_number - 1) * part_size,
+                "length": min(part_size, upload.size - (part_number - 1) * part_size),
+                "signed_url": signed_url,
+            }
+            for part_number, signed_url in enumerate(signed_urls, start=1)
+        ],
+    }
+
+
+@app.post("/upload-sessions/composite/complete/")
+async def complete_composite_upload(
+    upload: CompleteCompositeUploadRequest,
+    current_user: dict = Depends(get_current_user),
+):
+    """Compose the parts of a parallel composite upload into the final object.
+
+    The final object then triggers invoice processing as usual.
+    """
+    uid = current_user["uid"]
+    logger.info(f"User {uid} completing composite upload for {upload.file_name}")
+
+    error = validate_upload_request(upload.file_name, upload.content_type)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+    if not re.fullmatch(r"[0-9a-f]{32}", upload.upload_id):
+        raise HTTPException(status_code=400, detail="Invalid upload ID.")
+    if not 1 <= upload.parts <= MAX_COMPOSITE_PARTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Number of parts must be between 1 and {MAX_COMPOSITE_PARTS}.",
         )
-        return {"signed_url": signed_url, "file_name": file_name}
 
+    try:
+        await run_blocking(
+            compose_upload_parts,
+            uid,
+            upload.upload_id,
+            upload.file_name,
+            upload.content_type,
+            upload.parts,
+        )
+    except NotFound as e:
+        raise HTTPException(
+            status_code=400, detail=f"Not all parts have been uploaded: {e}"
+        )
     except Exception as e:
-        logger.error(f"Error generating signed URL: {e}")
+        logger.error(f"Error composing upload parts: {e}")
+        raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
+
+    return {"file_name": upload.file_name, "status": "composed"}
+
+
+# Review queue paging and claiming limits
+MAX_REVIEW_PAGE_SIZE = int(os.environ.get("MAX_REVIEW_PAGE_SIZE", 200))
+MAX_REVIEW_CLAIM_COUNT = int(os.environ.get("MAX_REVIEW_CLAIM_COUNT", 50))
+MAX_BULK_APPROVE_SIZE = int(os.environ.get("MAX_BULK_APPROVE_SIZE", 500))
+# How long a claim keeps an item away from other reviewers, in seconds
+REVIEW_CLAIM_SECONDS = int(os.environ.get("REVIEW_CLAIM_SECONDS", 900))
+
+
+class ClaimReviewRequest(BaseModel):
+    """Body of a claim request: how many items to claim."""
+
+    count: int = Field(10, ge=1)
+
+
+class ReviewCorrections(BaseModel):
+    """Fields a reviewer may correct before approving an item."""
+
+    vendor_name: Optional[str] = None
+    invoice_date: Optional[datetime.date] = None
+    due_date: Optional[datetime.date] = None
+    total_amount: Optional[float] = None
+
+
+class ApproveReviewItem(BaseModel):
+    """One item to approve, with optional corrections."""
+
+    review_id: str
+    corrections: Optional[ReviewCorrections] = None
+
+
+class BulkApproveRequest(BaseModel):
+    """Body of a bulk approve request."""
+
+    items: List[ApproveReviewItem]
+
+
+@app.get("/review-queue/")
+async def list_review_queue(
+    item_status: str = Query(PENDING, alias="status"),
+    page_size: int = 50,
+    page_token: Optional[str] = None,
+    current_user: dict = Depends(get_current_reviewer),
+):
+    """List review items oldest first, one page at a time.
+
+    Pass the returned next_page_token to get the following page.
+    """
+    if item_status not in (PENDING, APPROVED):
         raise HTTPException(
-            status_code=500, detail=f"An error occurred: {e}"
+            status_code=400, detail=f"status must be {PENDING} or {APPROVED}."
         )
+    if not 1 <= page_size <= MAX_REVIEW_PAGE_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"page_size must be between 1 and {MAX_REVIEW_PAGE_SIZE}.",
+        )
+    try:
+        after = decode_page_token(page_token) if page_token else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        items = await run_blocking(review_store.list, item_status, page_size, after)
+    except Exception as e:
+        logger.error(f"Error listing review queue: {e}")
+        raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
 
+    return {
+        "items": items,
+        "next_page_token": (
+            encode_page_token(items[-1]) if len(items) == page_size else None
+        ),
+    }
 
-@app.get("/health")
-async def health_check():
+
+@app.post("/review-queue/claim/")
+async def claim_review_items(
+    request: ClaimReviewRequest, current_user: dict = Depends(get_current_reviewer)
+):
+    """Claim the oldest pending items for the current user.
+
+    Other reviewers cannot claim or approve them until the claim expires.
     """
-    Health check endpoint.
+    if request.count > MAX_REVIEW_CLAIM_COUNT:
+        raise HTTPException(
+            status_code=400,
+            detail=f"count must be at most {MAX_REVIEW_CLAIM_COUNT}.",
+        )
+    uid = current_user["uid"]
+    try:
+        items = await run_blocking(
+            review_store.claim, uid, request.count, REVIEW_CLAIM_SECONDS, time.time()
+        )
+    except Exception as e:
+        logger.error(f"Error claiming review items: {e}")
+        raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
+
+    logger.info(f"User {uid} claimed {len(items)} review items")
+    return {"items": items, "claim_seconds": REVIEW_CLAIM_SECONDS}
+
+
+@app.post("/review-queue/approve/")
+async def bulk_approve_review_items(
+    request: BulkApproveRequest, current_user: dict = Depends(get_current_reviewer)
+):
+    """Approve review items, with optional corrections, and write their records.
+
+    The records go to BigQuery. Items that cannot be approved are reported
+    individually and do not fail the whole batch.
+    """
+    uid = current_user["uid"]
+    if not request.items:
+        raise HTTPException(status_code=400, detail="At least one item is required.")
+    if len(request.items) > MAX_BULK_APPROVE_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=(
+                f"Batch of {len(request.items)} items exceeds the maximum of "
+                f"{MAX_BULK_APPROVE_SIZE}."
+            ),
+        )
+    if not BQ_TABLE_ID:
+        raise HTTPException(status_code=500, detail="BQ_TABLE_ID is not set.")
+
+    approvals = [
+        (
+            item.review_id,
+            item.corrections.model_dump(mode="json", exclude_none=True)
+            if item.corrections else None,
+        )
+        for item in request.items
+    ]
+    try:
+        approved, errors = await run_blocking(
+            approve_items, review_store, bigquery_client, BQ_TABLE_ID, approvals, uid
+        )
+    except Exception as e:
+        logger.error(f"Error approving review items: {e}")
+        raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
+
+    logger.info(
+        f"User {uid} approved {len(approved)} review items ({len(errors)} errors)"
+    )
+    return {"approved": approved, "errors": errors}
+
+
+@app.get("/upload-options")
+async def upload_options():
+    """Return size guidance for choosing between the upload methods.
+
+    The methods are single-shot, resumable and parallel composite uploads.
     """
+    return {
+        "single_upload_max_bytes": SINGLE_UPLOAD_MAX_BYTES,
+        "max_upload_size_bytes": MAX_UPLOAD_SIZE_BYTES,
+        "resumable_chunk_size": RESUMABLE_CHUNK_SIZE,
+        "composite_part_size": COMPOSITE_PART_SIZE,
+        "max_composite_parts": MAX_COMPOSITE_PARTS,
+        "allowed_content_types": ALLOWED_CONTENT_TYPES,
+    }
+
+
+@app.get("/health")
+async def health_check():
+    """Health check endpoint."""
     return {"status": "ok"}
 
 
+@app.get("/ready")
+async def readiness_check():
+    """Report readiness.
+
+    Returns 503 until the Firebase and Storage clients have been initialized.
+    """
+    if clients_task is None or not clients_task.done():
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "initializing"},
+        )
+    if clients_task.exception() is not None:
+        logger.error("Client initialization failed",
+                     exc_info=clients_task.exception())
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "error", "detail": "Service is not ready."},
+        )
+    return {"status": "ready"}
+
+
+@app.get("/cache-stats")
+async def cache_stats(current_user: dict = Depends(get_current_user)):
+    """Report hit/miss counters for the in-process caches."""
+    return {
+        "token_cache": token_cache.stats(),
+        "signed_url_cache": dict(
+            signed_url_cache.stats(), enabled=SIGNED_URL_CACHE_ENABLED
+        ),
+    }
+
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8080))
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=port)
@@ -0,0 +1,425 @@
+import base64
+import datetime
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+# Statuses of a review item
+PENDING = "pending"
+APPROVED = "approved"
+
+# Record fields a reviewer may correct when approving
+CORRECTABLE_FIELDS = ("vendor_name", "invoice_date", "due_date", "total_amount")
+
+
+def row_id_for(source):
+    """Return the BigQuery insertId of a record, as bigquery_writer derives it.
+
+    The ID comes from the record's source object. BigQuery only drops a repeated
+    insertId on a best effort basis for about a minute, so it guards against
+    retried requests, not against approving an item twice.
+    """
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+def encode_page_token(item):
+    """Return the page token that resumes a listing after `item`."""
+    cursor = [item["created_at"], item["id"]]
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode("utf-8")).decode("ascii")
+
+
+def decode_page_token(page_token):
+    """Return the (created_at, id) cursor of a page token; raises ValueError."""
+    try:
+        created_at, review_id = json.loads(base64.urlsafe_b64decode(page_token))
+        return float(created_at), str(review_id)
+    except Exception as e:
+        raise ValueError("Invalid page token.") from e
+
+
+def is_claimable(item, reviewer, now):
+    """Return whether `reviewer` may claim, or approve, a pending item.
+
+    They may unless another reviewer holds an unexpired claim on it.
+    """
+    return item["status"] == PENDING and (
+        not item.get("claimed_by")
+        or item["claimed_by"] == reviewer
+        or (item.get("claim_expires_at") or 0) <= now
+    )
+
+
+def approval_error(item, reviewer, now):
+    """Return why `reviewer` cannot approve `item` now, or None if they can."""
+    if item is None:
+        return "Review item not found."
+    if item["status"] != PENDING:
+        return f"Review item is already {item['status']}."
+    if not is_claimable(item, reviewer, now):
+        return "Review item is claimed by another reviewer."
+    return None
+
+
+def apply_corrections(record, corrections):
+    """Return a copy of `record` with the correctable fields overridden."""
+    record = dict(record)
+    record.update({key: value for key, value in (corrections or {}).items()
+                   if key in CORRECTABLE_FIELDS})
+    return record
+
+
+class SQLiteReviewStore:
+    """Review items in a SQLite database.
+
+    Used for local runs and tests; a path of ":memory:" keeps everything in
+    memory.
+    """
+
+    COLUMNS = ("id", "status", "created_at", "source", "source_file_path",
+               "review_reason", "record", "entities", "claimed_by",
+               "claim_expires_at", "reviewed_by", "reviewed_at")
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS review_queue (id TEXT PRIMARY KEY, "
+                "status TEXT NOT NULL, created_at REAL NOT NULL, source TEXT NOT NULL, "
+                "source_file_path TEXT, review_reason TEXT, record TEXT NOT NULL, "
+                "entities TEXT, claimed_by TEXT, claim_expires_at REAL, "
+                "reviewed_by TEXT, reviewed_at REAL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS review_queue_status "
+                "ON review_queue (status, created_at, id)"
+            )
+
+    def _item(self, row):
+        item = dict(zip(self.COLUMNS, row))
+        item["record"] = json.loads(item["record"])
+        item["entities"] = json.loads(item["entities"] or "null")
+        return item
+
+    def _select(self, where, params):
+        return self._conn.execute(
+            f"SELECT {', '.join(self.COLUMNS)} FROM review_queue WHERE {where}", params
+        ).fetchall()
+
+    def add(self, item):
+        """Add a pending item; returns False if its ID is already queued."""
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "INSERT OR IGNORE INTO review_queue (id, status, created_at, source, "
+                "source_file_path, review_reason, record, entities) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (item["id"], PENDING, item["created_at"], item["source"],
+                 item.get("source_file_path"), item.get("review_reason"),
+                 json.dumps(item["record"]), json.dumps(item.get("entities"))),
+            ).rowcount == 1
+
+    def get(self, review_id):
+        """Return the item with `review_id`, or None."""
+        with self._lock:
+            rows = self._select("id = ?", (review_id,))
+        return self._item(rows[0]) if rows else None
+
+    def list(self, status, limit, after=None):
+        """Items with `status` in queue order, starting after a cursor."""
+        created_at, review_id = after or (-1.0, "")
+        with self._lock:
+            rows = self._select(
+                "status = ? AND (created_at > ? OR (created_at = ? AND id > ?)) "
+                "ORDER BY created_at, id LIMIT ?",
+                (status, created_at, created_at, review_id, limit),
+            )
+        return [self._item(row) for row in rows]
+
+    def claim(self, reviewer, count, lease_seconds, now):
+        """Claims up to `count` of the oldest claimable items for `reviewer`."""
+        with self._lock, self._conn:
+            rows = self._select(
+                "status = ? AND (claimed_by IS NULL OR claimed_by = ? "
+                "OR claim_expires_at <= ?) ORDER BY created_at, id LIMIT ?",
+                (PENDING, reviewer, now, count),
+            )
+            self._conn.executemany(
+                "UPDATE review_queue SET claimed_by = ?, claim_expires_at = ? "
+                "WHERE id = ?",
+                [(reviewer, now + lease_seconds, row[0]) for row in rows],
+            )
+        items = [self._item(row) for row in rows]
+        for item in items:
+            item["claimed_by"] = reviewer
+            item["claim_expires_at"] = now + lease_seconds
+        return items
+
+    def approve(self, review_id, reviewer, corrections, now):
+        """Approve the item in one transaction, if `reviewer` may.
+
+        The corrections are applied to its record and it is marked approved.
+        Returns (item, None) with the item as it was before, and its approved
+        record under "approved_record", or (None, error).
+        """
+        with self._lock, self._conn:
+            rows = self._select("id = ?", (review_id,))
+            item = self._item(rows[0]) if rows else None
+            error = approval_error(item, reviewer, now)
+            if error:
+                return None, error
+            item["approved_record"] = apply_corrections(item["record"], corrections)
+            self._conn.execute(
+                "UPDATE review_queue SET status = ?, record = ?, reviewed_by = ?, "
+                "reviewed_at = ? WHERE id = ?",
+                (APPROVED, json.dumps(item["approved_record"]), reviewer, now,
+                 review_id),
+            )
+        return item, None
+
+    def reopen(self, item, reviewer):
+        """Undo `reviewer`'s approval of `item`, as returned by approve().
+
+        The item is pending again with its original record.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE review_queue SET status = ?, record = ?, reviewed_by = NULL, "
+                "reviewed_at = NULL WHERE id = ? AND status = ? AND reviewed_by = ?",
+                (PENDING, json.dumps(item["record"]), item["id"], APPROVED, reviewer),
+            )
+
+    def count(self, status):
+        """Return the number of items with `status`."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM review_queue WHERE status = ?", (status,)
+            ).fetchone()[0]
+
+
+class FirestoreReviewStore:
+    """Review items as Firestore documents.
+
+    They are written by the workflow's createDocument call. Times are
+    timestamps, and the record and entities are JSON strings. Listing needs a
+    composite index on (status, created_at).
+    """
+
+    # Documents read per claim query page, to skip items others hold
+    CLAIM_PAGE_SIZE = 50
+
+    def __init__(self, collection, client=None):
+        from google.cloud import firestore
+
+        self._firestore = firestore
+        self.client = client or firestore.Client()
+        self.collection = self.client.collection(collection)
+
+    @staticmethod
+    def _timestamp(seconds):
+        if seconds is None:
+            return None
+        return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc)
+
+    @staticmethod
+    def _seconds(value):
+        return value.timestamp() if value is not None else None
+
+    def _item(self, snapshot):
+        data = snapshot.to_dict()
+        return {
+            "id": snapshot.id,
+            "status": data["status"],
+            "created_at": self._seconds(data["created_at"]),
+            "source": data["source"],
+            "source_file_path": data.get("source_file_path"),
+            "review_reason": data.get("review_reason"),
+            "record": json.loads(data["record"]),
+            "entities": json.loads(data.get("entities") or "null"),
+            "claimed_by": data.get("claimed_by"),
+            "claim_expires_at": self._seconds(data.get("claim_expires_at")),
+            "reviewed_by": data.get("reviewed_by"),
+            "reviewed_at": self._seconds(data.get("reviewed_at")),
+        }
+
+    def _query(self, status):
+        from google.cloud.firestore_v1.base_query import FieldFilter
+
+        return (
+            self.collection.where(filter=FieldFilter("status", "==", status))
+            .order_by("created_at")
+            .order_by("__name__")
+        )
+
+    def add(self, item):
+        """Add a pending item; returns False if its ID is already queued."""
+        from google.api_core.exceptions import AlreadyExists, Conflict
+
+        try:
+            self.collection.document(item["id"]).create({
+                "status": PENDING,
+                "created_at": self._timestamp(item["created_at"]),
+                "source": item["source"],
+                "source_file_path": item.get("source_file_path"),
+                "review_reason": item.get("review_reason"),
+                "record": json.dumps(item["record"]),
+                "entities": json.dumps(item.get("entities")),
+            })
+            return True
+        except (AlreadyExists, Conflict):
+            return False
+
+    def get(self, review_id):
+        """Return the item with `review_id`, or None."""
+        snapshot = self.collection.document(review_id).get()
+        return self._item(snapshot) if snapshot.exists else None
+
+    def list(self, status, limit, after=None):
+        """Items with `status` in queue order, starting after a cursor."""
+        query = self._query(status)
+        if after:
+            query = query.start_after({
+                "created_at": self._timestamp(after[0]),
+                "__name__": self.collection.document(after[1]),
+            })
+        return [self._item(snapshot) for snapshot in query.limit(limit).stream()]
+
+    def _update(self, review_id, changes_for):
+        """Read the item in a transaction and apply the update it calls for.
+
+        `changes_for(item)` returns the update as (fields, error); fields of None
+        leave the item as it is. Returns (item, None), or (None, error).
+        """
+        reference = self.collection.document(review_id)
+
+        @self._firestore.transactional
+        def update(transaction):
+            snapshot = reference.get(transaction=transaction)
+            if not snapshot.exists:
+                return None, "Review item not found."
+            item = self._item(snapshot)
+            fields, error = changes_for(item)
+            if fields is None:
+                return None, error
+            transaction.update(reference, fields)
+            return item, None
+
+        return update(self.client.transaction())
+
+    def claim(self, reviewer, count, lease_seconds, now):
+        """Claims up to `count` of the oldest claimable items for `reviewer`."""
+        claimed = []
+        after = None
+        while len(claimed) < count:
+            page = self.list(PENDING, self.CLAIM_PAGE_SIZE, after)
+            for candidate in page:
+                if len(claimed) == count:
+                    break
+                if not is_claimable(candidate, reviewer, now):
+                    continue
+                item, _ = self._update(
+                    candidate["id"],
+                    lambda item: (
+                        {"claimed_by": reviewer,
+                         "claim_expires_at": self._timestamp(now + lease_seconds)}
+                        if is_claimable(item, reviewer, now) else None,
+                        None,
+                    ),
+                )
+                if item is not None:
+                    item["claimed_by"] = reviewer
+                    item["claim_expires_at"] = now + lease_seconds
+                    claimed.append(item)
+            if len(page) < self.CLAIM_PAGE_SIZE:
+                break
+            after = (page[-1]["created_at"], page[-1]["id"])
+        return claimed
+
+    def approve(self, review_id, reviewer, corrections, now):
+        """Approve the item in one transaction, if `reviewer` may.
+
+        The corrections are applied to its record and it is marked approved.
+        Returns (item, None) with the item as it was before, and its approved
+        record under "approved_record", or (None, error).
+        """
+
+        def approval(item):
+            error = approval_error(item, reviewer, now)
+            if error:
+                return None, error
+            item["approved_record"] = apply_corrections(item["record"], corrections)
+            return {"status": APPROVED,
+                    "record": json.dumps(item["approved_record"]),
+                    "reviewed_by": reviewer,
+                    "reviewed_at": self._timestamp(now)}, None
+
+        return self._update(review_id, approval)
+
+    def reopen(self, item, reviewer):
+        """Undo `reviewer`'s approval of `item`, as returned by approve().
+
+        The item is pending again with its original record.
+        """
+
+        def reopening(current):
+            if current["status"] != APPROVED or current["reviewed_by"] != reviewer:
+                return None, None
+            return {"status": PENDING, "record": json.dumps(item["record"]),
+                    "reviewed_by": None, "reviewed_at": None}, None
+
+        self._update(item["id"], reopening)
+
+    def count(self, status):
+        """Return the number of items with `status`."""
+        from google.cloud.firestore_v1.base_query import FieldFilter
+
+        query = self.collection.where(filter=FieldFilter("status", "==", status))
+        return int(query.count().get()[0][0].value)
+
+
+def approve_items(store, bigquery_client, table_id, approvals, reviewer, now=None):
+    """Approve review items and write their records to BigQuery directly.
+
+    The records do not go through bigquery_writer. `approvals` is a list of
+    (review_id, corrections) pairs; corrections override fields of the queued
+    record.
+
+    Each item is checked and marked approved in one store transaction before
+    anything is written, so an item approved twice, or by two reviewers at
+    once, is written by only one of them. Items whose rows BigQuery rejects
+    are reopened and reported. Returns (approved_ids, errors).
+    """
+    now = time.time() if now is None else now
+    errors = []
+    accepted = []
+    for review_id, corrections in approvals:
+        item, error = store.approve(review_id, reviewer, corrections, now)
+        if error:
+            errors.append({"review_id": review_id, "error": error})
+        else:
+            accepted.append(item)
+
+    if not accepted:
+        return [], errors
+
+    try:
+        insert_errors = bigquery_client.insert_rows_json(
+            table_id,
+            [item["approved_record"] for item in accepted],
+            row_ids=[row_id_for(item["source"]) for item in accepted],
+        )
+    except Exception as e:
+        insert_errors = [{"index": index, "errors": str(e)}
+                         for index in range(len(accepted))]
+    failed = {error["index"]: error["errors"] for error in insert_errors or []}
+
+    approved = []
+    for index, item in enumerate(accepted):
+        if index in failed:
+            store.reopen(item, reviewer)
+            errors.append({"review_id": item["id"],
+                           "error": f"BigQuery insert failed: {failed[index]}"})
+        else:
+            approved.append(item["id"])
+    return approved, errors
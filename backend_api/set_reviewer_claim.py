@@ -0,0 +1,31 @@
+"""Grants or revokes the reviewer claim that the review queue endpoints require.
+
+The user gets the new claim with their next ID token, i.e. after signing in
+again or within an hour.
+"""
+import argparse
+
+import firebase_admin
+from firebase_admin import auth
+from main import REVIEWER_CLAIM
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Grant or revoke the review queue reviewer role."
+    )
+    parser.add_argument("email", help="Email address of the Firebase user.")
+    parser.add_argument("--revoke", action="store_true",
+                        help="Remove the reviewer role instead of granting it.")
+    args = parser.parse_args()
+
+    # Uses Application Default Credentials
+    firebase_admin.initialize_app()
+    user = auth.get_user_by_email(args.email)
+    claims = dict(user.custom_claims or {})
+    if args.revoke:
+        claims.pop(REVIEWER_CLAIM, None)
+    else:
+        claims[REVIEWER_CLAIM] = True
+    auth.set_custom_user_claims(user.uid, claims or None)
+    print(f"{'Revoked' if args.revoke else 'Granted'} the reviewer role "
+          f"{'from' if args.revoke else 'to'} {args.email} ({user.uid}).")
@@ -0,0 +1,53 @@
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(BACKEND_DIR), "load_testing"))
+sys.path.insert(0, BACKEND_DIR)
+
+import main  # noqa: E402
+from local_gcp import LocalBigQueryClient, LocalStorageClient  # noqa: E402
+from review_queue import SQLiteReviewStore  # noqa: E402
+
+
+@pytest.fixture
+def local_clients(monkeypatch, tmp_path):
+    """Replace the Google Cloud clients with the local_gcp stand-ins."""
+    storage_client = LocalStorageClient()
+    bigquery_client = LocalBigQueryClient()
+    review_store = SQLiteReviewStore(str(tmp_path / "review_queue.db"))
+
+    def initialize_clients():
+        main.storage_client = storage_client
+        main.bigquery_client = bigquery_client
+        main.review_store = review_store
+
+    monkeypatch.setattr(main, "initialize_clients", initialize_clients)
+    monkeypatch.setattr(main, "BQ_TABLE_ID", "local-project.dataset.invoices")
+    return storage_client, bigquery_client, review_store
+
+
+@pytest.fixture
+def sign_in():
+    """Return a function that makes requests authenticate as `claims`."""
+
+    def sign_in_as(claims):
+        async def current_user():
+            await main.ensure_clients()
+            return claims
+
+        main.app.dependency_overrides[main.get_current_user] = current_user
+
+    yield sign_in_as
+    main.app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def client(local_clients, sign_in):
+    """Yield a test client of the app, signed in as a plain user."""
+    sign_in({"uid": "user-1"})
+    with TestClient(main.app) as test_client:
+        yield test_client
@@ -0,0 +1,101 @@
+import main
+import pytest
+from fastapi.testclient import TestClient
+from token_cache import TokenCache
+from ttl_cache import TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Freeze time.time() for the caches; set `clock.now` to move it."""
+
+    class Clock:
+        now = 1000.0
+
+    monkeypatch.setattr("ttl_cache.time.time", lambda: Clock.now)
+    return Clock
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    """A full cache evicts the entry that was read or written longest ago."""
+    cache = TTLCache(max_size=2)
+    cache.put("a", 1, expires_at=2000)
+    cache.put("b", 2, expires_at=2000)
+    assert cache.get("a") == 1
+    cache.put("c", 3, expires_at=2000)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entry_is_dropped_below_min_remaining(clock):
+    """An entry is only returned while min_remaining_seconds are left."""
+    cache = TTLCache(min_remaining_seconds=600)
+    cache.put("url", "signed", expires_at=clock.now + 3600)
+
+    clock.now += 2999
+    assert cache.get("url") == "signed"
+    clock.now += 1
+    assert cache.get("url") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_expired_values_are_not_stored(clock):
+    """Putting an already expired value, or into a zero-size cache, is a no-op."""
+    cache = TTLCache()
+    cache.put("old", 1, expires_at=clock.now)
+    TTLCache(max_size=0).put("any", 1, expires_at=clock.now + 60)
+    assert cache.stats()["size"] == 0
+
+
+def test_stats_count_hits_and_misses(clock):
+    """Hits, misses and the hit rate reflect every lookup."""
+    cache = TTLCache()
+    cache.put("a", 1, expires_at=2000)
+    cache.get("a")
+    cache.get("a")
+    cache.get("missing")
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 1)
+    assert stats["hit_rate"] == pytest.approx(2 / 3)
+
+
+def test_token_cache_expires_at_the_token_exp(clock):
+    """A verified token is served from the cache until its exp claim."""
+    cache = TokenCache()
+    decoded = {"uid": "user-1", "exp": clock.now + 60}
+    cache.put("raw-token", decoded)
+
+    assert cache.get("raw-token") == decoded
+    clock.now += 60
+    assert cache.get("raw-token") is None
+
+
+def test_token_cache_skips_tokens_without_exp(clock):
+    """Tokens without an exp claim are never cached."""
+    cache = TokenCache()
+    cache.put("raw-token", {"uid": "user-1"})
+    assert cache.get("raw-token") is None
+
+
+def test_token_cache_does_not_keep_raw_tokens(clock):
+    """Entries are keyed by a hash, so the raw token is not held in memory."""
+    cache = TokenCache()
+    cache.put("raw-token", {"uid": "user-1", "exp": clock.now + 60})
+    assert "raw-token" not in cache._entries
+
+
+def test_cache_stats_require_authentication(local_clients):
+    """/cache-stats answers only signed-in callers."""
+    with TestClient(main.app) as test_client:
+        response = test_client.get("/cache-stats")
+    assert response.status_code in (401, 403)
+
+
+def test_cache_stats_for_signed_in_user(client):
+    """A signed-in caller gets the counters of both caches."""
+    response = client.get("/cache-stats")
+    assert response.status_code == 200
+    assert set(response.json()) == {"token_cache", "signed_url_cache"}
@@ -0,0 +1,95 @@
+import main
+import pytest
+
+
+@pytest.mark.parametrize(
+    "size, requested, expected",
+    [
+        (5, 4, (2, 3)),
+        (5, 5, (1, 5)),
+        (100, 3, (34, 3)),
+        (1, None, (1, 1)),
+        (40 * 1024 * 1024, None, (13981014, 3)),
+    ],
+)
+def test_plan_covers_every_byte(size, requested, expected):
+    """Every part of a plan holds at least one byte and the parts add up."""
+    part_size, parts = main.plan_composite_parts(size, requested)
+    assert (part_size, parts) == expected
+    lengths = [min(part_size, size - i * part_size) for i in range(parts)]
+    assert all(length > 0 for length in lengths)
+    assert sum(lengths) == size
+
+
+@pytest.mark.parametrize("size, requested", [(5, 6), (5, 0), (5, -1), (10**6, 33)])
+def test_plan_rejects_out_of_range_parts(size, requested):
+    """Part counts outside 1..min(32, size) are rejected."""
+    with pytest.raises(ValueError):
+        main.plan_composite_parts(size, requested)
+
+
+def test_start_rejects_more_parts_than_bytes(client):
+    """The endpoint answers 400 for a part count the plan rejects."""
+    response = client.post(
+        "/upload-sessions/composite/",
+        json={"file_name": "a.pdf", "content_type": "application/pdf",
+              "size": 5, "parts": 6},
+    )
+    assert response.status_code == 400
+
+
+def upload_parts(storage_client, plan, data, skip=()):
+    """PUT each planned part of `data`, except the part numbers in `skip`."""
+    for part in plan["parts"]:
+        if part["part_number"] in skip:
+            continue
+        assert part["length"] > 0
+        chunk = data[part["offset"]:part["offset"] + part["length"]]
+        storage_client.put_signed_url(
+            part["signed_url"], chunk, content_type=plan["part_content_type"]
+        )
+
+
+def test_composite_upload_round_trip(client, local_clients):
+    """Uploaded parts are composed into the original bytes and then deleted."""
+    storage_client = local_clients[0]
+    data = bytes(range(256)) * 4 + b"tail"
+    plan = client.post(
+        "/upload-sessions/composite/",
+        json={"file_name": "invoice.pdf", "content_type": "application/pdf",
+              "size": len(data), "parts": 7},
+    ).json()
+    assert sum(part["length"] for part in plan["parts"]) == len(data)
+    upload_parts(storage_client, plan, data)
+
+    response = client.post(
+        "/upload-sessions/composite/complete/",
+        json={"file_name": "invoice.pdf", "content_type": "application/pdf",
+              "upload_id": plan["upload_id"], "parts": len(plan["parts"])},
+    )
+    assert response.status_code == 200
+
+    bucket = storage_client.bucket(main.BUCKET_NAME)
+    assert bucket.blob("invoice.pdf").download_as_bytes() == data
+    assert bucket.get_blob("invoice.pdf") is not None
+    assert bucket.list_blobs(prefix=main.UPLOAD_PARTS_PREFIX) == []
+
+
+def test_complete_with_a_missing_part_is_rejected(client, local_clients):
+    """Completing an upload with a part missing fails and creates no object."""
+    storage_client = local_clients[0]
+    data = b"x" * 100
+    plan = client.post(
+        "/upload-sessions/composite/",
+        json={"file_name": "invoice.pdf", "content_type": "application/pdf",
+              "size": len(data), "parts": 4},
+    ).json()
+    upload_parts(storage_client, plan, data, skip={3})
+
+    response = client.post(
+        "/upload-sessions/composite/complete/",
+        json={"file_name": "invoice.pdf", "content_type": "application/pdf",
+              "upload_id": plan["upload_id"], "parts": len(plan["parts"])},
+    )
+    assert response.status_code == 400
+    assert not storage_client.bucket(main.BUCKET_NAME).blob("invoice.pdf").exists()
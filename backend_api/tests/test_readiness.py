@@ -0,0 +1,52 @@
+import time
+
+import main
+import pytest
+from fastapi.testclient import TestClient
+
+SECRET_DETAIL = "could not parse key abc123"
+
+
+@pytest.fixture
+def failing_client(monkeypatch, sign_in):
+    """Yield a signed-in test client whose client initialization fails."""
+
+    def initialize_clients():
+        raise ValueError(SECRET_DETAIL)
+
+    monkeypatch.setattr(main, "initialize_clients", initialize_clients)
+    sign_in({"uid": "user-1"})
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+def wait_until_initialized(test_client):
+    """Poll /ready until initialization has finished, and return the response."""
+    deadline = time.monotonic() + 5
+    while True:
+        response = test_client.get("/ready")
+        if response.json()["status"] != "initializing" or \
+                time.monotonic() > deadline:
+            return response
+        time.sleep(0.01)
+
+
+def test_ready_hides_the_initialization_error(failing_client):
+    """/ready answers 503 without the exception's text."""
+    response = wait_until_initialized(failing_client)
+    assert response.status_code == 503
+    assert response.json() == {"status": "error", "detail": "Service is not ready."}
+    assert SECRET_DETAIL not in response.text
+
+
+def test_endpoints_hide_the_initialization_error(failing_client):
+    """Authenticated endpoints answer 503 without the exception's text."""
+    response = failing_client.get("/cache-stats")
+    assert response.status_code == 503
+    assert response.json() == {"detail": "Service is not ready."}
+    assert SECRET_DETAIL not in response.text
+
+
+def test_ready_after_initialization(client):
+    """/ready reports ready once the clients are built."""
+    assert wait_until_initialized(client).json() == {"status": "ready"}
@@ -0,0 +1,97 @@
+import main
+import pytest
+from review_queue import APPROVED, PENDING, approve_items
+
+REVIEWER = {"uid": "reviewer-1", "reviewer": True}
+
+
+def queue(store, count):
+    """Add `count` pending items to the store, oldest first."""
+    for i in range(count):
+        source = f"gs://invoices/invoice_{i}.pdf#1"
+        store.add({
+            "id": f"item-{i}",
+            "created_at": 1000.0 + i,
+            "source": source,
+            "source_file_path": source,
+            "record": {"vendor_name": f"Vendor {i}", "source_file_path": source},
+        })
+
+
+@pytest.mark.parametrize(
+    "method, path, body",
+    [
+        ("get", "/review-queue/", None),
+        ("post", "/review-queue/claim/", {"count": 1}),
+        ("post", "/review-queue/approve/", {"items": [{"review_id": "item-0"}]}),
+    ],
+)
+def test_plain_user_is_forbidden(client, local_clients, method, path, body):
+    """Signed-in users without the reviewer claim get 403 and change nothing."""
+    _, bigquery_client, store = local_clients
+    queue(store, 1)
+    response = client.request(method, path, json=body)
+    assert response.status_code == 403
+    assert store.get("item-0")["status"] == PENDING
+    assert bigquery_client.rows(main.BQ_TABLE_ID) == []
+
+
+def test_reviewer_claims_and_approves(client, local_clients, sign_in):
+    """A reviewer lists, claims and approves items with corrections."""
+    _, bigquery_client, store = local_clients
+    queue(store, 3)
+    sign_in(REVIEWER)
+
+    assert len(client.get("/review-queue/").json()["items"]) == 3
+    claimed = client.post("/review-queue/claim/", json={"count": 2}).json()["items"]
+    response = client.post("/review-queue/approve/", json={"items": [
+        {"review_id": item["id"], "corrections": {"vendor_name": "Fixed"}}
+        for item in claimed
+    ]})
+
+    assert response.json() == {"approved": ["item-0", "item-1"], "errors": []}
+    rows = bigquery_client.rows(main.BQ_TABLE_ID)
+    assert [row["vendor_name"] for row in rows] == ["Fixed", "Fixed"]
+    assert store.get("item-0")["status"] == APPROVED
+
+
+def test_two_reviewers_approving_at_once_write_one_row(local_clients):
+    """Approving the same item twice writes its row once."""
+    _, bigquery_client, store = local_clients
+    queue(store, 1)
+
+    first = approve_items(store, bigquery_client, main.BQ_TABLE_ID,
+                          [("item-0", {"vendor_name": "A"})], "reviewer-1")
+    second = approve_items(store, bigquery_client, main.BQ_TABLE_ID,
+                           [("item-0", {"vendor_name": "B"})], "reviewer-2")
+
+    assert first == (["item-0"], [])
+    assert second[0] == [] and "already approved" in second[1][0]["error"]
+    assert [row["vendor_name"] for row in bigquery_client.rows(main.BQ_TABLE_ID)] \
+        == ["A"]
+    assert store.get("item-0")["record"]["vendor_name"] == "A"
+
+
+class FailingBigQueryClient:
+    """A BigQuery client whose inserts always fail."""
+
+    def insert_rows_json(self, table, json_rows, row_ids=None):
+        """Raise as an unavailable service would."""
+        raise RuntimeError("BigQuery is unavailable")
+
+
+def test_failed_write_reopens_the_item(local_clients):
+    """An item whose row BigQuery rejects is pending again, unchanged."""
+    _, bigquery_client, store = local_clients
+    queue(store, 1)
+
+    approved, errors = approve_items(store, FailingBigQueryClient(),
+                                     main.BQ_TABLE_ID,
+                                     [("item-0", {"vendor_name": "A"})], "reviewer-1")
+
+    assert approved == [] and "BigQuery insert failed" in errors[0]["error"]
+    item = store.get("item-0")
+    assert item["status"] == PENDING
+    assert item["record"]["vendor_name"] == "Vendor 0"
+    assert approve_items(store, bigquery_client, main.BQ_TABLE_ID,
+                         [("item-0", None)], "reviewer-1") == (["item-0"], [])
@@ -0,0 +1,29 @@
+import hashlib
+
+from ttl_cache import TTLCache
+
+
+class TokenCache(TTLCache):
+    """Bounded in-process cache of verified Firebase ID tokens.
+
+    Entries are keyed by a SHA-256 hash of the raw token, so the tokens
+    themselves are never kept in memory, and expire at the token's own `exp`
+    claim.
+    """
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token: str):
+        """Return the decoded token if it is cached and not yet expired."""
+        return super().get(self._key(token))
+
+    def put(self, token: str, decoded_token: dict):
+        """Cache a decoded token until its `exp` claim.
+
+        Tokens without an `exp` claim are not cached.
+        """
+        expires_at = decoded_token.get("exp")
+        if expires_at:
+            super().put(self._key(token), decoded_token, expires_at)
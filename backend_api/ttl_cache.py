@@ -0,0 +1,65 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Bounded in-process LRU cache whose entries expire at a given time.
+
+    Each entry is stored with its own expiry. An entry is only returned while
+    at least `min_remaining_seconds` of its lifetime are left. When the cache
+    is full the least recently used entry is evicted.
+    """
+
+    def __init__(self, max_size: int = 10000, min_remaining_seconds: float = 0):
+        self.max_size = max_size
+        self.min_remaining_seconds = min_remaining_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for `key` if it is still valid, else None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at - time.time() <= self.min_remaining_seconds:
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, expires_at: float):
+        """Cache `value` under `key` until `expires_at`."""
+        if self.max_size <= 0 or expires_at <= time.time():
+            return
+
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        """Return the cache counters and current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "min_remaining_seconds": self.min_remaining_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
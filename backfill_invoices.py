@@ -0,0 +1,576 @@
+"""Backfills historical invoices with Document AI batch processing.
+
+Lists the invoices under a GCS prefix, sends them to the processor in
+batchProcess requests, parses the sharded JSON output of each operation as
+it finishes and loads the extracted records into BigQuery with one load job
+per batch. Low-confidence records go to backend_api's review queue, as the
+workflow's do. Progress is saved to a checkpoint file after every step, so an
+interrupted backfill resumes where it stopped when run again.
+"""
+import argparse
+import datetime
+import hashlib
+import importlib.util
+import json
+import os
+import re
+import sys
+import time
+import urllib.parse
+from collections import Counter
+
+from google.api_core.exceptions import Conflict
+from google.cloud import bigquery, storage
+from google.cloud import documentai_v1 as documentai
+
+MIME_TYPES = {
+    ".pdf": "application/pdf",
+    ".tif": "image/tiff",
+    ".tiff": "image/tiff",
+    ".gif": "image/gif",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".bmp": "image/bmp",
+    ".webp": "image/webp",
+}
+# Parts of parallel composite uploads; only the composed object is an invoice
+UPLOAD_PARTS_PREFIX = "_upload_parts/"
+# Same threshold the workflow uses to send an invoice to human review
+CONFIDENCE_THRESHOLD = 0.9
+FIELDS = ["vendor_name", "invoice_date", "due_date", "total_amount"]
+ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+_date_parser = None
+
+
+def load_module(name, *path):
+    """Load a module of this repo from its path relative to the repo root."""
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(os.path.dirname(os.path.abspath(__file__)), *path)
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def parse_date(date_string):
+    """Parse a date with the same code as the date-parser-helper function."""
+    global _date_parser
+    if _date_parser is None:
+        _date_parser = load_module("backfill_date_parser", "date_parser_helper",
+                                   "main.py")
+    return _date_parser.parse_date(date_string)
+
+
+def split_gcs_uri(uri):
+    """Split gs://bucket/prefix into (bucket, prefix)."""
+    if not uri.startswith("gs://"):
+        raise ValueError(f"Not a GCS URI: {uri}")
+    bucket, _, prefix = uri[len("gs://"):].partition("/")
+    return bucket, prefix
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def list_invoices(storage_client, input_uri):
+    """Return [gcs_uri, mime_type] for each supported file under input_uri."""
+    bucket, prefix = split_gcs_uri(input_uri)
+    documents = []
+    for blob in storage_client.list_blobs(bucket, prefix=prefix):
+        if blob.name.startswith(UPLOAD_PARTS_PREFIX) or blob.name.endswith("/"):
+            continue
+        mime_type = MIME_TYPES.get(os.path.splitext(blob.name)[1].lower())
+        if mime_type:
+            documents.append([f"gs://{bucket}/{blob.name}", mime_type])
+    return sorted(documents)
+
+
+class OperationFailedError(Exception):
+    """Raised when a batchProcess operation fails without per-document results."""
+
+
+class DocumentAIBatchClient:
+    """Submits and polls batchProcess operations for one processor."""
+
+    def __init__(self, project_id, location, processor_id):
+        self.client = documentai.DocumentProcessorServiceClient(
+            client_options={"api_endpoint": f"{location}-documentai.googleapis.com"}
+        )
+        self.processor_name = self.client.processor_path(
+            project_id, location, processor_id
+        )
+
+    def submit(self, documents, output_uri):
+        """Start a batchProcess operation and return its name."""
+        request = documentai.BatchProcessRequest(
+            name=self.processor_name,
+            input_documents=documentai.BatchDocumentsInputConfig(
+                gcs_documents=documentai.GcsDocuments(documents=[
+                    documentai.GcsDocument(gcs_uri=uri, mime_type=mime_type)
+                    for uri, mime_type in documents
+                ])
+            ),
+            document_output_config=documentai.DocumentOutputConfig(
+                gcs_output_config=documentai.DocumentOutputConfig.GcsOutputConfig(
+                    gcs_uri=output_uri, field_mask="entities"
+                )
+            ),
+        )
+        operation = self.client.batch_process_documents(request=request)
+        return operation.operation.name
+
+    def poll(self, operation_name):
+        """Return None while the operation runs, else one status per document.
+
+        A status is an (input_uri, output_uri, error) tuple, where error is None
+        for documents that were processed. Raises OperationFailedError when the
+        operation failed as a whole.
+        """
+        operation = self.client.get_operation(request={"name": operation_name})
+        if not operation.done:
+            return None
+        metadata = documentai.BatchProcessMetadata.deserialize(
+            operation.metadata.value
+        )
+        statuses = [
+            (status.input_gcs_source, status.output_gcs_destination,
+             status.status.message if status.status.code else None)
+            for status in metadata.individual_process_statuses
+        ]
+        if not statuses and operation.error.code:
+            raise OperationFailedError(
+                f"Operation {operation_name} failed: {operation.error.message}"
+            )
+        return statuses
+
+
+class Checkpoint:
+    """The backfill's progress, saved as JSON after every change.
+
+    Each batch moves from "pending" to "running" (operation submitted) to
+    "done" (records loaded). A batch whose operation keeps failing as a whole
+    is "failed"; the next run submits it again.
+    """
+
+    def __init__(self, path, input_uri, output_uri):
+        self.path = path
+        self.state = {"input_uri": input_uri, "output_uri": output_uri, "batches": []}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+            if self.state["input_uri"] != input_uri:
+                raise ValueError(
+                    f"Checkpoint {path} belongs to a backfill of "
+                    f"{self.state['input_uri']}, not {input_uri}."
+                )
+
+    @property
+    def batches(self):
+        """The batches, in the order they were created."""
+        return self.state["batches"]
+
+    def add_documents(self, documents, batch_size):
+        """Put documents that are not in any batch yet into new batches."""
+        known = {uri for batch in self.batches for uri, _ in batch["documents"]}
+        new = [document for document in documents if document[0] not in known]
+        for start in range(0, len(new), batch_size):
+            self.batches.append({
+                "id": f"batch-{len(self.batches):05d}",
+                "documents": new[start:start + batch_size],
+                "state": "pending",
+                "operation": None,
+            })
+        return len(new)
+
+    def save(self):
+        """Write the checkpoint to its path."""
+        # Write then rename, so an interruption never leaves a torn file
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(temp_path, self.path)
+
+
+def read_output_entities(storage_client, output_uri):
+    """Return (entities, bytes_read) for the output shards of one document.
+
+    Shards are downloaded and parsed one at a time and only their entities
+    are kept, so memory use is bounded by the largest shard rather than the
+    whole document.
+    """
+    bucket, prefix = split_gcs_uri(output_uri)
+    entities = []
+    bytes_read = 0
+    for blob in storage_client.list_blobs(bucket, prefix=prefix.rstrip("/") + "/"):
+        if not blob.name.endswith(".json"):
+            continue
+        data = blob.download_as_bytes()
+        bytes_read += len(data)
+        entities.extend(json.loads(data).get("entities", []))
+    return entities, bytes_read
+
+
+def entity_value(entity):
+    """Return the record value for an extracted entity."""
+    normalized = entity.get("normalizedValue") or {}
+    if entity["type"] in ("invoice_date", "due_date"):
+        if ISO_DATE.match(normalized.get("text") or ""):
+            return normalized["text"]
+        return parse_date(entity.get("mentionText"))
+    if entity["type"] == "total_amount":
+        money = normalized.get("moneyValue")
+        if money:
+            return int(money.get("units", 0)) + money.get("nanos", 0) / 1e9
+        try:
+            return float(
+                (entity.get("mentionText") or "").replace("$", "").replace(",", "")
+            )
+        except ValueError:
+            return None
+    return entity.get("mentionText")
+
+
+def extract_record(entities, source_uri):
+    """Build the processed_invoices row for one document, like the workflow.
+
+    Returns (record, review_reason), where review_reason is None when every
+    field is confident enough to load without human review.
+    """
+    values = {field: None for field in FIELDS}
+    confidences = {field: 0 for field in FIELDS}
+    for entity in entities:
+        if entity.get("type") in values:
+            values[entity["type"]] = entity_value(entity)
+            confidences[entity["type"]] = entity.get("confidence", 0)
+
+    record = dict(values)
+    record["processed_timestamp"] = datetime.datetime.now(
+        datetime.timezone.utc
+    ).isoformat()
+    record["source_file_path"] = source_uri
+
+    for field in FIELDS:
+        if confidences[field] < CONFIDENCE_THRESHOLD:
+            return record, f"Low confidence score for {field}"
+    return record, None
+
+
+def review_entities(entities):
+    """Return the extracted entities shown to a reviewer, like the workflow's."""
+    shown = {field: {"value": None, "confidence": 0} for field in FIELDS}
+    for field in ("invoice_date", "due_date"):
+        shown[field]["normalized"] = None
+    for entity in entities:
+        if entity.get("type") not in shown:
+            continue
+        shown[entity["type"]].update(value=entity.get("mentionText"),
+                                     confidence=entity.get("confidence", 0))
+        if "normalized" in shown[entity["type"]]:
+            shown[entity["type"]]["normalized"] = (
+                entity.get("normalizedValue") or {}
+            ).get("text")
+    return shown
+
+
+def load_rows(bigquery_client, table, rows, job_key):
+    """Append rows with one load job.
+
+    The job ID comes from job_key, so loading the same batch again after an
+    interruption is a no-op.
+    """
+    job_id = "backfill_" + hashlib.sha256(job_key.encode("utf-8")).hexdigest()[:40]
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+    )
+    try:
+        job = bigquery_client.load_table_from_json(
+            rows, table, job_config=job_config, job_id=job_id
+        )
+    except Conflict:
+        job = bigquery_client.get_job(job_id)
+    job.result()
+
+
+def finish_batch(batch, statuses, storage_client, bigquery_client, table,
+                 input_uri):
+    """Parse a finished operation's output and load its records."""
+    rows = []
+    batch["failed"] = []
+    batch["needs_review"] = []
+    batch["output_bytes"] = 0
+    # A document the operation reported nothing for is failed, not dropped
+    reported = {source_uri for source_uri, _, _ in statuses}
+    statuses = list(statuses) + [
+        (uri, None, "No status returned by the operation")
+        for uri, _ in batch["documents"] if uri not in reported
+    ]
+    for source_uri, output_uri, error in statuses:
+        if error:
+            batch["failed"].append({"source_file_path": source_uri, "error": error})
+            continue
+        entities, bytes_read = read_output_entities(storage_client, output_uri)
+        batch["output_bytes"] += bytes_read
+        record, reason = extract_record(entities, source_uri)
+        if reason:
+            batch["needs_review"].append({"record": record, "reason": reason,
+                                          "entities": review_entities(entities)})
+        else:
+            rows.append(record)
+
+    if rows:
+        load_rows(bigquery_client, table, rows, f"{input_uri}|{batch['id']}")
+    batch["rows_loaded"] = len(rows)
+    batch["state"] = "done"
+    batch["completed_at"] = time.time()
+
+
+def queue_reviews(review_store, batch):
+    """Add a finished batch's low-confidence records to the review queue.
+
+    Items get IDs from their source the way the workflow's do, so queuing a
+    batch again after an interruption adds nothing. The backfill does not
+    know object generations, so sources end in an empty one.
+    """
+    for item in batch["needs_review"]:
+        source_uri = item["record"]["source_file_path"]
+        source = f"{source_uri}#"
+        review_store.add({
+            "id": urllib.parse.quote(source, safe=""),
+            "created_at": time.time(),
+            "source": source,
+            "source_file_path": source_uri,
+            "review_reason": item["reason"],
+            "record": item["record"],
+            "entities": item.get("entities"),
+        })
+    batch["reviews_queued"] = True
+
+
+def fail_batch(batch, error):
+    """Record every document of a batch whose operation failed as failed."""
+    batch["failed"] = [{"source_file_path": uri, "error": error}
+                       for uri, _ in batch["documents"]]
+    batch["needs_review"] = []
+    batch["output_bytes"] = 0
+    batch["rows_loaded"] = 0
+    batch["state"] = "failed"
+    batch["completed_at"] = time.time()
+
+
+def run_backfill(docai, storage_client, bigquery_client, input_uri, output_uri,
+                 table, checkpoint_path, batch_size=100,
+                 max_concurrent_operations=5, poll_interval=30,
+                 review_output=None, max_operation_attempts=3,
+                 review_store=None):
+    """Run (or resume) a backfill and return a throughput report.
+
+    A batch whose operation fails as a whole is submitted again, up to
+    `max_operation_attempts` times per run, and then recorded as failed so
+    the other batches can finish. Records that need review are queued in
+    `review_store` as their batch finishes, and written to `review_output`.
+    """
+    checkpoint = Checkpoint(checkpoint_path, input_uri, output_uri)
+    already_done = sum(1 for batch in checkpoint.batches if batch["state"] == "done")
+    new_documents = checkpoint.add_documents(
+        list_invoices(storage_client, input_uri), batch_size
+    )
+    checkpoint.save()
+    print(f"{new_documents} new documents; {len(checkpoint.batches)} batches, "
+          f"{already_done} already done.")
+
+    started_at = time.time()
+    pending = [batch for batch in checkpoint.batches
+               if batch["state"] in ("pending", "failed")]
+    running = [batch for batch in checkpoint.batches if batch["state"] == "running"]
+    attempts = Counter()
+    try:
+        while pending or running:
+            while pending and len(running) < max_concurrent_operations:
+                batch = pending.pop(0)
+                batch["operation"] = docai.submit(
+                    batch["documents"], f"{output_uri.rstrip('/')}/{batch['id']}/"
+                )
+                batch["state"] = "running"
+                batch["submitted_at"] = time.time()
+                checkpoint.save()
+                running.append(batch)
+                print(f"Submitted {batch['id']} ({len(batch['documents'])} "
+                      f"documents): {batch['operation']}")
+
+            finished = False
+            for batch in list(running):
+                try:
+                    statuses = docai.poll(batch["operation"])
+                except OperationFailedError as e:
+                    running.remove(batch)
+                    finished = True
+                    attempts[batch["id"]] += 1
+                    if attempts[batch["id"]] < max_operation_attempts:
+                        batch["state"] = "pending"
+                        batch["operation"] = None
+                        pending.append(batch)
+                        print(f"{e}; resubmitting {batch['id']}.")
+                    else:
+                        fail_batch(batch, str(e))
+                        print(f"{e}; giving up on {batch['id']} after "
+                              f"{attempts[batch['id']]} attempts.")
+                    checkpoint.save()
+                    continue
+                if statuses is None:
+                    continue
+                finish_batch(batch, statuses, storage_client, bigquery_client,
+                             table, input_uri)
+                if review_store is not None:
+                    queue_reviews(review_store, batch)
+                checkpoint.save()
+                running.remove(batch)
+                finished = True
+                print(f"Finished {batch['id']}: {batch['rows_loaded']} loaded, "
+                      f"{len(batch['needs_review'])} need review, "
+                      f"{len(batch['failed'])} failed")
+            if running and not finished:
+                time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        print(f"\nInterrupted. Progress is saved in {checkpoint_path}; run the "
+              f"same command again to resume.")
+        raise
+
+    if review_store is not None:
+        # Batches finished by runs that did not queue their reviews
+        for batch in checkpoint.batches:
+            if batch["state"] == "done" and not batch.get("reviews_queued"):
+                queue_reviews(review_store, batch)
+        checkpoint.save()
+
+    if review_output:
+        with open(review_output, "w") as f:
+            for batch in checkpoint.batches:
+                for item in batch.get("needs_review", []):
+                    f.write(json.dumps(item) + "\n")
+
+    return build_report(checkpoint, started_at, time.time())
+
+
+def build_report(checkpoint, started_at, finished_at):
+    """Return totals for the whole backfill and throughput for this run."""
+    batches = checkpoint.batches
+    this_run = [b for b in batches if b.get("completed_at", 0) >= started_at]
+    elapsed = finished_at - started_at
+    documents = sum(len(b["documents"]) for b in this_run)
+    output_bytes = sum(b.get("output_bytes", 0) for b in this_run)
+    operation_seconds = [b["completed_at"] - b["submitted_at"] for b in this_run]
+    return {
+        "batches": len(batches),
+        "documents": sum(len(b["documents"]) for b in batches),
+        "rows_loaded": sum(b.get("rows_loaded", 0) for b in batches),
+        "needs_review": sum(len(b.get("needs_review", [])) for b in batches),
+        "failed": sum(len(b.get("failed", [])) for b in batches),
+        "this_run": {
+            "batches": len(this_run),
+            "documents": documents,
+            "duration_s": elapsed,
+            "documents_per_s": documents / elapsed if elapsed else 0,
+            "output_mb_per_s": output_bytes / elapsed / 1024 / 1024 if elapsed else 0,
+            "operation_latency_s": {
+                "p50": percentile(operation_seconds, 50),
+                "p95": percentile(operation_seconds, 95),
+                "max": max(operation_seconds, default=None),
+            },
+        },
+    }
+
+
+def print_report(report):
+    """Print the human-readable summary of a backfill."""
+    run = report["this_run"]
+    print("\nBackfill complete.")
+    print(f"Documents: {report['documents']} in {report['batches']} batches")
+    print(f"Loaded: {report['rows_loaded']}  Needs review: {report['needs_review']}  "
+          f"Failed: {report['failed']}")
+    print(f"This run: {run['documents']} documents in {run['batches']} batches, "
+          f"{run['duration_s']:.1f} s ({run['documents_per_s']:.2f} documents/s, "
+          f"{run['output_mb_per_s']:.2f} MB/s of output parsed)")
+    latency = run["operation_latency_s"]
+    if latency["p50"] is not None:
+        print(f"Operation latency: p50={latency['p50']:.1f} s  "
+              f"p95={latency['p95']:.1f} s  max={latency['max']:.1f} s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Backfill historical invoices with Document AI batchProcess."
+    )
+    parser.add_argument("project_id")
+    parser.add_argument("input_uri", help="GCS prefix of the invoices, e.g. "
+                                          "gs://my-archive/invoices/2023/")
+    parser.add_argument("--output-uri", required=True,
+                        help="GCS prefix for Document AI output. Must not be in "
+                             "the bucket that triggers the workflow.")
+    parser.add_argument("--processor-id", required=True)
+    parser.add_argument("--location", default="us")
+    parser.add_argument("--table", default=None,
+                        help="Destination table (default: "
+                             "<project>.automation_outputs.processed_invoices).")
+    parser.add_argument("--batch-size", type=int, default=100,
+                        help="Documents per batchProcess request.")
+    parser.add_argument("--max-concurrent-operations", type=int, default=5,
+                        help="batchProcess operations running at once.")
+    parser.add_argument("--poll-interval", type=float, default=30,
+                        help="Seconds between operation polls.")
+    parser.add_argument("--checkpoint", default="backfill_checkpoint.json",
+                        help="Checkpoint file; rerun with the same file to resume.")
+    parser.add_argument("--review-output", default="backfill_needs_review.jsonl",
+                        help="Where to write records that need human review.")
+    parser.add_argument("--review-collection", default="review_queue",
+                        help="Firestore collection of backend_api's review queue.")
+    parser.add_argument("--no-review-queue", action="store_true",
+                        help="Only write --review-output; queue nothing.")
+    parser.add_argument("--report", default=None,
+                        help="Optional path to write the report as JSON.")
+    args = parser.parse_args()
+
+    if split_gcs_uri(args.output_uri)[0] == split_gcs_uri(args.input_uri)[0]:
+        print("Error: --output-uri must be in a different bucket than the input.")
+        sys.exit(1)
+
+    review_store = None
+    if not args.no_review_queue:
+        from google.cloud import firestore
+
+        review_queue = load_module("backfill_review_queue", "backend_api",
+                                   "review_queue.py")
+        review_store = review_queue.FirestoreReviewStore(
+            args.review_collection, client=firestore.Client(project=args.project_id)
+        )
+
+    try:
+        report = run_backfill(
+            DocumentAIBatchClient(args.project_id, args.location, args.processor_id),
+            storage.Client(project=args.project_id),
+            bigquery.Client(project=args.project_id),
+            args.input_uri,
+            args.output_uri,
+            args.table or f"{args.project_id}.automation_outputs.processed_invoices",
+            args.checkpoint,
+            batch_size=args.batch_size,
+            max_concurrent_operations=args.max_concurrent_operations,
+            poll_interval=args.poll_interval,
+            review_output=args.review_output,
+            review_store=review_store,
+        )
+    except KeyboardInterrupt:
+        sys.exit(130)
+
+    print_report(report)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
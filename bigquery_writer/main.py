@@ -0,0 +1,420 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+import flask
+import functions_framework
+from google.api_core.exceptions import Conflict, GoogleAPIError
+from google.cloud import bigquery
+
+# Destination table, e.g. "my-project.automation_outputs.processed_invoices"
+TABLE_ID = os.environ.get("BQ_TABLE_ID") or (
+    f"{os.environ.get('GCP_PROJECT_ID')}.automation_outputs.processed_invoices"
+)
+# "insert_all" streams each batch with stable insertIds, so BigQuery drops a
+# retried row whichever instance writes it. "load_job" appends each batch with
+# a free load job instead; it is opt-in because load jobs have no insertIds, so
+# a row is only deduplicated by the instance that wrote it (see LoadJobSink).
+WRITE_METHOD = os.environ.get("WRITE_METHOD", "insert_all")
+
+# A batch is flushed when it holds MAX_BATCH_ROWS rows or its oldest row has
+# waited MAX_BATCH_DELAY_SECONDS.
+MAX_BATCH_ROWS = int(os.environ.get("MAX_BATCH_ROWS", 500))
+MAX_BATCH_DELAY_SECONDS = float(os.environ.get("MAX_BATCH_DELAY_SECONDS", 1))
+# BigQuery allows 1,500 load jobs per table per day across all instances. With
+# the load_job method every instance flushes at most once per
+# LOAD_JOB_MIN_DELAY_SECONDS, so MAX_INSTANCES instances stay within a budget
+# of LOAD_JOBS_PER_DAY, leaving headroom for other loads into the table.
+MAX_INSTANCES = int(os.environ.get("MAX_INSTANCES", 1))
+LOAD_JOBS_PER_DAY = int(os.environ.get("LOAD_JOBS_PER_DAY", 1000))
+LOAD_JOB_MIN_DELAY_SECONDS = 86400 * MAX_INSTANCES / LOAD_JOBS_PER_DAY
+# Requests are rejected with 429 once this many rows are waiting to be written
+MAX_PENDING_ROWS = int(os.environ.get("MAX_PENDING_ROWS", 10000))
+# How long a request waits for its rows to be written before giving up
+WRITE_TIMEOUT_SECONDS = float(os.environ.get("WRITE_TIMEOUT_SECONDS", 240))
+# Number of batches that may be written at the same time
+MAX_CONCURRENT_FLUSHES = int(os.environ.get("MAX_CONCURRENT_FLUSHES", 2))
+# Number of recently written row IDs remembered to drop retried rows
+DEDUP_WINDOW_ROWS = int(os.environ.get("DEDUP_WINDOW_ROWS", 100000))
+RETRY_AFTER_SECONDS = 5
+
+
+def row_id_for(source):
+    """Derive a stable row ID from the source object.
+
+    The source looks like "gs://bucket/invoice.pdf#1712345678901234", so
+    retries of the same invoice map to the same row.
+    """
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class BackpressureError(Exception):
+    """Raised when too many rows are already waiting to be written."""
+
+
+class LoadJobSink:
+    """Appends each batch to the table with one load job.
+
+    The job ID is derived from the batch's row IDs, so a flush that is retried
+    after an unknown outcome finds the existing job instead of loading the rows
+    twice.
+
+    Load jobs ignore row IDs. A request retried on another instance, or after
+    the batch has left the dedup window, loads its rows again, and the table
+    needs a downstream dedup on source_file_path.
+    """
+
+    def __init__(self, client, table_id, max_attempts=3, timeout=300):
+        self.client = client
+        self.table_id = table_id
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+        )
+
+    def write(self, rows, row_ids):
+        """Load the batch, retrying failed jobs up to `max_attempts` times."""
+        digest = hashlib.sha256("\n".join(row_ids).encode("utf-8")).hexdigest()[:40]
+        error = None
+        for attempt in range(self.max_attempts):
+            # A failed load job writes nothing, so a new attempt gets a new ID
+            job_id = f"invoice_writer_{digest}_{attempt}"
+            try:
+                job = self.client.load_table_from_json(
+                    rows, self.table_id, job_config=self.job_config, job_id=job_id
+                )
+            except Conflict:
+                job = self.client.get_job(job_id)
+            try:
+                job.result(timeout=self.timeout)
+                return
+            except GoogleAPIError as e:
+                logging.warning(f"Load job {job_id} failed: {e}")
+                error = e
+        raise error
+
+
+class InsertAllSink:
+    """Streams each batch with tabledata.insertAll.
+
+    The row IDs are sent as insertIds, so BigQuery drops rows it has recently
+    seen.
+    """
+
+    MAX_ROWS_PER_REQUEST = 500
+
+    def __init__(self, client, table_id):
+        self.client = client
+        self.table_id = table_id
+
+    def write(self, rows, row_ids):
+        """Insert the batch in requests of at most MAX_ROWS_PER_REQUEST rows."""
+        for start in range(0, len(rows), self.MAX_ROWS_PER_REQUEST):
+            end = start + self.MAX_ROWS_PER_REQUEST
+            errors = self.client.insert_rows_json(
+                self.table_id, rows[start:end], row_ids=row_ids[start:end]
+            )
+            if errors:
+                raise RuntimeError(f"BigQuery insert errors: {errors[:3]}")
+
+
+class Batch:
+    """Rows waiting to be written together, and the outcome once they are."""
+
+    def __init__(self):
+        self.rows = []
+        self.row_ids = []
+        self.opened_at = None
+        self.flushed = threading.Event()
+        self.error = None
+
+
+class WriterMetrics:
+    """Flush counters plus recent batch sizes and latencies."""
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.rows_written = 0
+        self.duplicate_rows = 0
+        self.rejected_rows = 0
+        self.batch_rows = deque(maxlen=window)
+        self.flush_latency_ms = deque(maxlen=window)
+        self.queue_wait_ms = deque(maxlen=window)
+
+    def record_flush(self, rows, latency, queue_wait, failed):
+        """Record one flush of `rows` rows."""
+        with self._lock:
+            self.flushes += 1
+            if failed:
+                self.failed_flushes += 1
+            else:
+                self.rows_written += rows
+            self.batch_rows.append(rows)
+            self.flush_latency_ms.append(latency * 1000)
+            self.queue_wait_ms.append(queue_wait * 1000)
+
+    def count(self, name, n):
+        """Add `n` to the counter `name`."""
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def snapshot(self):
+        """Return the counters and percentiles as a JSON-ready dict."""
+        with self._lock:
+            batch_rows = list(self.batch_rows)
+            latencies = list(self.flush_latency_ms)
+            waits = list(self.queue_wait_ms)
+            return {
+                "flushes": self.flushes,
+                "failed_flushes": self.failed_flushes,
+                "rows_written": self.rows_written,
+                "duplicate_rows": self.duplicate_rows,
+                "rejected_rows": self.rejected_rows,
+                "batch_rows": {
+                    "mean": sum(batch_rows) / len(batch_rows) if batch_rows else None,
+                    "p50": percentile(batch_rows, 50),
+                    "max": max(batch_rows, default=None),
+                },
+                "flush_latency_ms": {
+                    "p50": percentile(latencies, 50),
+                    "p95": percentile(latencies, 95),
+                    "p99": percentile(latencies, 99),
+                },
+                "queue_wait_ms": {
+                    "p50": percentile(waits, 50),
+                    "p95": percentile(waits, 95),
+                    "p99": percentile(waits, 99),
+                },
+            }
+
+
+class BatchWriter:
+    """Buffers rows from concurrent requests and writes them in batches.
+
+    Batches are written from background threads. write() returns once the
+    caller's rows are written, so a request only succeeds after its rows are
+    durable. While every flush slot is busy the next batch keeps growing, and
+    once MAX_PENDING_ROWS rows are waiting new rows are refused.
+    """
+
+    def __init__(self, sink, max_batch_rows=MAX_BATCH_ROWS,
+                 max_batch_delay=MAX_BATCH_DELAY_SECONDS,
+                 max_pending_rows=MAX_PENDING_ROWS,
+                 max_concurrent_flushes=MAX_CONCURRENT_FLUSHES,
+                 dedup_window=DEDUP_WINDOW_ROWS, log_flushes=True):
+        self.sink = sink
+        self.max_batch_rows = max_batch_rows
+        self.max_batch_delay = max_batch_delay
+        self.max_pending_rows = max_pending_rows
+        self.dedup_window = dedup_window
+        self.log_flushes = log_flushes
+        self.metrics = WriterMetrics()
+        self._condition = threading.Condition()
+        self._batch = Batch()
+        self._pending_rows = 0
+        # Row IDs not yet written, and the batch each one belongs to
+        self._unwritten = {}
+        self._written = OrderedDict()
+        self._flush_slots = threading.BoundedSemaphore(max_concurrent_flushes)
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+
+    def write(self, rows, row_ids, timeout=WRITE_TIMEOUT_SECONDS):
+        """Add rows to the current batch and wait until they are written.
+
+        Rows whose ID was recently written, or is already waiting, are not
+        added again. Raises BackpressureError when the buffer is full.
+        """
+        deadline = time.monotonic() + timeout
+        waits = set()
+        with self._condition:
+            fresh = []
+            seen = set()
+            for row, row_id in zip(rows, row_ids):
+                if row_id in self._written or row_id in seen:
+                    continue
+                if row_id in self._unwritten:
+                    waits.add(self._unwritten[row_id])
+                    continue
+                seen.add(row_id)
+                fresh.append((row, row_id))
+
+            if fresh and self._pending_rows + len(fresh) > self.max_pending_rows:
+                self.metrics.count("rejected_rows", len(fresh))
+                raise BackpressureError(
+                    f"{self._pending_rows} rows are already waiting to be written."
+                )
+
+            batch = self._batch
+            for row, row_id in fresh:
+                batch.rows.append(row)
+                batch.row_ids.append(row_id)
+                self._unwritten[row_id] = batch
+            if fresh:
+                if batch.opened_at is None:
+                    batch.opened_at = time.monotonic()
+                self._pending_rows += len(fresh)
+                waits.add(batch)
+                self._condition.notify()
+
+        duplicates = len(rows) - len(fresh)
+        self.metrics.count("duplicate_rows", duplicates)
+
+        for waiting in waits:
+            if not waiting.flushed.wait(max(0, deadline - time.monotonic())):
+                raise TimeoutError("Timed out waiting for rows to be written.")
+            if waiting.error is not None:
+                raise waiting.error
+        return {"written": len(fresh), "duplicates": duplicates}
+
+    def stats(self):
+        """Return the flush metrics and the number of rows waiting."""
+        stats = self.metrics.snapshot()
+        with self._condition:
+            stats["pending_rows"] = self._pending_rows
+        return stats
+
+    def _flush_loop(self):
+        while True:
+            self._flush_slots.acquire()
+            with self._condition:
+                while not self._batch.rows:
+                    self._condition.wait()
+                while len(self._batch.rows) < self.max_batch_rows:
+                    remaining = (
+                        self._batch.opened_at + self.max_batch_delay - time.monotonic()
+                    )
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._batch
+                self._batch = Batch()
+            threading.Thread(target=self._flush, args=(batch,), daemon=True).start()
+
+    def _flush(self, batch):
+        start = time.monotonic()
+        try:
+            self.sink.write(batch.rows, batch.row_ids)
+        except Exception as e:
+            logging.error(f"Failed to write {len(batch.rows)} rows: {e}")
+            batch.error = e
+        latency = time.monotonic() - start
+
+        with self._condition:
+            for row_id in batch.row_ids:
+                self._unwritten.pop(row_id, None)
+                if batch.error is None:
+                    self._written[row_id] = True
+            while len(self._written) > self.dedup_window:
+                self._written.popitem(last=False)
+            self._pending_rows -= len(batch.rows)
+
+        queue_wait = start - batch.opened_at
+        self.metrics.record_flush(
+            len(batch.rows), latency, queue_wait, batch.error is not None
+        )
+        if self.log_flushes:
+            # Structured log entry, so batch size and latency can back
+            # log-based metrics
+            print(json.dumps({
+                "severity": "ERROR" if batch.error else "INFO",
+                "message": "BigQuery flush",
+                "rows": len(batch.rows),
+                "flush_latency_ms": round(latency * 1000, 1),
+                "queue_wait_ms": round(queue_wait * 1000, 1),
+                "failed": batch.error is not None,
+            }))
+        batch.flushed.set()
+        self._flush_slots.release()
+
+
+# Created on first use, so a local runner can install its own writer first
+writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Return the instance's BatchWriter, creating it on first use."""
+    global writer
+    with _writer_lock:
+        if writer is None:
+            client = bigquery.Client()
+            if WRITE_METHOD == "load_job":
+                sink = LoadJobSink(client, TABLE_ID)
+                max_batch_delay = max(MAX_BATCH_DELAY_SECONDS,
+                                      LOAD_JOB_MIN_DELAY_SECONDS)
+                if max_batch_delay > MAX_BATCH_DELAY_SECONDS:
+                    logging.warning(
+                        f"MAX_BATCH_DELAY_SECONDS raised to {max_batch_delay:.0f}s "
+                        f"to keep {MAX_INSTANCES} instances within "
+                        f"{LOAD_JOBS_PER_DAY} load jobs per day."
+                    )
+            elif WRITE_METHOD == "insert_all":
+                sink = InsertAllSink(client, TABLE_ID)
+                max_batch_delay = MAX_BATCH_DELAY_SECONDS
+            else:
+                raise ValueError(f"Unknown WRITE_METHOD: {WRITE_METHOD}")
+            writer = BatchWriter(sink, max_batch_delay=max_batch_delay)
+    return writer
+
+
+@functions_framework.http
+def bigquery_writer(request: flask.Request):
+    """HTTP Cloud Function that writes invoice records to BigQuery in batches.
+
+    POST {"rows": [{"json": {...}, "source": "gs://bucket/object#generation"}]}
+    returns once the rows are written. GET /metrics returns flush metrics.
+    """
+    if request.method == "GET" and request.path.rstrip("/").endswith("/metrics"):
+        return flask.jsonify(get_writer().stats())
+
+    request_json = request.get_json(silent=True)
+    if not isinstance(request_json, dict) or not isinstance(
+        request_json.get("rows"), list
+    ):
+        return flask.jsonify({"error": "Invalid request. 'rows' is required."}), 400
+
+    rows = []
+    row_ids = []
+    for item in request_json["rows"]:
+        if not isinstance(item, dict) or not isinstance(item.get("json"), dict):
+            return flask.jsonify(
+                {"error": "Each row must be an object with a 'json' record."}
+            ), 400
+        source = item.get("source") or item["json"].get("source_file_path")
+        if not source:
+            return flask.jsonify(
+                {"error": "Each row needs a 'source' or 'source_file_path'."}
+            ), 400
+        rows.append(item["json"])
+        row_ids.append(row_id_for(source))
+
+    try:
+        result = get_writer().write(rows, row_ids)
+    except BackpressureError as e:
+        return flask.jsonify({"error": str(e)}), 429, {
+            "Retry-After": str(RETRY_AFTER_SECONDS)
+        }
+    except TimeoutError as e:
+        return flask.jsonify({"error": str(e)}), 503
+    except Exception as e:
+        return flask.jsonify({"error": f"Failed to write rows: {e}"}), 500
+
+    return flask.jsonify({"status": "success", **result}), 200
@@ -2,12 +2,20 @@ from google.cloud import monitoring_v3
 from google.api_core.exceptions import AlreadyExists
 from google.protobuf import duration_pb2
 
-def create_workflow_failure_alert(project_id):
-    client = monitoring_v3.AlertPolicyServiceClient()
+def find_alert_policy(client, project_name, display_name):
+    """Return the project's alert policy with this display name, or None."""
+    policies = client.list_alert_policies(
+        name=project_name, filter=f'display_name = "{display_name}"'
+    )
+    return next(iter(policies), None)
+
+def create_workflow_failure_alert(project_id, client=None):
+    """Create the workflow failure alert policy, or return the existing one."""
+    client = client or monitoring_v3.AlertPolicyServiceClient()
     project_name = f"projects/{project_id}"
 
     # Define the MetricThreshold trigger
-    trigger = monitoring_v3.Trigger(
+    trigger = monitoring_v3.AlertPolicy.Condition.Trigger(
         count=1
     )
 
@@ -34,13 +42,13 @@ def create_workflow_failure_alert(project_id):
     # Define the AlertPolicy Condition
     condition = monitoring_v3.AlertPolicy.Condition(
         display_name="Workflow Failure Rate",
-        metric_threshold=metric_threshold
+        condition_threshold=metric_threshold
     )
 
     # Define the AlertPolicy
     policy = monitoring_v3.AlertPolicy(
         display_name="Invoice Processing Workflow Failure Alert",
-        combiner=monitoring_v3.AlertPolicy.Combiner.OR,
+        combiner=monitoring_v3.AlertPolicy.ConditionCombinerType.OR,
         conditions=[condition],
         documentation=monitoring_v3.AlertPolicy.Documentation(
             content="This alert fires when the Invoice Processing Workflow fails.",
@@ -54,8 +62,13 @@ def create_workflow_failure_alert(project_id):
         print(f"Alert policy created successfully: {created_policy.name}")
         return created_policy
     except AlreadyExists:
-        print("Alert policy already exists.")
-        return None
+        # Return the stored policy; the local one has no name yet
+        existing = find_alert_policy(client, project_name, policy.display_name)
+        if existing is None:
+            print("Alert policy already exists, but it could not be found.")
+        else:
+            print(f"Alert policy already exists: {existing.name}")
+        return existing
     except Exception as e:
         print(f"An error occurred while creating alert policy: {e}")
         return None
@@ -2,11 +2,13 @@
 from google.cloud import bigquery
 from google.api_core.exceptions import Conflict
 
-def create_bigquery_dataset_and_table(project_id: str, dataset_id: str, table_id: str):
+def create_bigquery_dataset_and_table(project_id: str, dataset_id: str, table_id: str,
+                                      client=None):
     """
-    Creates a BigQuery dataset and a table with a predefined schema.
+    Creates a BigQuery dataset and a table with a predefined schema. Returns
+    the full table ID, or None if either could not be created.
     """
-    client = bigquery.Client(project=project_id)
+    client = client or bigquery.Client(project=project_id)
 
     # Create Dataset
     dataset_ref = bigquery.DatasetReference(project_id, dataset_id)
@@ -21,7 +23,7 @@ def create_bigquery_dataset_and_table(project_id: str, dataset_id: str, table_id
         print(f"Dataset {dataset_id} already exists.")
     except Exception as e:
         print(f"An error occurred while creating dataset: {e}")
-        return
+        return None
 
     # Define Table Schema
     schema = [
@@ -45,6 +47,8 @@ def create_bigquery_dataset_and_table(project_id: str, dataset_id: str, table_id
         print(f"Table {table_id} already exists in dataset {dataset_id}.")
     except Exception as e:
         print(f"An error occurred while creating table: {e}")
+        return None
+    return f"{project_id}.{dataset_id}.{table_id}"
 
 import sys
 
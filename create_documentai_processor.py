@@ -2,11 +2,12 @@ from google.cloud import documentai_v1 as documentai
 from google.api_core.exceptions import AlreadyExists, GoogleAPIError
 import time
 
-def create_processor(project_id: str, location: str, display_name: str, processor_type: str):
+def create_processor(project_id: str, location: str, display_name: str,
+                     processor_type: str, client=None):
     """
     Creates a Document AI processor or retrieves an existing one.
     """
-    client = documentai.DocumentProcessorServiceClient()
+    client = client or documentai.DocumentProcessorServiceClient()
     parent = f"projects/{project_id}/locations/{location}"
 
     processor = documentai.Processor(
@@ -18,9 +19,11 @@ def create_processor(project_id: str, location: str, display_name: str, processo
         print(f"Attempting to create processor: {display_name} ({processor_type}) in {location}...")
         # Attempt to create the processor
         operation = client.create_processor(parent=parent, processor=processor)
-        # Wait for the operation to complete
-        operation.result() 
-        print(f"Processor creation operation completed.")
+        # Wait for the operation to complete; its result is the new processor,
+        # so there is no need to list the location's processors to find it
+        created = operation.result()
+        print(f"Processor created: {created.name}")
+        return created
 
     except AlreadyExists:
         print(f"Processor '{display_name}' already exists. Proceeding to retrieve.")
@@ -32,7 +35,7 @@ def create_processor(project_id: str, location: str, display_name: str, processo
         print(f"An unexpected error occurred during creation: {e}")
         return None
 
-    # Always try to retrieve the processor after creation attempt or if it already exists
+    # Retrieve the processor if it already exists
     print(f"Attempting to retrieve processor: {display_name}...")
     try:
         # List processors and find the one with the matching display_name and type.
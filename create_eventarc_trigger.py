@@ -10,11 +10,13 @@ def create_eventarc_trigger(
     destination_cloud_function_region: str,
     gcs_bucket_name: str,
     service_account_email: str,
+    client=None,
 ):
     """
-    Creates an Eventarc trigger for a GCS bucket to trigger a Cloud Function.
+    Creates an Eventarc trigger for a GCS bucket to trigger a Cloud Function,
+    or returns the existing one.
     """
-    client = eventarc_v1.EventarcClient()
+    client = client or eventarc_v1.EventarcClient()
     parent = f"projects/{project_id}/locations/{location}"
 
     trigger = Trigger(
@@ -41,7 +43,7 @@ def create_eventarc_trigger(
     except AlreadyExists:
         print(f"Eventarc trigger '{trigger_id}' already exists.")
         # If it already exists, we assume it's correctly configured.
-        return None
+        return client.get_trigger(name=trigger.name)
     except GoogleAPIError as e:
         print(f"An API error occurred: {e}")
         return None
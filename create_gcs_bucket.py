@@ -1,22 +1,64 @@
 
 from google.cloud import storage
+from google.api_core.exceptions import Conflict
 from datetime import datetime
 
-def create_bucket(project_id: str, bucket_name: str, location: str):
-    """
-    Creates a new Google Cloud Storage bucket.
+# Parts of parallel composite uploads that were never composed are deleted
+# after a day
+UPLOAD_PARTS_PREFIX = "_upload_parts/"
+UPLOAD_PARTS_MAX_AGE_DAYS = 1
+
+
+def has_upload_parts_rule(bucket):
+    """Return whether the bucket already deletes stale upload parts."""
+    return any(
+        rule.get("action", {}).get("type") == "Delete"
+        and rule.get("condition", {}).get("matchesPrefix") == [UPLOAD_PARTS_PREFIX]
+        for rule in bucket.lifecycle_rules
+    )
+
+
+def add_upload_parts_rule(bucket):
+    """Add the lifecycle rule that deletes stale upload parts."""
+    bucket.add_lifecycle_delete_rule(
+        age=UPLOAD_PARTS_MAX_AGE_DAYS, matches_prefix=[UPLOAD_PARTS_PREFIX]
+    )
+
+
+def create_bucket(project_id: str, bucket_name: str, location: str,
+                  storage_client=None):
+    """Create a Google Cloud Storage bucket, or return it if it exists.
+
+    An existing bucket gets the upload parts lifecycle rule if it lacks it.
     """
-    storage_client = storage.Client(project=project_id)
+    storage_client = storage_client or storage.Client(project=project_id)
 
     try:
         print(f"Attempting to create bucket: {bucket_name} in {location}...")
-        bucket = storage_client.create_bucket(bucket_name, location=location)
+        bucket = storage_client.bucket(bucket_name)
+        add_upload_parts_rule(bucket)
+        bucket = storage_client.create_bucket(bucket, location=location)
         print(f"Bucket {bucket.name} created.")
         return bucket
+    except Conflict:
+        print(f"Bucket {bucket_name} already exists.")
     except Exception as e:
         print(f"An error occurred while creating bucket: {e}")
         return None
 
+    try:
+        bucket = storage_client.get_bucket(bucket_name)
+        if not has_upload_parts_rule(bucket):
+            # The rule is appended to the bucket's rules; patch() sends the lifecycle
+            # field only
+            add_upload_parts_rule(bucket)
+            bucket.patch()
+            print(f"Added the upload parts lifecycle rule to {bucket_name}.")
+        return bucket
+    except Exception as e:
+        print(f"An error occurred while updating bucket: {e}")
+        return None
+
 import sys
 
 if __name__ == "__main__":
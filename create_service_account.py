@@ -2,11 +2,12 @@
 from google.cloud import iam_admin_v1
 from google.api_core.exceptions import AlreadyExists
 
-def create_service_account_python(project_id: str, service_account_id: str, display_name: str):
+def create_service_account_python(project_id: str, service_account_id: str,
+                                  display_name: str, client=None):
     """
     Creates a service account using the Python client library.
     """
-    client = iam_admin_v1.IAMClient()
+    client = client or iam_admin_v1.IAMClient()
     project_name = f"projects/{project_id}"
 
     # Create the ServiceAccount object with just the display name
@@ -1,27 +1,228 @@
 import functions_framework
 from dateutil.parser import parse
+import datetime
 import flask
+import functools
+import os
+import re
+import time
+
+# Vendored from the repo root by Cloud Build; see stage_timing.py
+import stage_timing
+
+# Upper bound on the number of dates accepted in one 'date_strings' request
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 10000))
+
+# Number of distinct (date string, dayfirst) results kept in memory
+PARSE_CACHE_SIZE = int(os.environ.get("PARSE_CACHE_SIZE", 4096))
+
+# How ambiguous numeric dates like 01/02/2024 are read when the request gives
+# no hint. False (month first) matches dateutil's default.
+DEFAULT_DAYFIRST = os.environ.get("DATE_PARSER_DAYFIRST", "false").lower() == "true"
+
+# Regions that write numeric dates month first; every other locale hint is
+# read day first
+MONTH_FIRST_REGIONS = {"US", "PH", "FM", "MH", "PW"}
+
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+MONTH_NAME = (
+    r"(?P<month>jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|"
+    r"july?|aug(?:ust)?|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|"
+    r"dec(?:ember)?)\.?"
+)
+DAY = r"(?P<day>\d{1,2})(?:st|nd|rd|th)?"
+YEAR = r"(?P<year>\d{4}|\d{2})"
+
+# 2024-01-31, 2024/01/31, 2024.01.31, optionally followed by a time
+ISO_DATE = re.compile(
+    r"(?P<year>\d{4})([-/.])(?P<month>\d{1,2})\2(?P<day>\d{1,2})"
+    r"(?:[T ]\d{1,2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?)?"
+)
+# 01/31/2024, 31.01.2024, 31-01-24
+NUMERIC_DATE = re.compile(r"(?P<first>\d{1,2})([-/.])(?P<second>\d{1,2})\2" + YEAR)
+# January 31, 2024 / Jan 31 2024
+MONTH_NAME_FIRST = re.compile(MONTH_NAME + r"[\s-]+" + DAY + r",?[\s-]+" + YEAR,
+                              re.IGNORECASE)
+# 31 January 2024 / 31-Jan-2024
+DAY_FIRST_MONTH_NAME = re.compile(DAY + r"[\s-]+" + MONTH_NAME + r",?[\s-]+" + YEAR,
+                                  re.IGNORECASE)
+
+
+def expand_year(year_text):
+    """Expand a two-digit year to within 50 years of today.
+
+    dateutil does the same, so both tiers agree.
+    """
+    year = int(year_text)
+    if len(year_text) > 2:
+        return year
+    this_year = datetime.date.today().year
+    year += this_year // 100 * 100
+    if year >= this_year + 50:
+        year -= 100
+    elif year < this_year - 50:
+        year += 100
+    return year
+
+
+def make_date(year, month, day):
+    """Return the date, or None if the fields do not form a valid date."""
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        return None
+
+
+def parse_iso(date_string, dayfirst):
+    """Parse 'YYYY-MM-DD'; the dayfirst hint does not apply."""
+    match = ISO_DATE.fullmatch(date_string)
+    if not match:
+        return None
+    return make_date(int(match["year"]), int(match["month"]), int(match["day"]))
+
+
+def parse_numeric(date_string, dayfirst):
+    """Parse numeric dates like 01/02/2024, 1.2.24 or 01-02-2024."""
+    match = NUMERIC_DATE.fullmatch(date_string)
+    if not match:
+        return None
+    first, second = int(match["first"]), int(match["second"])
+    month, day = (second, first) if dayfirst else (first, second)
+    # Like dateutil, a field that cannot be a month swaps the order
+    if month > 12 >= day:
+        month, day = day, month
+    return make_date(expand_year(match["year"]), month, day)
+
+
+def parse_month_name(date_string, dayfirst):
+    """Parse dates with a month name, like 'Jan 2, 2024' or '2 January 2024'."""
+    match = (MONTH_NAME_FIRST.fullmatch(date_string)
+             or DAY_FIRST_MONTH_NAME.fullmatch(date_string))
+    if not match:
+        return None
+    month = MONTHS[match["month"][:3].lower()]
+    return make_date(expand_year(match["year"]), month, int(match["day"]))
+
+
+def parse_fallback(date_string, dayfirst):
+    """Parse any other format with dateutil."""
+    try:
+        return parse(date_string, dayfirst=dayfirst).date()
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+
+# Tried in order; each returns a date, or None to pass the string on. Only
+# the last tier may reject a string outright.
+PARSER_TIERS = [
+    ("iso", parse_iso),
+    ("numeric", parse_numeric),
+    ("month_name", parse_month_name),
+    ("dateutil", parse_fallback),
+]
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_date_cached(date_string, dayfirst):
+    """Return the first tier's result as 'YYYY-MM-DD', or None."""
+    for _, parser in PARSER_TIERS:
+        parsed = parser(date_string, dayfirst)
+        if parsed is not None:
+            return parsed.strftime('%Y-%m-%d')
+    return None
+
+
+def parse_date(date_string, dayfirst=DEFAULT_DAYFIRST):
+    """Parse a date string into 'YYYY-MM-DD', or None if it is empty or invalid."""
+    if not date_string or not isinstance(date_string, str):
+        return None
+    return parse_date_cached(date_string.strip(), dayfirst)
+
+
+def resolve_dayfirst(request_json):
+    """Read the optional 'dayfirst' or 'locale' hint from a request.
+
+    Locales look like "en_GB" or "en-US". Returns (dayfirst, error).
+    """
+    if 'dayfirst' in request_json:
+        if not isinstance(request_json['dayfirst'], bool):
+            return None, "'dayfirst' must be true or false."
+        return request_json['dayfirst'], None
+
+    locale = request_json.get('locale')
+    if locale is None:
+        return DEFAULT_DAYFIRST, None
+    if not isinstance(locale, str):
+        return None, "'locale' must be a string such as 'en_US'."
+    _, _, region = locale.replace("-", "_").partition("_")
+    if not region:
+        return DEFAULT_DAYFIRST, None
+    return region.upper() not in MONTH_FIRST_REGIONS, None
 
 
 @functions_framework.http
 def date_parser_helper(request: flask.Request):
     """
     An HTTP-triggered Cloud Function to parse date strings.
+
+    Accepts either a single {"date_string": "..."} or a batch in
+    {"date_strings": [...]} / {"date_strings": {"name": "...", ...}}, and
+    returns {"parsed_date": ...} or {"parsed_dates": ...} in the same shape.
+    Ambiguous numeric dates are read using the optional "dayfirst" (bool) or
+    "locale" (e.g. "en_GB") hint. Each request emits a stage timing record.
     """
-    request_json = request.get_json(silent=True)
+    started_at = time.time()
+    response = parse_request(request.get_json(silent=True))
+    code = response[1] if isinstance(response, tuple) else 200
+    stage_timing.log_stage_timing(
+        "date_parser_helper", request.headers.get(stage_timing.TRACE_HEADER),
+        started_at, "ok" if code < 400 else "error",
+    )
+    return response
 
-    if not request_json or 'date_string' not in request_json:
+
+def parse_request(request_json):
+    """Handle a date_parser_helper request body; returns a Flask response."""
+    if not isinstance(request_json, dict) or (
+        'date_string' not in request_json and 'date_strings' not in request_json
+    ):
         return flask.jsonify(
-            {"error": "Invalid request. 'date_string' is required."}
+            {"error": "Invalid request. 'date_string' or 'date_strings' is required."}
         ), 400
 
-    date_string = request_json['date_string']
+    dayfirst, error = resolve_dayfirst(request_json)
+    if error:
+        return flask.jsonify({"error": error}), 400
 
-    if not date_string:
-        return flask.jsonify({"parsed_date": None})
+    if 'date_strings' in request_json:
+        date_strings = request_json['date_strings']
 
-    try:
-        parsed_date = parse(date_string)
-        return flask.jsonify({"parsed_date": parsed_date.strftime('%Y-%m-%d')})
-    except (ValueError, TypeError):
-        return flask.jsonify({"parsed_date": None})
+        if isinstance(date_strings, dict):
+            items = date_strings.values()
+        elif isinstance(date_strings, list):
+            items = date_strings
+        else:
+            return flask.jsonify(
+                {"error": "'date_strings' must be a list or an object."}
+            ), 400
+
+        if len(items) > MAX_BATCH_SIZE:
+            return flask.jsonify(
+                {"error": f"'date_strings' exceeds the maximum of {MAX_BATCH_SIZE}."}
+            ), 400
+
+        if isinstance(date_strings, dict):
+            parsed_dates = {
+                name: parse_date(value, dayfirst)
+                for name, value in date_strings.items()
+            }
+        else:
+            parsed_dates = [parse_date(value, dayfirst) for value in date_strings]
+        return flask.jsonify({"parsed_dates": parsed_dates})
+
+    return flask.jsonify(
+        {"parsed_date": parse_date(request_json['date_string'], dayfirst)}
+    )
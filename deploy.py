@@ -1,51 +1,441 @@
-import subprocess
+"""Provisions the invoice processing system in a single process.
+
+Each resource is a step that lists the steps it depends on. A thread pool
+starts every step as soon as its dependencies have finished. The bucket,
+BigQuery dataset, Document AI processor, service account and alert policy
+are therefore created concurrently. The IAM grants wait for the service
+account and the processor, and the Eventarc trigger waits for the bucket
+and the grants. The API clients are created once, on first use, and shared
+by all steps. The timing of every step is reported at the end. A step that
+fails causes the steps depending on it to be skipped, but its independent
+steps still run.
+
+The IDs of the provisioned resources are recorded in a local state file.
+On the next deploy, a step whose recorded resource is confirmed by a
+single get call is skipped, instead of calling its create API again and
+relying on AlreadyExists. --plan only runs these checks and prints what a
+deploy would create.
+"""
+import argparse
+import datetime
+import graphlib
+import importlib
+import json
+import os
 import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from create_alert_policy import create_workflow_failure_alert
+from create_bigquery_resources import create_bigquery_dataset_and_table
+from create_documentai_processor import create_processor
+from create_eventarc_trigger import create_eventarc_trigger
+from create_gcs_bucket import create_bucket
+from create_service_account import create_service_account_python
+from google.api_core.exceptions import NotFound
+from grant_iam_roles import (
+    TRIGGER_SA_ROLES,
+    documentai_service_agent,
+    grant_iam_roles,
+    missing_bindings,
+)
+
+BUCKET_NAME = "ai-invoice-processor-0707-invoices"
+BUCKET_LOCATION = "us-east4"
+DATASET_ID = "automation_outputs"
+TABLE_ID = "processed_invoices"
+PROCESSOR_LOCATION = "us"
+PROCESSOR_DISPLAY_NAME = "agency-invoice-parser"
+PROCESSOR_TYPE = "INVOICE_PROCESSOR"
+SERVICE_ACCOUNT_ID = "eventarc-trigger-sa"
+SERVICE_ACCOUNT_DISPLAY_NAME = "Eventarc Trigger Service Account"
+TRIGGER_LOCATION = "us-east4"
+TRIGGER_ID = "trigger-invoice-workflow-gcs"
+TRIGGER_FUNCTION = "trigger-invoice-workflow"
+TRIGGER_FUNCTION_REGION = "us-east4"
+STATE_DIR = ".deploy_state"
+
+# Client name -> (module, class, whether the constructor takes the project)
+CLIENTS = {
+    "storage": ("google.cloud.storage", "Client", True),
+    "bigquery": ("google.cloud.bigquery", "Client", True),
+    "documentai": ("google.cloud.documentai_v1", "DocumentProcessorServiceClient",
+                   False),
+    "iam": ("google.cloud.iam_admin_v1", "IAMClient", False),
+    "projects": ("google.cloud.resourcemanager_v3", "ProjectsClient", False),
+    "eventarc": ("google.cloud.eventarc_v1", "EventarcClient", False),
+    "monitoring": ("google.cloud.monitoring_v3", "AlertPolicyServiceClient", False),
+}
+
+# Step statuses that let the steps depending on them run
+SUCCEEDED = ("ok", "in_place")
+
+
+def default_client_factory(name, project_id):
+    """Build the real API client `name` for a project."""
+    module, class_name, takes_project = CLIENTS[name]
+    client_class = getattr(importlib.import_module(module), class_name)
+    return client_class(project=project_id) if takes_project else client_class()
+
+
+class Clients:
+    """The API clients of a deployment, each created on first use.
+
+    The clients are shared by all steps. `factory(name, project_id)` builds a
+    client; tests and local harnesses pass one that returns fakes.
+    """
+
+    def __init__(self, project_id, factory=default_client_factory):
+        self.project_id = project_id
+        self.factory = factory
+        self._clients = {}
+        self._locks = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """Return the client `name`, creating it on first use."""
+        with self._lock:
+            lock = self._locks[name]
+        # Per-client locks, so building one client does not hold up another
+        with lock:
+            if name not in self._clients:
+                self._clients[name] = self.factory(name, self.project_id)
+            return self._clients[name]
+
+
+class DeploymentState:
+    """The records of a project's provisioned resources, saved as JSON.
+
+    A path of None keeps them in memory only.
+    """
+
+    def __init__(self, path, project_id):
+        self.path = path
+        self.project_id = project_id
+        self.resources = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                content = json.load(f)
+            if content["project_id"] != project_id:
+                raise ValueError(f"{path} records project {content['project_id']}, "
+                                 f"not {project_id}.")
+            self.resources = content["resources"]
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """Return the record of step `name`, or None."""
+        with self._lock:
+            return self.resources.get(name)
+
+    def set(self, name, record):
+        """Record step `name`'s resource, with the time it was recorded."""
+        with self._lock:
+            self.resources[name] = dict(
+                record, updated_at=datetime.datetime.now(datetime.timezone.utc)
+                .isoformat()
+            )
+
+    def drop(self, name):
+        """Forget the record of step `name`."""
+        with self._lock:
+            self.resources.pop(name, None)
+
+    def save(self):
+        """Write the records to the state file, if there is one."""
+        if not self.path:
+            return
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump({"project_id": self.project_id,
+                           "resources": self.resources}, f, indent=2)
+            os.replace(temp_path, self.path)
+
+
+class Step:
+    """A provisioning step.
+
+    `func(clients, outputs)` receives the records of finished steps by name and
+    returns its own record, a JSON-serializable dict of resource IDs; None
+    means failure. `verify(clients, record)` checks with a cheap get call that
+    a recorded resource is still in place.
+    """
+
+    def __init__(self, name, func, depends_on=(), verify=None):
+        self.name = name
+        self.func = func
+        self.depends_on = list(depends_on)
+        self.verify = verify
+
+
+def build_steps(project_id):
+    """Return the steps that provision the system, with their dependencies."""
+    service_account_email = f"{SERVICE_ACCOUNT_ID}@{project_id}.iam.gserviceaccount.com"
+
+    def bucket(clients, outputs):
+        created = create_bucket(project_id, BUCKET_NAME, BUCKET_LOCATION,
+                                clients.get("storage"))
+        return {"bucket": created.name} if created is not None else None
+
+    def verify_bucket(clients, record):
+        return clients.get("storage").lookup_bucket(record["bucket"]) is not None
 
-def run_script(script_name, project_id):
-    """Runs a Python script with the project ID as an argument."""
+    def bigquery(clients, outputs):
+        table = create_bigquery_dataset_and_table(project_id, DATASET_ID, TABLE_ID,
+                                                  clients.get("bigquery"))
+        return {"table": table} if table is not None else None
+
+    def verify_bigquery(clients, record):
+        return clients.get("bigquery").get_table(record["table"]) is not None
+
+    def documentai_processor(clients, outputs):
+        processor = create_processor(project_id, PROCESSOR_LOCATION,
+                                     PROCESSOR_DISPLAY_NAME, PROCESSOR_TYPE,
+                                     clients.get("documentai"))
+        return {"processor": processor.name} if processor is not None else None
+
+    def verify_documentai_processor(clients, record):
+        # One get by name, instead of listing every processor in the location
+        processor = clients.get("documentai").get_processor(name=record["processor"])
+        return processor.display_name == PROCESSOR_DISPLAY_NAME
+
+    def service_account(clients, outputs):
+        email = create_service_account_python(project_id, SERVICE_ACCOUNT_ID,
+                                              SERVICE_ACCOUNT_DISPLAY_NAME,
+                                              clients.get("iam"))
+        return {"email": email} if email is not None else None
+
+    def verify_service_account(clients, record):
+        clients.get("iam").get_service_account(
+            name=f"projects/{project_id}/serviceAccounts/{record['email']}"
+        )
+        return True
+
+    def iam_roles(clients, outputs):
+        # One read-modify-write of the project policy for all bindings. The
+        # Document AI service agent reads the invoices from GCS itself.
+        projects = clients.get("projects")
+        email = outputs["service_account"]["email"]
+        bindings = [(email, role) for role in TRIGGER_SA_ROLES]
+        bindings.append((documentai_service_agent(project_id, projects),
+                         "roles/storage.objectViewer"))
+        if not grant_iam_roles(project_id, bindings, projects):
+            return None
+        return {"bindings": [list(binding) for binding in bindings]}
+
+    def verify_iam_roles(clients, record):
+        policy = clients.get("projects").get_iam_policy(
+            request={"resource": f"projects/{project_id}"}
+        )
+        return not missing_bindings(policy, [tuple(b) for b in record["bindings"]])
+
+    def eventarc_trigger(clients, outputs):
+        trigger = create_eventarc_trigger(
+            project_id, TRIGGER_LOCATION, TRIGGER_ID, TRIGGER_FUNCTION,
+            TRIGGER_FUNCTION_REGION, BUCKET_NAME, service_account_email,
+            clients.get("eventarc"),
+        )
+        return {"trigger": trigger.name} if trigger is not None else None
+
+    def verify_eventarc_trigger(clients, record):
+        return clients.get("eventarc").get_trigger(name=record["trigger"]) is not None
+
+    def alert_policy(clients, outputs):
+        policy = create_workflow_failure_alert(project_id, clients.get("monitoring"))
+        return {"alert_policy": policy.name} if policy is not None else None
+
+    def verify_alert_policy(clients, record):
+        # Creating an alert policy again would add a duplicate, not fail
+        monitoring = clients.get("monitoring")
+        return monitoring.get_alert_policy(name=record["alert_policy"]) is not None
+
+    return [
+        Step("bucket", bucket, verify=verify_bucket),
+        Step("bigquery", bigquery, verify=verify_bigquery),
+        Step("documentai_processor", documentai_processor,
+             verify=verify_documentai_processor),
+        Step("service_account", service_account, verify=verify_service_account),
+        Step("alert_policy", alert_policy, verify=verify_alert_policy),
+        Step("iam_roles", iam_roles, ["service_account", "documentai_processor"],
+             verify=verify_iam_roles),
+        Step("eventarc_trigger", eventarc_trigger, ["bucket", "iam_roles"],
+             verify=verify_eventarc_trigger),
+    ]
+
+
+def check_record(step, clients, record):
+    """Return (in_place, note) for a step's recorded resource.
+
+    A failed check is not an error: the step then runs and its create call
+    decides.
+    """
+    if record is None:
+        return False, "not recorded"
+    if step.verify is None:
+        return False, "cannot be verified"
     try:
-        subprocess.run(["python", script_name, project_id], check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error running {script_name}: {e}")
-        sys.exit(1)
-    except FileNotFoundError:
-        print(f"Error: {script_name} not found.")
-        sys.exit(1)
+        if step.verify(clients, record):
+            return True, None
+        return False, "recorded resource changed"
+    except NotFound:
+        return False, "recorded resource not found"
+    except Exception as e:
+        return False, f"verification failed: {type(e).__name__}: {e}"
 
-def main():
-    """Main function to deploy the invoice processing system."""
-    if len(sys.argv) != 2:
-        print("Usage: python deploy.py <project_id>")
-        sys.exit(1)
 
-    project_id = sys.argv[1]
+def run_steps(steps, clients, max_workers=8, state=None, plan=False):
+    """Run every step once its dependencies succeeded, up to `max_workers` at once.
+
+    A step whose record in `state` is verified is "in_place" and does not run.
+    With `plan`, steps are only verified; the others are reported as "create".
+    Returns (outputs, timings), both keyed by step name.
+    """
+    by_name = {step.name: step for step in steps}
+    for step in steps:
+        unknown = set(step.depends_on) - set(by_name)
+        if unknown:
+            raise ValueError(f"Step {step.name} depends on unknown steps: {unknown}")
+    sorter = graphlib.TopologicalSorter({step.name: step.depends_on for step in steps})
+    sorter.prepare()  # Raises graphlib.CycleError on a dependency cycle
+
+    outputs = {}
+    timings = {}
+    started_at = time.perf_counter()
+
+    def run(step):
+        start = time.perf_counter()
+        error = None
+        if state is None:
+            in_place, note = False, None
+        else:
+            in_place, note = check_record(step, clients, state.get(step.name))
+        if in_place:
+            output, status = state.get(step.name), "in_place"
+        elif plan:
+            output, status = None, "create"
+        else:
+            print(f"--- Starting {step.name}" + (f" ({note})" if note else "")
+                  + " ---")
+            try:
+                output = step.func(clients, outputs)
+            except Exception as e:
+                output, error = None, f"{type(e).__name__}: {e}"
+            status = "ok" if output is not None else "failed"
+            if state is not None:
+                if output is not None:
+                    state.set(step.name, output)
+                else:
+                    state.drop(step.name)
+        timing = {
+            "status": status,
+            "start_s": start - started_at,
+            "duration_s": time.perf_counter() - start,
+            "note": note,
+            "error": error,
+        }
+        print(f"--- {step.name} {status} in {timing['duration_s']:.2f} s ---")
+        return output, timing
 
-    # --- Resource Creation ---
-    print("--- Creating GCS Bucket ---")
-    run_script("create_gcs_bucket.py", project_id)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        running = {}
+        while sorter.is_active():
+            for name in sorter.get_ready():
+                step = by_name[name]
+                blocked = [dependency for dependency in step.depends_on
+                           if timings[dependency]["status"] not in SUCCEEDED]
+                if blocked and not plan:
+                    print(f"--- Skipping {name}: {', '.join(blocked)} did not "
+                          f"succeed ---")
+                    timings[name] = {"status": "skipped", "start_s": None,
+                                     "duration_s": 0.0, "note": None,
+                                     "error": f"Blocked by {', '.join(blocked)}"}
+                    sorter.done(name)
+                else:
+                    running[pool.submit(run, step)] = name
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                outputs[name], timings[name] = future.result()
+                sorter.done(name)
+    if state is not None and not plan:
+        state.save()
 
-    print("\n--- Creating BigQuery Resources ---")
-    run_script("create_bigquery_resources.py", project_id)
+    timings = {step.name: timings[step.name] for step in steps}
+    return outputs, timings
 
-    print("\n--- Creating Document AI Processor ---")
-    run_script("create_documentai_processor.py", project_id)
 
-    print("\n--- Creating Service Account ---")
-    run_script("create_service_account.py", project_id)
+def print_timings(timings, elapsed):
+    """Print each step's status and timing, and the total."""
+    print(f"\n{'step':<24}{'status':<10}{'start s':>9}{'duration s':>12}  note")
+    for name, timing in timings.items():
+        start = "-" if timing["start_s"] is None else f"{timing['start_s']:.2f}"
+        note = timing["note"] if timing["status"] != "in_place" else ""
+        print(f"{name:<24}{timing['status']:<10}{start:>9}"
+              f"{timing['duration_s']:>12.2f}  {note or ''}")
+    serial = sum(timing["duration_s"] for timing in timings.values())
+    print(f"\nTotal {elapsed:.2f} s for {serial:.2f} s of steps")
+    for name, timing in timings.items():
+        if timing["error"]:
+            print(f"{name}: {timing['error']}")
 
-    # --- IAM Configuration ---
-    print("\n--- Granting IAM Roles ---")
-    run_script("grant_iam_roles.py", project_id)
 
-    # --- Eventarc Trigger ---
-    print("\n--- Creating Eventarc Trigger ---")
-    run_script("create_eventarc_trigger.py", project_id)
-    
-    # --- Monitoring ---
-    print("\n--- Creating Alert Policy ---")
-    run_script("create_alert_policy.py", project_id)
+def main():
+    """Deploy the invoice processing system."""
+    parser = argparse.ArgumentParser(
+        description="Provision the invoice processing system's resources."
+    )
+    parser.add_argument("project_id")
+    parser.add_argument("--plan", action="store_true",
+                        help="Only verify the recorded resources and show what "
+                             "a deploy would create.")
+    parser.add_argument("--state", default=None,
+                        help=f"Deployment state file (default: "
+                             f"{STATE_DIR}/<project_id>.json).")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Ignore the recorded state and run every step.")
+    parser.add_argument("--max-workers", type=int, default=8,
+                        help="Steps run at once; 1 runs them one after another.")
+    parser.add_argument("--report", default=None,
+                        help="Optional path to write the step timings as JSON.")
+    args = parser.parse_args()
+
+    state_path = args.state or os.path.join(STATE_DIR, f"{args.project_id}.json")
+    try:
+        state = DeploymentState(state_path, args.project_id)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    if args.refresh:
+        state.resources = {}
 
+    start = time.perf_counter()
+    outputs, timings = run_steps(build_steps(args.project_id),
+                                 Clients(args.project_id), args.max_workers,
+                                 state=state, plan=args.plan)
+    elapsed = time.perf_counter() - start
+    print_timings(timings, elapsed)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"duration_s": elapsed, "steps": timings}, f, indent=2)
+
+    statuses = Counter(timing["status"] for timing in timings.values())
+    if args.plan:
+        print(f"\nPlan: {statuses['create']} to create, "
+              f"{statuses['in_place']} in place")
+        return
+    if outputs.get("documentai_processor") is not None:
+        print(f"Document AI processor: {outputs['documentai_processor']['processor']}")
+    print(f"State saved to {state_path}")
+    if any(status not in SUCCEEDED for status in statuses):
+        print("\n--- Deployment Incomplete ---")
+        sys.exit(1)
     print("\n--- Deployment Complete ---")
 
+
 if __name__ == "__main__":
     main()
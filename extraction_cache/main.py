@@ -0,0 +1,271 @@
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import flask
+import functions_framework
+
+# "firestore" in production; "sqlite" keeps entries in a local file
+CACHE_STORE = os.environ.get("CACHE_STORE", "firestore")
+FIRESTORE_COLLECTION = os.environ.get("FIRESTORE_COLLECTION", "extraction_cache")
+SQLITE_PATH = os.environ.get("CACHE_SQLITE_PATH", "/tmp/extraction_cache.db")
+# How long an extraction may be reused after it was stored
+CACHE_TTL_SECONDS = float(os.environ.get("CACHE_TTL_SECONDS", 30 * 24 * 3600))
+# Least recently used entries are evicted above this many entries
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 100000))
+# Counting entries is a query in Firestore, so the cap is checked every N puts
+EVICTION_CHECK_INTERVAL = int(os.environ.get("EVICTION_CHECK_INTERVAL", 100))
+
+
+class SQLiteStore:
+    """Cache entries in a SQLite database.
+
+    Used for local runs and tests; a path of ":memory:" keeps everything in
+    memory.
+    """
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, "
+                "value TEXT NOT NULL, created_at REAL NOT NULL, "
+                "expires_at REAL NOT NULL, last_used_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS cache_last_used ON cache (last_used_at)"
+            )
+
+    def get(self, key):
+        """Return the entry for key, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at, expires_at, last_used_at FROM cache "
+                "WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"value": json.loads(row[0]), "created_at": row[1],
+                "expires_at": row[2], "last_used_at": row[3]}
+
+    def put(self, key, entry):
+        """Store an entry under key."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(entry["value"]), entry["created_at"],
+                 entry["expires_at"], entry["last_used_at"]),
+            )
+
+    def touch(self, key, last_used_at):
+        """Record that key was used at last_used_at."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE cache SET last_used_at = ? WHERE key = ?", (last_used_at, key)
+            )
+
+    def delete(self, key):
+        """Delete the entry for key."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def count(self):
+        """Return the number of entries."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def evict(self, count):
+        """Delete the `count` least recently used entries."""
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache "
+                "ORDER BY last_used_at LIMIT ?)", (count,)
+            ).rowcount
+
+
+class FirestoreStore:
+    """Cache entries as Firestore documents.
+
+    Document IDs are hashes of the cache keys, which may contain '/'.
+    expires_at is stored as a timestamp, so a Firestore TTL policy on it can
+    delete expired entries too.
+    """
+
+    def __init__(self, collection, client=None):
+        from google.cloud import firestore
+
+        self.collection = (client or firestore.Client()).collection(collection)
+
+    @staticmethod
+    def _id(key):
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _timestamp(seconds):
+        return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc)
+
+    def get(self, key):
+        """Return the entry for key, or None."""
+        snapshot = self.collection.document(self._id(key)).get()
+        if not snapshot.exists:
+            return None
+        data = snapshot.to_dict()
+        return {"value": json.loads(data["value"]),
+                "created_at": data["created_at"].timestamp(),
+                "expires_at": data["expires_at"].timestamp(),
+                "last_used_at": data["last_used_at"].timestamp()}
+
+    def put(self, key, entry):
+        """Store an entry under key."""
+        self.collection.document(self._id(key)).set({
+            "value": json.dumps(entry["value"]),
+            "created_at": self._timestamp(entry["created_at"]),
+            "expires_at": self._timestamp(entry["expires_at"]),
+            "last_used_at": self._timestamp(entry["last_used_at"]),
+        })
+
+    def touch(self, key, last_used_at):
+        """Record that key was used at last_used_at."""
+        self.collection.document(self._id(key)).update(
+            {"last_used_at": self._timestamp(last_used_at)}
+        )
+
+    def delete(self, key):
+        """Delete the entry for key."""
+        self.collection.document(self._id(key)).delete()
+
+    def count(self):
+        """Return the number of entries."""
+        return int(self.collection.count().get()[0][0].value)
+
+    def evict(self, count):
+        """Delete the `count` least recently used entries."""
+        evicted = 0
+        query = self.collection.order_by("last_used_at").limit(count)
+        for snapshot in query.stream():
+            snapshot.reference.delete()
+            evicted += 1
+        return evicted
+
+
+class ExtractionCache:
+    """Document AI extractions keyed by the content hash of the source file.
+
+    Entries have a TTL and the number of entries is capped. The counters are
+    per instance; the workflow logs every lookup for fleet-wide hit rates.
+    """
+
+    def __init__(self, store, ttl_seconds=CACHE_TTL_SECONDS,
+                 max_entries=CACHE_MAX_ENTRIES,
+                 eviction_check_interval=EVICTION_CHECK_INTERVAL):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.eviction_check_interval = eviction_check_interval
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.puts = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key, or None."""
+        now = time.time()
+        entry = self.store.get(key)
+        if entry is not None and entry["expires_at"] <= now:
+            self.store.delete(key)
+            with self._lock:
+                self.expired += 1
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self.store.touch(key, now)
+        return entry["value"]
+
+    def put(self, key, value):
+        """Store value under key and evict entries above the cap."""
+        now = time.time()
+        self.store.put(key, {"value": value, "created_at": now,
+                             "expires_at": now + self.ttl_seconds,
+                             "last_used_at": now})
+        with self._lock:
+            self.puts += 1
+            check = self.puts % self.eviction_check_interval == 0
+        if check:
+            excess = self.store.count() - self.max_entries
+            if excess > 0:
+                evicted = self.store.evict(excess)
+                with self._lock:
+                    self.evictions += evicted
+
+    def stats(self):
+        """Return this instance's lookup and eviction counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "expired": self.expired,
+                "puts": self.puts,
+                "evictions": self.evictions,
+            }
+
+
+cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the instance's cache, creating it on first use."""
+    global cache
+    with _cache_lock:
+        if cache is None:
+            if CACHE_STORE == "sqlite":
+                store = SQLiteStore(SQLITE_PATH)
+            else:
+                store = FirestoreStore(FIRESTORE_COLLECTION)
+            cache = ExtractionCache(store)
+    return cache
+
+
+@functions_framework.http
+def extraction_cache(request: flask.Request):
+    """HTTP Cloud Function that caches Document AI extractions by content hash.
+
+    POST {"action": "get", "key": "..."} returns {"hit": bool, "value": ...};
+    POST {"action": "put", "key": "...", "value": {...}} stores a value.
+    GET /stats returns this instance's hit rate and eviction counters.
+    """
+    if request.method == "GET" and request.path.rstrip("/").endswith("/stats"):
+        return flask.jsonify(get_cache().stats())
+
+    request_json = request.get_json(silent=True)
+    if not isinstance(request_json, dict) or not isinstance(
+        request_json.get("key"), str
+    ) or not request_json["key"]:
+        return flask.jsonify({"error": "Invalid request. 'key' is required."}), 400
+
+    action = request_json.get("action")
+    try:
+        if action == "get":
+            value = get_cache().get(request_json["key"])
+            return flask.jsonify({"hit": value is not None, "value": value}), 200
+        if action == "put":
+            if not isinstance(request_json.get("value"), dict):
+                return flask.jsonify({"error": "'value' must be an object."}), 400
+            get_cache().put(request_json["key"], request_json["value"])
+            return flask.jsonify({"status": "success"}), 200
+    except Exception as e:
+        return flask.jsonify({"error": f"Cache {action} failed: {e}"}), 500
+
+    return flask.jsonify({"error": "'action' must be 'get' or 'put'."}), 400
@@ -1,19 +1,35 @@
 from google.cloud import resourcemanager_v3
-from google.cloud.resourcemanager_v3.types import SetIamPolicyRequest
+from google.iam.v1.iam_policy_pb2 import GetIamPolicyRequest, SetIamPolicyRequest
 from google.iam.v1 import policy_pb2
 from google.api_core.exceptions import NotFound
 
-def grant_iam_role_python(project_id: str, service_account_email: str, role: str):
+# Roles of the service account the Eventarc trigger runs as
+TRIGGER_SA_ROLES = [
+    "roles/run.invoker",
+    "roles/eventarc.publisher",
+    "roles/workflowexecutions.editor",
+    "roles/storage.objectViewer",
+    "roles/documentai.viewer",
+    "roles/documentai.editor",
+    "roles/bigquery.dataEditor",
+    "roles/bigquery.jobUser",
+    "roles/datastore.user"
+]
+
+def grant_iam_role_python(project_id: str, service_account_email: str, role: str,
+                          client=None):
     """
     Grants an IAM role to a service account using the Python client library.
     """
-    resource_manager_client = resourcemanager_v3.ProjectsClient()
+    resource_manager_client = client or resourcemanager_v3.ProjectsClient()
     
     project_name = f"projects/{project_id}"
 
     try:
         # Get the current IAM policy
-        policy = resource_manager_client.get_iam_policy(request=resourcemanager_v3.GetIamPolicyRequest(resource=project_name))
+        policy = resource_manager_client.get_iam_policy(
+            request=GetIamPolicyRequest(resource=project_name)
+        )
 
         # Check if the binding already exists
         binding_exists = False
@@ -39,6 +55,59 @@ def grant_iam_role_python(project_id: str, service_account_email: str, role: str
     except Exception as e:
         print(f"An error occurred while granting role {role}: {e}")
 
+def missing_bindings(policy, bindings):
+    """Return the (service_account_email, role) bindings not in `policy`."""
+    granted = {(member, binding.role)
+               for binding in policy.bindings for member in binding.members}
+    return [(service_account_email, role) for service_account_email, role in bindings
+            if (f"serviceAccount:{service_account_email}", role) not in granted]
+
+def grant_iam_roles(project_id: str, bindings, client=None):
+    """Grant several (service_account_email, role) bindings at once.
+
+    The project's IAM policy is read and written a single time. Concurrent
+    writes of the policy would overwrite each other, so grants are batched
+    rather than run in parallel. Returns whether all bindings are in place.
+    """
+    resource_manager_client = client or resourcemanager_v3.ProjectsClient()
+    project_name = f"projects/{project_id}"
+
+    try:
+        policy = resource_manager_client.get_iam_policy(
+            request=GetIamPolicyRequest(resource=project_name)
+        )
+        missing = missing_bindings(policy, bindings)
+        for service_account_email, role in bindings:
+            if (service_account_email, role) not in missing:
+                print(f"Role {role} already granted to {service_account_email}.")
+
+        if not missing:
+            return True
+        for service_account_email, role in missing:
+            policy.bindings.append(policy_pb2.Binding(
+                role=role, members=[f"serviceAccount:{service_account_email}"]
+            ))
+        # The policy's etag makes this fail if the policy changed since it was read
+        resource_manager_client.set_iam_policy(
+            request=SetIamPolicyRequest(resource=project_name, policy=policy)
+        )
+        for service_account_email, role in missing:
+            print(f"Role {role} granted to {service_account_email}.")
+        return True
+    except NotFound:
+        print(f"Project {project_id} not found.")
+        return False
+    except Exception as e:
+        print(f"An error occurred while granting roles: {e}")
+        return False
+
+def documentai_service_agent(project_id: str, client=None):
+    """Return the email of the project's Document AI service agent."""
+    client = client or resourcemanager_v3.ProjectsClient()
+    project = client.get_project(name=f"projects/{project_id}")
+    project_number = project.name.split("/")[-1]
+    return f"service-{project_number}@gcp-sa-prod-dai-core.iam.gserviceaccount.com"
+
 import sys
 
 if __name__ == "__main__":
@@ -48,16 +117,12 @@ if __name__ == "__main__":
 
     project_id = sys.argv[1]
     service_account_email = f"eventarc-trigger-sa@{project_id}.iam.gserviceaccount.com"
+    client = resourcemanager_v3.ProjectsClient()
 
-    roles_to_grant = [
-        "roles/run.invoker",
-        "roles/eventarc.publisher",
-        "roles/workflowexecutions.editor",
-        "roles/storage.objectViewer",
-        "roles/documentai.viewer",
-        "roles/documentai.editor",
-        "roles/bigquery.dataEditor"
-    ]
-
-    for role in roles_to_grant:
-        grant_iam_role_python(project_id, service_account_email, role)
+    # The workflow passes Document AI a GCS reference to each invoice, so the
+    # Document AI service agent reads the object itself
+    bindings = [(service_account_email, role) for role in TRIGGER_SA_ROLES]
+    bindings.append(
+        (documentai_service_agent(project_id, client), "roles/storage.objectViewer")
+    )
+    grant_iam_roles(project_id, bindings, client)
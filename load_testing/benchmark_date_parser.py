@@ -0,0 +1,215 @@
+"""Microbenchmark for date_parser_helper's tiered parser.
+
+Builds a corpus of date strings in the formats invoices actually use, then
+reports parses per second for each tier, for the tiered parser with and
+without its cache, and for plain dateutil as the baseline. It also lists
+the strings where the tiered parser and dateutil disagree. With --dayfirst
+dateutil reads ISO dates as year-day-month; the iso tier deliberately
+does not, so those show up as disagreements.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import time
+
+import benchmark_results
+from benchmark_results import metric
+from workflow_runner import load_function_module
+
+# (strftime format, share of corpus). Repeats of the same invoice dates are
+# common, so strings are drawn from a limited pool of dates.
+CORPUS_FORMATS = [
+    ("%Y-%m-%d", 0.35),
+    ("%Y-%m-%dT%H:%M:%SZ", 0.05),
+    ("%m/%d/%Y", 0.2),
+    ("%d/%m/%Y", 0.05),
+    ("%d.%m.%Y", 0.05),
+    ("%B %d, %Y", 0.1),
+    ("%b %d %Y", 0.05),
+    ("%d %b %Y", 0.05),
+    ("%d-%b-%y", 0.03),
+    ("%A, %B %d, %Y", 0.03),
+    ("%Y%m%d", 0.02),
+]
+UNPARSEABLE = ["Due on receipt", "Net 30", "N/A", "see attached"]
+UNPARSEABLE_SHARE = 0.02
+
+
+def build_corpus(count, distinct_dates, seed):
+    """Return a list of date strings drawn from a pool of recent dates."""
+    rng = random.Random(seed)
+    today = datetime.date(2025, 7, 1)
+    dates = [
+        today - datetime.timedelta(days=rng.randint(0, 730))
+        for _ in range(distinct_dates)
+    ]
+    formats = [fmt for fmt, _ in CORPUS_FORMATS]
+    weights = [share for _, share in CORPUS_FORMATS]
+
+    corpus = []
+    for _ in range(count):
+        if rng.random() < UNPARSEABLE_SHARE:
+            corpus.append(rng.choice(UNPARSEABLE))
+            continue
+        fmt = rng.choices(formats, weights=weights)[0]
+        corpus.append(rng.choice(dates).strftime(fmt))
+    return corpus
+
+
+def first_tier(parser, date_string, dayfirst):
+    """Return the name of the tier that resolves a string."""
+    for name, tier in parser.PARSER_TIERS:
+        if tier(date_string, dayfirst) is not None:
+            return name
+    return parser.PARSER_TIERS[-1][0]
+
+
+def measure(func, strings, dayfirst, min_seconds):
+    """Call func over strings until min_seconds pass; return parses/s."""
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        for date_string in strings:
+            func(date_string, dayfirst)
+        calls += len(strings)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return calls / elapsed
+
+
+def run(args):
+    """Benchmark each tier and the whole parser; return the report."""
+    parser = load_function_module("date_parser_helper/main.py", "bench_date_parser")
+    corpus = build_corpus(args.count, args.distinct_dates, args.seed)
+    dayfirst = args.dayfirst
+    uncached = parser.parse_date_cached.__wrapped__
+
+    def format_date(parsed):
+        return parsed.strftime("%Y-%m-%d") if parsed else None
+
+    def dateutil_only(date_string, dayfirst):
+        return format_date(parser.parse_fallback(date_string, dayfirst))
+
+    mismatches = []
+    for date_string in sorted(set(corpus)):
+        tiered = uncached(date_string, dayfirst)
+        expected = dateutil_only(date_string, dayfirst)
+        if tiered != expected:
+            mismatches.append({
+                "input": date_string,
+                "tier": first_tier(parser, date_string, dayfirst),
+                "tiered": tiered,
+                "dateutil": expected,
+            })
+
+    by_tier = {name: [] for name, _ in parser.PARSER_TIERS}
+    for date_string in corpus:
+        by_tier[first_tier(parser, date_string, dayfirst)].append(date_string)
+
+    tiers = {}
+    for name, tier in parser.PARSER_TIERS:
+        strings = by_tier[name]
+        if not strings:
+            continue
+        tiers[name] = {
+            "share": len(strings) / len(corpus),
+            "parses_per_second": measure(tier, strings, dayfirst, args.min_seconds),
+            "dateutil_parses_per_second": measure(
+                parser.parse_fallback, strings, dayfirst, args.min_seconds
+            ),
+        }
+
+    # Hit rate of a single pass over the corpus, starting from an empty cache
+    parser.parse_date_cached.cache_clear()
+    for date_string in corpus:
+        parser.parse_date_cached(date_string, dayfirst)
+    cache_info = parser.parse_date_cached.cache_info()
+    cached = measure(parser.parse_date_cached, corpus, dayfirst, args.min_seconds)
+
+    return {
+        "config": {
+            "count": args.count,
+            "distinct_strings": len(set(corpus)),
+            "dayfirst": dayfirst,
+            "cache_size": parser.PARSE_CACHE_SIZE,
+        },
+        "tiers": tiers,
+        "overall": {
+            "dateutil_only": measure(dateutil_only, corpus, dayfirst, args.min_seconds),
+            "tiered": measure(uncached, corpus, dayfirst, args.min_seconds),
+            "tiered_cached": cached,
+            "cache_hit_rate": cache_info.hits / (cache_info.hits + cache_info.misses),
+        },
+        "mismatches": mismatches,
+    }
+
+
+def key_metrics(report):
+    """Return the metrics compared between saved runs."""
+    overall = report["overall"]
+    metrics = {
+        f"{name}_parses_per_s": metric(overall[name], "per_s", "higher")
+        for name in ("tiered", "tiered_cached", "dateutil_only")
+    }
+    for name, tier in report["tiers"].items():
+        metrics[f"tier_{name}_parses_per_s"] = metric(
+            tier["parses_per_second"], "per_s", "higher"
+        )
+    metrics["mismatches"] = metric(len(report["mismatches"]), "count")
+    return metrics
+
+
+def print_report(report):
+    """Print the per-tier table, the overall rates and any disagreements."""
+    config = report["config"]
+    print(f"Corpus: {config['count']} strings, {config['distinct_strings']} distinct, "
+          f"dayfirst={config['dayfirst']}")
+    print(f"\n{'tier':<12} {'share':>7} {'parses/s':>12} {'dateutil/s':>12} "
+          f"{'speedup':>8}")
+    for name, tier in report["tiers"].items():
+        speedup = tier["parses_per_second"] / tier["dateutil_parses_per_second"]
+        print(f"{name:<12} {tier['share']:>7.1%} {tier['parses_per_second']:>12,.0f} "
+              f"{tier['dateutil_parses_per_second']:>12,.0f} {speedup:>7.1f}x")
+
+    overall = report["overall"]
+    print(f"\ndateutil only:   {overall['dateutil_only']:>12,.0f} parses/s")
+    print(f"tiered:          {overall['tiered']:>12,.0f} parses/s")
+    print(f"tiered + cache:  {overall['tiered_cached']:>12,.0f} parses/s "
+          f"(hit rate {overall['cache_hit_rate']:.1%})")
+
+    mismatches = report["mismatches"]
+    print(f"\nDisagreements with dateutil: {len(mismatches)}")
+    for mismatch in mismatches[:10]:
+        print(f"  {mismatch['input']!r} ({mismatch['tier']}): "
+              f"tiered={mismatch['tiered']} "
+              f"dateutil={mismatch['dateutil']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark date_parser_helper's parser tiers."
+    )
+    parser.add_argument("--count", type=int, default=100000,
+                        help="Number of date strings in the corpus.")
+    parser.add_argument("--distinct-dates", type=int, default=2000,
+                        help="Size of the pool of dates the strings are drawn from.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dayfirst", action="store_true",
+                        help="Read ambiguous numeric dates day first.")
+    parser.add_argument("--min-seconds", type=float, default=1.0,
+                        help="Minimum time to measure each configuration.")
+    parser.add_argument("--report", default=None,
+                        help="Optional path to write the results as JSON.")
+    benchmark_results.add_arguments(parser)
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+    benchmark_results.save_from_args(args, "benchmark_date_parser", report,
+                                     key_metrics(report))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {os.path.abspath(args.report)}")
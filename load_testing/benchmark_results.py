@@ -0,0 +1,347 @@
+"""Stores benchmark results and compares runs for regressions.
+
+Every benchmark in this directory saves its report after a run as
+results/<benchmark>/<run_id>.json. The file records the configuration, the
+git commit and a small set of key metrics. Each metric has a unit and a
+direction, so a comparison does not need the benchmark's code. Runs stay
+local; results/ is ignored by git. `baseline` copies a run to
+baselines/<benchmark>.json, which is meant to be committed.
+
+    python benchmark_results.py list workflow_runner
+    python benchmark_results.py compare workflow_runner:baseline workflow_runner
+    python benchmark_results.py baseline workflow_runner
+
+A run is referenced by the path of its JSON file, or as
+<benchmark>[:latest|:previous|:baseline|:<run_id prefix>]. compare exits
+with status 1 when a metric is worse than the baseline by more than its
+tolerance. Tolerances are relative for times and throughputs, and absolute
+for ratios such as error rates and for counts such as missing rows.
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+LOAD_TESTING_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(LOAD_TESTING_DIR, "results")
+BASELINES_DIR = os.path.join(LOAD_TESTING_DIR, "baselines")
+
+# Units whose tolerance is absolute rather than relative to the baseline
+ABSOLUTE_UNITS = ("ratio", "count")
+
+
+def metric(value, unit, better="lower"):
+    """Return a key metric of a run; `better` is "lower" or "higher"."""
+    return {"value": value, "unit": unit, "better": better}
+
+
+def git_info():
+    """Return the commit, branch and dirty state of the working tree, if in git."""
+
+    def git(*args):
+        result = subprocess.run(
+            ["git", *args], cwd=LOAD_TESTING_DIR, capture_output=True, text=True
+        )
+        return result.stdout.strip() if result.returncode == 0 else None
+
+    sha = git("rev-parse", "HEAD")
+    if sha is None:
+        return {"sha": None, "branch": None, "dirty": None}
+    return {
+        "sha": sha,
+        "branch": git("rev-parse", "--abbrev-ref", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+    }
+
+
+def add_arguments(parser):
+    """Add the options that control saving results to a benchmark's parser."""
+    parser.add_argument("--results-dir", default=RESULTS_DIR,
+                        help="Directory the run's results are saved under.")
+    parser.add_argument("--no-save-results", dest="save_results",
+                        action="store_false",
+                        help="Do not save the run's results.")
+
+
+def save_result(benchmark, config, metrics, report, results_dir=RESULTS_DIR):
+    """Save a run and return the path of its results file."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    git = git_info()
+    run_id = f"{now:%Y%m%dT%H%M%S%fZ}_{(git['sha'] or 'nogit')[:8]}"
+    directory = os.path.join(results_dir, benchmark)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{run_id}.json")
+    with open(path, "w") as f:
+        json.dump({
+            "benchmark": benchmark,
+            "run_id": run_id,
+            "created_at": now.isoformat(),
+            "git": git,
+            "config": config,
+            "metrics": metrics,
+            "report": report,
+        }, f, indent=2, default=str)
+    return path
+
+
+def save_from_args(args, benchmark, report, metrics):
+    """Save a run unless --no-save-results was given, and print where.
+
+    The config is the report's, or else the arguments without output paths and
+    secrets.
+    """
+    if not args.save_results:
+        return None
+    config = report.get("config") if isinstance(report, dict) else None
+    if config is None:
+        config = {k: v for k, v in vars(args).items()
+                  if k not in ("report", "output", "results_dir", "save_results",
+                               "token")}
+    path = save_result(benchmark, config, metrics, report, args.results_dir)
+    print(f"Results saved to {os.path.relpath(path)}")
+    return path
+
+
+def list_runs(benchmark, results_dir=RESULTS_DIR):
+    """Return the paths of a benchmark's saved runs, oldest first."""
+    return sorted(glob.glob(os.path.join(results_dir, benchmark, "*.json")))
+
+
+def resolve(ref, results_dir=RESULTS_DIR, baselines_dir=BASELINES_DIR):
+    """Return the results file path a run reference points to."""
+    if os.path.isfile(ref):
+        return ref
+    benchmark, _, which = ref.partition(":")
+    which = which or "latest"
+    if which == "baseline":
+        path = os.path.join(baselines_dir, f"{benchmark}.json")
+        if not os.path.isfile(path):
+            raise ValueError(f"No baseline for {benchmark}: {path} does not exist.")
+        return path
+
+    runs = list_runs(benchmark, results_dir)
+    if which in ("latest", "previous"):
+        index = -1 if which == "latest" else -2
+        if len(runs) < -index:
+            raise ValueError(f"{benchmark} has {len(runs)} saved runs; "
+                             f"no {which} run.")
+        return runs[index]
+    matches = [path for path in runs if os.path.basename(path).startswith(which)]
+    if len(matches) != 1:
+        raise ValueError(f"{len(matches)} runs of {benchmark} match {which!r}.")
+    return matches[0]
+
+
+def load(ref, results_dir=RESULTS_DIR, baselines_dir=BASELINES_DIR):
+    """Load the saved run a reference points to."""
+    with open(resolve(ref, results_dir, baselines_dir)) as f:
+        return json.load(f)
+
+
+def config_differences(base, candidate):
+    """Return the config keys whose values differ between two runs."""
+    keys = sorted(set(base["config"]) | set(candidate["config"]))
+    return {key: (base["config"].get(key), candidate["config"].get(key))
+            for key in keys
+            if base["config"].get(key) != candidate["config"].get(key)}
+
+
+def compare(base, candidate, tolerance=0.1, rate_tolerance=0.01,
+            count_tolerance=0, metric_tolerances=None, only=None):
+    """Compare the key metrics of two runs.
+
+    Returns one row per metric with its status: "ok", "improved",
+    "regressed", or "missing" when only one run has it.
+    """
+    metric_tolerances = metric_tolerances or {}
+    rows = []
+    for name in sorted(set(base["metrics"]) | set(candidate["metrics"])):
+        if only and name not in only:
+            continue
+        old = base["metrics"].get(name)
+        new = candidate["metrics"].get(name)
+        spec = new or old
+        absolute = spec["unit"] in ABSOLUTE_UNITS
+        allowed = metric_tolerances.get(name, {
+            "ratio": rate_tolerance, "count": count_tolerance,
+        }.get(spec["unit"], tolerance))
+        row = {"metric": name, "unit": spec["unit"], "better": spec["better"],
+               "base": old and old["value"], "candidate": new and new["value"],
+               "change": None, "tolerance": allowed, "absolute": absolute}
+        if row["base"] is None or row["candidate"] is None:
+            row["status"] = "missing"
+            rows.append(row)
+            continue
+
+        delta = row["candidate"] - row["base"]
+        if absolute:
+            row["change"] = delta
+        elif row["base"]:
+            row["change"] = delta / abs(row["base"])
+        else:
+            row["change"] = 0.0 if not delta else float("inf") * delta
+        # Positive when the candidate is worse
+        worse = row["change"] if spec["better"] == "lower" else -row["change"]
+        if worse > allowed:
+            row["status"] = "regressed"
+        elif worse < -allowed:
+            row["status"] = "improved"
+        else:
+            row["status"] = "ok"
+        rows.append(row)
+    return rows
+
+
+def format_value(value, unit):
+    """Format a metric value for its unit."""
+    if value is None:
+        return "-"
+    if unit == "ratio":
+        return f"{value:.2%}"
+    if unit == "count":
+        return f"{value:,.0f}"
+    return f"{value:,.2f}"
+
+
+def format_change(row):
+    """Format a comparison row's change, in points or percent."""
+    if row["change"] is None:
+        return "-"
+    if row["absolute"]:
+        if row["unit"] == "ratio":
+            return f"{row['change'] * 100:+.2f} pt"
+        return f"{row['change']:+,.0f}"
+    return f"{row['change']:+.1%}"
+
+
+def describe(result):
+    """Return a one-line label for a saved run."""
+    git = result["git"]
+    sha = (git["sha"] or "no git")[:12] + (" (dirty)" if git["dirty"] else "")
+    return f"{result['benchmark']} {result['run_id']}  {sha}"
+
+
+def print_comparison(base, candidate, rows, differences):
+    """Print a comparison table and the regressed metrics."""
+    print(f"Base:      {describe(base)}")
+    print(f"Candidate: {describe(candidate)}")
+    if differences:
+        print("\nWarning: the runs' configurations differ:")
+        for key, (old, new) in differences.items():
+            print(f"  {key}: {old!r} -> {new!r}")
+    print(f"\n{'metric':<36}{'base':>14}{'candidate':>14}{'change':>11}"
+          f"{'tolerance':>11}  status")
+    for row in rows:
+        if row["absolute"] and row["unit"] == "ratio":
+            allowed = f"{row['tolerance'] * 100:.2f} pt"
+        elif row["absolute"]:
+            allowed = f"{row['tolerance']:,.0f}"
+        else:
+            allowed = f"{row['tolerance']:.0%}"
+        print(f"{row['metric']:<36}{format_value(row['base'], row['unit']):>14}"
+              f"{format_value(row['candidate'], row['unit']):>14}"
+              f"{format_change(row):>11}{allowed:>11}  {row['status'].upper()}")
+    regressed = [row["metric"] for row in rows if row["status"] == "regressed"]
+    print(f"\n{len(regressed)} regressions" + (f": {', '.join(regressed)}"
+                                                if regressed else ""))
+
+
+def parse_metric_tolerances(values):
+    """Parse METRIC=TOLERANCE arguments into a dict."""
+    tolerances = {}
+    for value in values:
+        name, separator, allowed = value.partition("=")
+        if not separator:
+            raise argparse.ArgumentTypeError(f"Expected METRIC=TOLERANCE: {value}")
+        tolerances[name] = float(allowed)
+    return tolerances
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="List, compare and baseline saved benchmark results."
+    )
+    parser.add_argument("--results-dir", default=RESULTS_DIR)
+    parser.add_argument("--baselines-dir", default=BASELINES_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = commands.add_parser("list", help="List a benchmark's runs.")
+    list_parser.add_argument("benchmark")
+
+    compare_parser = commands.add_parser(
+        "compare", help="Compare a run against a baseline or an earlier run."
+    )
+    compare_parser.add_argument("base", help="Run to compare against.")
+    compare_parser.add_argument("candidate", nargs="?", default=None,
+                                help="Run to check (default: the base "
+                                     "benchmark's latest run).")
+    compare_parser.add_argument("--tolerance", type=float, default=0.1,
+                                help="Allowed relative change of times and "
+                                     "throughputs.")
+    compare_parser.add_argument("--rate-tolerance", type=float, default=0.01,
+                                help="Allowed absolute change of ratios such as "
+                                     "error rates.")
+    compare_parser.add_argument("--count-tolerance", type=float, default=0,
+                                help="Allowed absolute change of counts such as "
+                                     "missing rows.")
+    compare_parser.add_argument("--metric-tolerance", action="append", default=[],
+                                metavar="METRIC=TOLERANCE",
+                                help="Tolerance of one metric; may be repeated.")
+    compare_parser.add_argument("--metric", action="append", default=[],
+                                help="Only compare this metric; may be repeated.")
+    compare_parser.add_argument("--fail-on-missing", action="store_true",
+                                help="Also fail when a metric is in only one run.")
+    compare_parser.add_argument("--report", default=None,
+                                help="Optional path to write the comparison as "
+                                     "JSON.")
+
+    baseline_parser = commands.add_parser(
+        "baseline", help="Copy a run to baselines/<benchmark>.json."
+    )
+    baseline_parser.add_argument("run", help="Run to use (e.g. workflow_runner).")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "list":
+            for path in list_runs(args.benchmark, args.results_dir):
+                with open(path) as f:
+                    result = json.load(f)
+                print(describe(result))
+        elif args.command == "baseline":
+            source = resolve(args.run, args.results_dir, args.baselines_dir)
+            with open(source) as f:
+                benchmark = json.load(f)["benchmark"]
+            os.makedirs(args.baselines_dir, exist_ok=True)
+            target = os.path.join(args.baselines_dir, f"{benchmark}.json")
+            shutil.copyfile(source, target)
+            print(f"Baseline for {benchmark} set to {os.path.relpath(target)}")
+        else:
+            base = load(args.base, args.results_dir, args.baselines_dir)
+            candidate = load(args.candidate or base["benchmark"],
+                             args.results_dir, args.baselines_dir)
+            rows = compare(
+                base, candidate, tolerance=args.tolerance,
+                rate_tolerance=args.rate_tolerance,
+                count_tolerance=args.count_tolerance,
+                metric_tolerances=parse_metric_tolerances(args.metric_tolerance),
+                only=set(args.metric),
+            )
+            differences = config_differences(base, candidate)
+            print_comparison(base, candidate, rows, differences)
+            if args.report:
+                with open(args.report, "w") as f:
+                    json.dump({"base": base["run_id"],
+                               "candidate": candidate["run_id"],
+                               "config_differences": differences,
+                               "metrics": rows}, f, indent=2)
+            failing = {"regressed", "missing"} if args.fail_on_missing else {
+                "regressed"
+            }
+            sys.exit(1 if any(row["status"] in failing for row in rows) else 0)
+    except (ValueError, argparse.ArgumentTypeError) as e:
+        print(f"Error: {e}")
+        sys.exit(2)
@@ -0,0 +1,171 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+import benchmark_results
+import httpx
+from benchmark_results import metric
+
+BACKEND_API_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "backend_api"
+)
+
+
+class FakeBlob:
+    """A blob whose signing blocks the calling thread, like real RSA signing."""
+
+    def __init__(self, name, sign_delay):
+        self.name = name
+        self.sign_delay = sign_delay
+
+    def generate_signed_url(self, **kwargs):
+        """Return a fake URL after blocking for `sign_delay` seconds."""
+        time.sleep(self.sign_delay)
+        return f"https://storage.example.com/{self.name}?X-Goog-Signature=fake"
+
+
+class FakeBucket:
+    """A bucket whose blobs sign slowly."""
+
+    def __init__(self, sign_delay):
+        self.sign_delay = sign_delay
+
+    def blob(self, name):
+        """Return a FakeBlob for `name`."""
+        return FakeBlob(name, self.sign_delay)
+
+
+class FakeStorageClient:
+    """A Storage client whose blobs sign slowly."""
+
+    def __init__(self, sign_delay):
+        self.sign_delay = sign_delay
+
+    def bucket(self, name):
+        """Return a FakeBucket; the name is ignored."""
+        return FakeBucket(self.sign_delay)
+
+
+def load_app(sign_delay, storage_client=None):
+    """Import backend_api/main.py with a fake Storage client and no authentication."""
+    sys.path.insert(0, BACKEND_API_DIR)
+    import main
+
+    # Per-request INFO logging would dominate the measurement
+    logging.disable(logging.INFO)
+    main.storage_client = storage_client or FakeStorageClient(sign_delay)
+    main.app.dependency_overrides[main.get_current_user] = lambda: {
+        "uid": "benchmark"
+    }
+    return main
+
+
+async def run_inline(func, *args, **kwargs):
+    """Run blocking work directly on the event loop, as the API used to."""
+    return func(*args, **kwargs)
+
+
+def percentile(latencies, pct):
+    """Return the `pct` percentile of `latencies` (nearest rank)."""
+    ordered = sorted(latencies)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def measure(app, concurrency, rounds):
+    """Send `rounds` waves of `concurrency` simultaneous requests."""
+    transport = httpx.ASGITransport(app=app)
+    latencies = []
+
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://benchmark"
+    ) as client:
+        async def one_request(i):
+            start = time.perf_counter()
+            response = await client.post(
+                "/generate-signed-url/",
+                params={
+                    "file_name": f"invoice_{i}.pdf",
+                    "content_type": "application/pdf",
+                },
+            )
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+        for _ in range(rounds):
+            await asyncio.gather(*(one_request(i) for i in range(concurrency)))
+
+    return latencies
+
+
+def key_metrics(report):
+    """Return the metrics compared between saved runs, per mode and concurrency."""
+    metrics = {}
+    for result in report["results"]:
+        prefix = f"{result['mode']}_c{result['concurrency']}"
+        metrics[f"{prefix}_p50_ms"] = metric(result["p50_ms"], "ms")
+        metrics[f"{prefix}_p99_ms"] = metric(result["p99_ms"], "ms")
+    return metrics
+
+
+def main_cli(concurrency_levels, rounds, sign_delay, output):
+    """Benchmark signing latency with blocking work on and off the event loop.
+
+    Returns the results.
+    """
+    main = load_app(sign_delay)
+    offloaded = main.run_blocking
+    results = []
+
+    for mode, runner in (("before", run_inline), ("after", offloaded)):
+        main.run_blocking = runner
+        for concurrency in concurrency_levels:
+            latencies = asyncio.run(measure(main.app, concurrency, rounds))
+            result = {
+                "mode": mode,
+                "concurrency": concurrency,
+                "requests": len(latencies),
+                "p50_ms": percentile(latencies, 50) * 1000,
+                "p99_ms": percentile(latencies, 99) * 1000,
+                "mean_ms": statistics.mean(latencies) * 1000,
+            }
+            results.append(result)
+            print(
+                f"{mode:>6}  concurrency={concurrency:<4}  "
+                f"p50={result['p50_ms']:8.2f} ms  p99={result['p99_ms']:8.2f} ms"
+            )
+
+    main.run_blocking = offloaded
+    main.blocking_executor.shutdown(wait=True)
+
+    report = {"sign_delay_s": sign_delay, "rounds": rounds, "results": results}
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {output}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark signed-URL latency with a fake, blocking signer."
+    )
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 50, 500],
+                        help="Concurrency levels to measure.")
+    parser.add_argument("--rounds", type=int, default=3,
+                        help="Waves of concurrent requests per level.")
+    parser.add_argument("--sign-delay", type=float, default=0.005,
+                        help="Seconds the fake signer blocks per URL.")
+    parser.add_argument("--output", default=None,
+                        help="Optional path for a JSON copy of the results.")
+    benchmark_results.add_arguments(parser)
+    args = parser.parse_args()
+
+    report = main_cli(args.concurrency, args.rounds, args.sign_delay, args.output)
+    benchmark_results.save_from_args(args, "benchmark_signing", report,
+                                     key_metrics(report))
@@ -0,0 +1,102 @@
+"""Compares per-invoice workflow latency for the two Document AI input modes.
+
+Document AI either gets the document inline (downloaded into the execution and
+base64-encoded) or as a GCS reference it reads itself. Each document size is
+run through the local workflow executor once per mode, and the report shows
+execution latency percentiles, the time spent in the download and processing
+steps, and how many executions failed (inline documents above the workflow
+variable limit cannot be processed). Transfer rates are simulated; to measure a
+deployment, run run_pipeline_benchmark.py against it once with the workflow's
+DOC_AI_INPUT_MODE set to "gcs" and once with "inline".
+"""
+import json
+import os
+import sys
+
+import benchmark_results
+from benchmark_results import metric
+from workflow_runner import build_parser, run
+
+MODES = ["inline", "gcs"]
+DOCUMENT_STEPS = ["read_gcs_file", "process_document_inline", "process_document"]
+
+
+def compare(args):
+    """Run every document size through the workflow once per input mode."""
+    results = []
+    for size_kb in args.sizes_kb:
+        for mode in MODES:
+            run_args = build_parser().parse_args([
+                "--events", str(args.events),
+                "--concurrency", str(args.concurrency),
+                "--document-bytes", str(size_kb * 1024),
+                "--doc-ai-input-mode", mode,
+                "--workflow-transfer-rate", str(args.workflow_transfer_rate),
+                "--gcs-read-rate", str(args.gcs_read_rate),
+                "--bigquery-latency", "0.2",
+                "--writer-batch-delay", "0.1",
+                "--duplicate-rate", "0",
+            ])
+            report = run(run_args)
+            steps = report["steps"]
+            results.append({
+                "size_kb": size_kb,
+                "mode": mode,
+                "rows_inserted": report["rows_inserted"],
+                "dlq_entries": report["dlq_entries"],
+                "execution_latency_ms": report["execution_latency_ms"],
+                "document_steps_p50_ms": sum(
+                    steps[name]["p50_ms"] for name in DOCUMENT_STEPS if name in steps
+                ),
+            })
+    return results
+
+
+def key_metrics(results):
+    """Return the metrics compared between saved runs, per size and mode."""
+    metrics = {}
+    for result in results:
+        prefix = f"{result['mode']}_{result['size_kb']}kb"
+        latency = result["execution_latency_ms"]
+        metrics[f"{prefix}_p50_ms"] = metric(latency["p50"], "ms")
+        metrics[f"{prefix}_p95_ms"] = metric(latency["p95"], "ms")
+        metrics[f"{prefix}_dlq_entries"] = metric(result["dlq_entries"], "count")
+    return metrics
+
+
+def print_comparison(results):
+    """Print one row of latency figures per document size and mode."""
+    print(f"\n{'size':>8} {'mode':<8}{'rows':>6}{'dlq':>6}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'doc steps p50 ms':>18}")
+    for result in results:
+        latency = result["execution_latency_ms"]
+        print(f"{result['size_kb']:>6}KB {result['mode']:<8}"
+              f"{result['rows_inserted']:>6}{result['dlq_entries']:>6}"
+              f"{latency['p50']:>10.1f}{latency['p95']:>10.1f}"
+              f"{result['document_steps_p50_ms']:>18.1f}")
+
+
+if __name__ == "__main__":
+    parser = build_parser()
+    parser.description = ("Compare inline and GCS-reference Document AI requests "
+                          "in the local workflow executor.")
+    parser.add_argument("--sizes-kb", type=int, nargs="+",
+                        default=[50, 200, 350, 1024, 4096],
+                        help="Document sizes to compare, in KB.")
+    parser.set_defaults(events=100, concurrency=20)
+    args = parser.parse_args()
+
+    # The individual runs only print progress; keep the comparison readable
+    with open(os.devnull, "w") as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            results = compare(args)
+        finally:
+            sys.stdout = stdout
+    print_comparison(results)
+    benchmark_results.save_from_args(args, "compare_doc_ai_input_modes", results,
+                                     key_metrics(results))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nReport written to {os.path.abspath(args.report)}")
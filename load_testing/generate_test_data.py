@@ -1,21 +1,66 @@
+import io
+import json
 import os
-from faker import Faker
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
 import random
+import time
+from concurrent.futures import ProcessPoolExecutor
 
+from faker import Faker
+from reportlab import rl_config
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
 
-def generate_invoice(file_path):
-    """Generates a single fake PDF invoice."""
-    fake = Faker()
-    c = canvas.Canvas(file_path, pagesize=letter)
-
-    # Invoice Header
+# Invoice shapes and their default share of the corpus
+DEFAULT_MIX = {
+    "standard": 0.7,
+    "many_items": 0.15,
+    "multi_page": 0.1,
+    "scanned": 0.05,
+}
+
+# Embed streams as binary; reportlab's pure-Python ASCII85 encoder dominates
+# the time spent writing image-only invoices
+rl_config.useA85 = 0
+
+LINE_HEIGHT = 20
+PAGE_TOP = 580
+PAGE_BOTTOM = 80
+
+
+def parse_mix(mix):
+    """Parse a mix like 'standard=0.7,multi_page=0.3' into normalized weights."""
+    weights = {}
+    for item in mix.split(","):
+        shape, _, weight = item.partition("=")
+        shape = shape.strip()
+        if shape not in DEFAULT_MIX:
+            raise ValueError(
+                f"Unknown invoice shape: {shape}. Known shapes are: "
+                f"{', '.join(DEFAULT_MIX)}"
+            )
+        weights[shape] = float(weight)
+    total = sum(weights.values())
+    if total <= 0:
+        raise ValueError("Invoice mix weights must add up to more than zero.")
+    return {shape: weight / total for shape, weight in weights.items()}
+
+
+def line_item_count(shape, rng):
+    """Return how many line items an invoice of the given shape has."""
+    if shape == "many_items":
+        return rng.randint(20, 25)
+    if shape == "multi_page":
+        return rng.randint(40, 120)
+    return rng.randint(1, 5)
+
+
+def draw_header(c, fake, rng):
+    """Draws the invoice header, vendor and client blocks and column titles."""
+    invoice_date = fake.date_this_year()
     c.drawString(100, 750, "INVOICE")
-    c.drawString(400, 750, f"Invoice #: {random.randint(1000, 9999)}")
-    c.drawString(
-        400, 735, f"Date: {fake.date_this_year().strftime('%Y-%m-%d')}"
-    )
+    c.drawString(400, 750, f"Invoice #: {rng.randint(1000, 9999)}")
+    c.drawString(400, 735, f"Date: {invoice_date.strftime('%Y-%m-%d')}")
 
     # Vendor and Client Info
     c.drawString(100, 700, "From:")
@@ -30,30 +75,154 @@ def generate_invoice(file_path):
     c.drawString(100, 600, "Description")
     c.drawString(400, 600, "Amount")
 
+
+def draw_invoice(c, fake, rng, shape):
+    """Draws an invoice of the given shape, adding pages as needed."""
+    draw_header(c, fake, rng)
+
     total_amount = 0
-    for i in range(random.randint(1, 5)):
-        description = fake.bs()
-        amount = round(random.uniform(50, 500), 2)
-        c.drawString(100, 580 - (i * 20), description)
-        c.drawString(400, 580 - (i * 20), f"${amount}")
+    y = PAGE_TOP
+    for _ in range(line_item_count(shape, rng)):
+        if y < PAGE_BOTTOM:
+            c.showPage()
+            c.drawString(100, 750, "INVOICE (continued)")
+            y = 720
+        amount = round(rng.uniform(50, 500), 2)
+        c.drawString(100, y, fake.bs())
+        c.drawString(400, y, f"${amount}")
         total_amount += amount
+        y -= LINE_HEIGHT
 
     # Total
-    c.drawString(350, 500, "Total:")
-    c.drawString(400, 500, f"${total_amount:.2f}")
+    y = min(y, 500) - LINE_HEIGHT
+    c.drawString(350, y, "Total:")
+    c.drawString(400, y, f"${total_amount:.2f}")
+    return total_amount
+
+
+def write_scanned_invoice(file_path, fake, rng):
+    """Write an image-only invoice, like a scan, with no text layer.
+
+    Each page is rendered to a noisy bitmap and embedded as a single image.
+    """
+    from PIL import Image, ImageChops, ImageDraw
+
+    width, height = 1275, 1650  # Letter at 150 dpi
+    scale = width / letter[0]
+    pages = []
+
+    class ImageCanvas:
+        """Maps the reportlab drawString/showPage calls onto bitmaps."""
+
+        def __init__(self):
+            self.showPage()
 
+        # Named after reportlab's Canvas methods, which draw_invoice calls
+        def drawString(self, x, y, text):  # noqa: N802
+            self.draw.text((x * scale, height - y * scale), text, fill=0)
+
+        def showPage(self):  # noqa: N802
+            pages.append(Image.new("L", (width, height), color=255))
+            self.draw = ImageDraw.Draw(pages[-1])
+
+    shape = rng.choice(["standard", "many_items", "multi_page"])
+    draw_invoice(ImageCanvas(), fake, rng, shape)
+
+    c = canvas.Canvas(file_path, pagesize=letter, invariant=True)
+    for page in pages:
+        # Paper grain, so pages compress like real scans rather than line art
+        grain = Image.frombytes("L", (width, height), rng.randbytes(width * height))
+        page = ImageChops.darker(page, grain.point(lambda v: 225 + v % 31))
+
+        buffer = io.BytesIO()
+        page.save(buffer, format="JPEG", quality=75)
+        buffer.seek(0)
+        c.drawImage(ImageReader(buffer), 0, 0, width=letter[0], height=letter[1])
+        c.showPage()
+    c.save()
+
+
+def generate_invoice(file_path, fake=None, rng=None, shape="standard"):
+    """Generate a single fake PDF invoice."""
+    fake = fake or Faker()
+    rng = rng or random.Random()
+
+    if shape == "scanned":
+        write_scanned_invoice(file_path, fake, rng)
+        return
+
+    # invariant=True leaves out timestamps so reruns produce identical files
+    c = canvas.Canvas(file_path, pagesize=letter, invariant=True)
+    draw_invoice(c, fake, rng, shape)
     c.save()
 
 
-def main(num_invoices, output_dir):
+def generate_shard(shard):
+    """Generate one worker's share of the corpus.
+
+    Each invoice gets its own seed derived from the corpus seed and its index,
+    so the corpus is the same regardless of the number of workers.
+    """
+    corpus_seed, indices, output_dir, mix = shard
+    fake = Faker()
+    shapes = list(mix)
+    weights = [mix[shape] for shape in shapes]
+    manifest = []
+    total_bytes = 0
+
+    for index in indices:
+        seed = corpus_seed * 1_000_003 + index
+        rng = random.Random(seed)
+        fake.seed_instance(seed)
+        shape = rng.choices(shapes, weights=weights)[0]
+
+        file_path = os.path.join(output_dir, f"invoice_{index + 1}.pdf")
+        generate_invoice(file_path, fake=fake, rng=rng, shape=shape)
+        size = os.path.getsize(file_path)
+        total_bytes += size
+        manifest.append(
+            {"file_name": os.path.basename(file_path), "shape": shape, "bytes": size}
+        )
+
+    return manifest, total_bytes
+
+
+def main(num_invoices, output_dir, workers=None, seed=0, mix=None, chunk_size=50):
     """Generates a specified number of fake invoices."""
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    for i in range(num_invoices):
-        file_path = os.path.join(output_dir, f"invoice_{i+1}.pdf")
-        generate_invoice(file_path)
-        print(f"Generated {file_path}")
+    mix = mix or DEFAULT_MIX
+    workers = workers or os.cpu_count() or 1
+    shards = [
+        (seed, range(start, min(start + chunk_size, num_invoices)), output_dir, mix)
+        for start in range(0, num_invoices, chunk_size)
+    ]
+
+    start_time = time.perf_counter()
+    generated = 0
+    total_bytes = 0
+    manifest_path = os.path.join(output_dir, "manifest.jsonl")
+
+    # Shards are written to disk as they finish rather than held in memory
+    with ProcessPoolExecutor(max_workers=workers) as executor, \
+            open(manifest_path, "w") as manifest_file:
+        for shard_manifest, shard_bytes in executor.map(generate_shard, shards):
+            for entry in shard_manifest:
+                manifest_file.write(json.dumps(entry) + "\n")
+            generated += len(shard_manifest)
+            total_bytes += shard_bytes
+            elapsed = time.perf_counter() - start_time
+            print(
+                f"Generated {generated}/{num_invoices} invoices "
+                f"({generated / elapsed:.1f} invoices/s)"
+            )
+
+    elapsed = time.perf_counter() - start_time
+    print(f"\nGenerated {generated} invoices in {output_dir} in {elapsed:.2f}s")
+    print(f"Throughput: {generated / elapsed:.1f} invoices/s, "
+          f"{total_bytes / elapsed / 1024 / 1024:.2f} MB/s")
+    print(f"Manifest written to {manifest_path}")
 
 
 if __name__ == "__main__":
@@ -64,6 +233,14 @@ if __name__ == "__main__":
                         help="The number of invoices to generate.")
     parser.add_argument("--output-dir", default="test_invoices",
                         help="The directory to save the generated invoices.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes (default: CPU count).")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Corpus seed; the same seed reproduces the same corpus.")
+    parser.add_argument("--mix", type=parse_mix, default=None,
+                        help="Shape mix, e.g. 'standard=0.7,many_items=0.15,"
+                             "multi_page=0.1,scanned=0.05'.")
     args = parser.parse_args()
 
-    main(args.num_invoices, args.output_dir)
+    main(args.num_invoices, args.output_dir, workers=args.workers, seed=args.seed,
+         mix=args.mix)
@@ -0,0 +1,366 @@
+"""In-memory stand-ins for the Google Cloud services used by the pipeline.
+
+They implement the small subset of the google-cloud-storage and
+google-cloud-bigquery client APIs that this repository calls, so benchmarks
+and local runs can exercise the real code paths offline.
+"""
+import base64
+import datetime
+import hashlib
+import threading
+import time
+from urllib.parse import quote, unquote, urlparse
+
+try:
+    import google_crc32c
+except ImportError:  # Installed with google-cloud-storage, but optional here
+    google_crc32c = None
+
+from google.api_core.exceptions import Conflict, NotFound, PreconditionFailed
+
+LOCAL_URL_SCHEME = "local"
+
+
+class LocalBlob:
+    """A single object in a LocalBucket."""
+
+    def __init__(self, bucket, name, generation=None):
+        self.bucket = bucket
+        self.name = name
+        self.content_type = None
+        # Like a fetched Blob, get_blob() pins the generation it saw
+        self._generation = generation
+
+    @property
+    def _object(self):
+        return self.bucket._objects.get(self.name)
+
+    @property
+    def size(self):
+        """Size of the stored object in bytes, or None."""
+        obj = self._object
+        return len(obj["data"]) if obj else None
+
+    @property
+    def generation(self):
+        """Generation of the stored object, or None."""
+        if self._generation is not None:
+            return self._generation
+        obj = self._object
+        return int(obj["generation"]) if obj else None
+
+    @property
+    def md5_hash(self):
+        """Base64 MD5 of the stored object, or None."""
+        obj = self._object
+        return obj["md5Hash"] if obj else None
+
+    @property
+    def crc32c(self):
+        """Base64 CRC32C of the stored object, or None if unavailable."""
+        obj = self._object
+        return obj["crc32c"] if obj else None
+
+    @property
+    def time_created(self):
+        """Creation time of the stored object, or None."""
+        obj = self._object
+        return obj["timeCreated"] if obj else None
+
+    @property
+    def metadata(self):
+        """Custom metadata of the stored object, or None."""
+        obj = self._object
+        return obj["metadata"] if obj else None
+
+    def exists(self, client=None):
+        """Return whether the object exists."""
+        return self._object is not None
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None):
+        """Store `data` as the object, honouring `if_generation_match`."""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.bucket._put(
+            self.name,
+            data,
+            content_type or self.content_type,
+            if_generation_match=if_generation_match,
+        )
+
+    def upload_from_filename(self, filename, content_type=None):
+        """Store the contents of a local file as the object."""
+        with open(filename, "rb") as f:
+            self.upload_from_string(f.read(), content_type=content_type)
+
+    def download_as_bytes(self, if_generation_match=None):
+        """Return the stored bytes, raising NotFound or PreconditionFailed like GCS."""
+        obj = self._object
+        if obj is None:
+            raise NotFound(f"No such object: {self.bucket.name}/{self.name}")
+        if if_generation_match is not None and int(obj["generation"]) != int(
+            if_generation_match
+        ):
+            raise PreconditionFailed(f"Generation mismatch: {self.bucket.name}/"
+                                     f"{self.name}")
+        return obj["data"]
+
+    def download_as_text(self):
+        """Return the object's contents decoded as UTF-8."""
+        return self.download_as_bytes().decode("utf-8")
+
+    def delete(self):
+        """Delete the object, raising NotFound if it does not exist."""
+        with self.bucket._lock:
+            if self.bucket._objects.pop(self.name, None) is None:
+                raise NotFound(f"No such object: {self.bucket.name}/{self.name}")
+
+    def compose(self, sources):
+        """Store the concatenation of `sources` as this object."""
+        data = b"".join(source.download_as_bytes() for source in sources)
+        self.upload_from_string(data, content_type=self.content_type)
+
+    def generate_signed_url(
+        self, version="v4", expiration=3600, method="GET", content_type=None, **kwargs
+    ):
+        """Return a local:// URL that put_signed_url() accepts."""
+        return (
+            f"{LOCAL_URL_SCHEME}://{self.bucket.name}/{quote(self.name, safe='')}"
+            f"?method={method}&expires={int(time.time() + expiration)}"
+        )
+
+
+class LocalBucket:
+    """An in-memory bucket. Writes fire the client's finalize listeners."""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self._objects = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def blob(self, name):
+        """Return a LocalBlob for `name`; nothing is fetched."""
+        return LocalBlob(self, name)
+
+    def get_blob(self, name):
+        """Return the object pinned to its current generation, or None."""
+        with self._lock:
+            obj = self._objects.get(name)
+        return LocalBlob(self, name, int(obj["generation"])) if obj else None
+
+    def list_blobs(self, prefix=None):
+        """Return the bucket's objects under `prefix`, sorted by name."""
+        with self._lock:
+            names = sorted(self._objects)
+        return [
+            LocalBlob(self, name)
+            for name in names
+            if prefix is None or name.startswith(prefix)
+        ]
+
+    def delete_blobs(self, blobs, on_error=None):
+        """Delete `blobs`, passing missing ones to `on_error` if given."""
+        for blob in blobs:
+            try:
+                blob.delete()
+            except NotFound:
+                if on_error is None:
+                    raise
+                on_error(blob)
+
+    def _put(self, name, data, content_type, if_generation_match=None):
+        with self._lock:
+            if if_generation_match is not None:
+                current = self._objects.get(name)
+                generation = int(current["generation"]) if current else 0
+                if generation != int(if_generation_match):
+                    raise PreconditionFailed(
+                        f"Generation mismatch: {self.name}/{name}"
+                    )
+            self._generation += 1
+            crc32c = None
+            if google_crc32c is not None:
+                crc32c = base64.b64encode(
+                    google_crc32c.Checksum(data).digest()
+                ).decode("ascii")
+            obj = {
+                "data": data,
+                "contentType": content_type or "application/octet-stream",
+                "md5Hash": base64.b64encode(hashlib.md5(data).digest()).decode("ascii"),
+                "crc32c": crc32c,
+                "generation": str(self._generation),
+                "timeCreated": datetime.datetime.now(datetime.timezone.utc),
+                "metadata": {},
+            }
+            self._objects[name] = obj
+        self.client._finalized(self, name, obj)
+
+
+class LocalStorageClient:
+    """Stand-in for google.cloud.storage.Client.
+
+    Register callbacks with on_finalize() to receive GCS-style object finalize
+    events.
+    """
+
+    def __init__(self, project="local-project"):
+        self.project = project
+        self._buckets = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def bucket(self, name):
+        """Return the bucket called `name`, creating it on first use."""
+        with self._lock:
+            if name not in self._buckets:
+                self._buckets[name] = LocalBucket(self, name)
+            return self._buckets[name]
+
+    def create_bucket(self, bucket_or_name, location=None):
+        """Return the bucket; local buckets always exist."""
+        name = getattr(bucket_or_name, "name", bucket_or_name)
+        return self.bucket(name)
+
+    def list_blobs(self, bucket_or_name, prefix=None):
+        """Return a bucket's objects under `prefix`, sorted by name."""
+        name = getattr(bucket_or_name, "name", bucket_or_name)
+        return self.bucket(name).list_blobs(prefix=prefix)
+
+    def on_finalize(self, callback):
+        """Call `callback` with the finalize event of every object written."""
+        self._listeners.append(callback)
+
+    def put_signed_url(self, url, data, content_type=None):
+        """Perform the PUT a client would send to a local signed URL."""
+        parsed = urlparse(url)
+        if parsed.scheme != LOCAL_URL_SCHEME:
+            raise ValueError(f"Not a local signed URL: {url}")
+        name = unquote(parsed.path.lstrip("/"))
+        self.bucket(parsed.netloc).blob(name).upload_from_string(
+            data, content_type=content_type
+        )
+
+    def finalize_event(self, bucket_name, name):
+        """Return the GCS object finalize event payload for an object."""
+        obj = self.bucket(bucket_name)._objects[name]
+        return {
+            "bucket": bucket_name,
+            "name": name,
+            "contentType": obj["contentType"],
+            "size": str(len(obj["data"])),
+            "md5Hash": obj["md5Hash"],
+            "crc32c": obj["crc32c"],
+            "generation": obj["generation"],
+            "timeCreated": obj["timeCreated"].isoformat(),
+        }
+
+    def _finalized(self, bucket, name, obj):
+        if not self._listeners:
+            return
+        event = self.finalize_event(bucket.name, name)
+        for callback in self._listeners:
+            callback(event)
+
+
+class LocalLoadJob:
+    """A load job that has already completed."""
+
+    def __init__(self, job_id, rows):
+        self.job_id = job_id
+        self.output_rows = rows
+        self.state = "DONE"
+        self.error_result = None
+
+    def result(self, timeout=None):
+        """Return the job; it has already finished."""
+        return self
+
+
+class LocalBigQueryClient:
+    """Stand-in for google.cloud.bigquery.Client's insert and JSON load job APIs.
+
+    Rows are kept in memory together with the wall-clock time they were
+    inserted. Like insertAll, rows that repeat a recent insertId are
+    deduplicated, and like jobs.insert, reusing a job ID is a Conflict.
+    """
+
+    def __init__(self, project="local-project", job_latency=0.0):
+        self.project = project
+        # Simulated duration of each insert request or load job
+        self.job_latency = job_latency
+        self.api_calls = 0
+        self._tables = {}
+        self._row_ids = {}
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    @staticmethod
+    def _table_id(table):
+        return str(getattr(table, "table_id", table)).replace(":", ".")
+
+    def on_insert(self, callback):
+        """Call `callback` with (table_id, entry) for every row stored."""
+        self._listeners.append(callback)
+
+    def insert_rows_json(self, table, json_rows, row_ids=None, **kwargs):
+        """Stream rows into a table like insertAll; no row ever fails."""
+        with self._lock:
+            self.api_calls += 1
+        time.sleep(self.job_latency)
+        self._append(self._table_id(table), json_rows, row_ids)
+        return []
+
+    def load_table_from_json(self, json_rows, destination, job_config=None,
+                             job_id=None, **kwargs):
+        """Append rows like a load job; reusing a job ID raises Conflict."""
+        with self._lock:
+            self.api_calls += 1
+            if job_id is not None and job_id in self._jobs:
+                raise Conflict(f"Already Exists: Job {self.project}:{job_id}")
+            job = LocalLoadJob(job_id, len(json_rows))
+            if job_id is not None:
+                self._jobs[job_id] = job
+        time.sleep(self.job_latency)
+        # Load jobs have no insertIds, so every row is appended
+        self._append(self._table_id(destination), json_rows, None)
+        return job
+
+    def get_job(self, job_id, **kwargs):
+        """Return a job started with an explicit ID, or raise NotFound."""
+        with self._lock:
+            if job_id not in self._jobs:
+                raise NotFound(f"Not found: Job {self.project}:{job_id}")
+            return self._jobs[job_id]
+
+    def _append(self, table_id, json_rows, row_ids):
+        inserted = []
+        with self._lock:
+            rows = self._tables.setdefault(table_id, [])
+            seen = self._row_ids.setdefault(table_id, set())
+            now = time.time()
+            for i, row in enumerate(json_rows):
+                row_id = row_ids[i] if row_ids else None
+                if row_id is not None:
+                    if row_id in seen:
+                        continue
+                    seen.add(row_id)
+                entry = {"row": dict(row), "row_id": row_id, "inserted_at": now}
+                rows.append(entry)
+                inserted.append(entry)
+        for callback in self._listeners:
+            for entry in inserted:
+                callback(table_id, entry)
+
+    def rows(self, table):
+        """Return the inserted rows of a table, oldest first."""
+        with self._lock:
+            entries = self._tables.get(self._table_id(table), [])
+            return [entry["row"] for entry in entries]
+
+    def entries(self, table):
+        """Return the inserted rows with their insertion metadata."""
+        with self._lock:
+            return list(self._tables.get(self._table_id(table), []))
@@ -0,0 +1,259 @@
+"""Run backfill_invoices.py end to end against local fakes.
+
+Reports the backfill's throughput. A fake batchProcess service writes sharded
+Document AI output JSON into the in-memory GCS stand-in once each operation's
+simulated processing time has passed, and rows are loaded into the in-memory
+BigQuery stand-in. With --interrupt-after the first run is stopped after that
+many batches and the backfill is resumed from its checkpoint, to check that
+every invoice ends up loaded, or queued for review, exactly once.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import benchmark_results
+from benchmark_results import metric
+from local_gcp import LocalBigQueryClient, LocalStorageClient
+from workflow_runner import REPO_ROOT, FakeDocumentAI, load_function_module
+
+sys.path.insert(0, REPO_ROOT)
+import backfill_invoices  # noqa: E402
+
+INPUT_BUCKET = "local-invoice-archive"
+OUTPUT_BUCKET = "local-backfill-output"
+TABLE = "local-project.automation_outputs.processed_invoices"
+
+
+class FakeBatchDocumentAI:
+    """Accepts batchProcess requests and writes sharded output for them.
+
+    Once an operation's simulated duration has passed, each document's
+    entities are written to the output prefix split across several shards,
+    the way the API lays them out.
+    """
+
+    def __init__(self, storage_client, operation_latency, document_latency,
+                 failure_rate, low_confidence_rate, missing_normalized_rate,
+                 shards, seed):
+        self.storage_client = storage_client
+        self.operation_latency = operation_latency
+        self.document_latency = document_latency
+        self.shards = shards
+        self.documents = FakeDocumentAI(0, low_confidence_rate, failure_rate,
+                                        seed, missing_normalized_rate)
+        self.submitted = 0
+        self.polls = 0
+        self._operations = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, documents, output_uri):
+        """Start an operation for documents and return its name."""
+        with self._lock:
+            operation_id = next(self._ids)
+            self.submitted += 1
+        name = f"projects/local-project/locations/us/operations/{operation_id}"
+        self._operations[name] = {
+            "id": operation_id,
+            "documents": documents,
+            "output_uri": output_uri,
+            "ready_at": time.time() + self.operation_latency
+            + self.document_latency * len(documents),
+            "statuses": None,
+        }
+        return name
+
+    def poll(self, operation_name):
+        """Return None until the operation is done, then its statuses."""
+        self.polls += 1
+        operation = self._operations[operation_name]
+        if time.time() < operation["ready_at"]:
+            return None
+        if operation["statuses"] is None:
+            operation["statuses"] = self._write_output(operation)
+        return operation["statuses"]
+
+    def _write_output(self, operation):
+        statuses = []
+        bucket_name, prefix = backfill_invoices.split_gcs_uri(operation["output_uri"])
+        bucket = self.storage_client.bucket(bucket_name)
+        for index, (uri, _) in enumerate(operation["documents"]):
+            try:
+                entities = self.documents(
+                    {"body": {"field_mask": "entities"}}, None
+                )["document"]["entities"]
+            except RuntimeError as e:
+                statuses.append((uri, "", str(e)))
+                continue
+            document_prefix = f"{prefix}{operation['id']}/{index}"
+            base_name = os.path.splitext(uri.rsplit("/", 1)[-1])[0]
+            for shard in range(self.shards):
+                output = {
+                    "entities": entities[shard::self.shards],
+                    "shardInfo": {"shardIndex": shard, "shardCount": self.shards},
+                }
+                bucket.blob(f"{document_prefix}/{base_name}-{shard}.json") \
+                    .upload_from_string(json.dumps(output),
+                                        content_type="application/json")
+            statuses.append((uri, f"gs://{bucket_name}/{document_prefix}", None))
+        return statuses
+
+
+class InterruptingBatchClient:
+    """Wraps a batch client and interrupts the backfill after N finished batches."""
+
+    def __init__(self, client, interrupt_after):
+        self.client = client
+        self.remaining = interrupt_after
+
+    def submit(self, documents, output_uri):
+        """Pass the request on to the wrapped client."""
+        return self.client.submit(documents, output_uri)
+
+    def poll(self, operation_name):
+        """Poll the wrapped client, or interrupt once enough batches finished."""
+        if self.remaining <= 0:
+            raise KeyboardInterrupt
+        statuses = self.client.poll(operation_name)
+        if statuses is not None:
+            self.remaining -= 1
+        return statuses
+
+
+def run(args):
+    """Run the backfill against the fakes and check its loaded rows."""
+    storage_client = LocalStorageClient()
+    bigquery_client = LocalBigQueryClient(job_latency=args.bigquery_latency)
+    bucket = storage_client.bucket(INPUT_BUCKET)
+    rng = random.Random(args.seed)
+    for i in range(args.documents):
+        bucket.blob(f"invoices/2024/invoice_{i:05d}.pdf").upload_from_string(
+            b"%PDF-1.4 " + rng.randbytes(64), content_type="application/pdf"
+        )
+
+    docai = FakeBatchDocumentAI(
+        storage_client, args.operation_latency, args.document_latency,
+        args.failure_rate, args.low_confidence_rate, args.missing_normalized_rate,
+        args.shards, args.seed,
+    )
+    workdir = tempfile.mkdtemp(prefix="backfill_benchmark_")
+    checkpoint = os.path.join(workdir, "checkpoint.json")
+    review_queue = load_function_module("backend_api/review_queue.py",
+                                        "local_review_queue")
+    review_store = review_queue.SQLiteReviewStore(":memory:")
+
+    def backfill(client):
+        return backfill_invoices.run_backfill(
+            client, storage_client, bigquery_client,
+            f"gs://{INPUT_BUCKET}/invoices/", f"gs://{OUTPUT_BUCKET}/output/",
+            TABLE, checkpoint,
+            batch_size=args.batch_size,
+            max_concurrent_operations=args.max_concurrent_operations,
+            poll_interval=args.poll_interval,
+            review_output=os.path.join(workdir, "needs_review.jsonl"),
+            review_store=review_store,
+        )
+
+    start = time.time()
+    interrupted = False
+    if args.interrupt_after:
+        try:
+            backfill(InterruptingBatchClient(docai, args.interrupt_after))
+        except KeyboardInterrupt:
+            interrupted = True
+    report = backfill(docai)
+    elapsed = time.time() - start
+
+    sources = [row["source_file_path"] for row in bigquery_client.rows(TABLE)]
+    report["check"] = {
+        "interrupted_and_resumed": interrupted,
+        "rows_in_table": len(sources),
+        "duplicate_rows": len(sources) - len(set(sources)),
+        "unaccounted_documents": args.documents - report["rows_loaded"]
+        - report["needs_review"] - report["failed"],
+        "unqueued_reviews": report["needs_review"]
+        - review_store.count(review_queue.PENDING),
+    }
+    report["total"] = {
+        "duration_s": elapsed,
+        "documents_per_s": args.documents / elapsed,
+        "operations_submitted": docai.submitted,
+        "operation_polls": docai.polls,
+        "bigquery_load_jobs": bigquery_client.api_calls,
+    }
+    return report
+
+
+def key_metrics(report):
+    """Return the metrics compared between saved runs."""
+    total = report["total"]
+    check = report["check"]
+    operation_latency = report["this_run"]["operation_latency_s"]
+    return {
+        "duration_s": metric(total["duration_s"], "s"),
+        "documents_per_s": metric(total["documents_per_s"], "per_s", "higher"),
+        "operation_p95_s": metric(operation_latency["p95"], "s"),
+        "failure_rate": metric(report["failed"] / report["documents"], "ratio"),
+        "duplicate_rows": metric(check["duplicate_rows"], "count"),
+        "unaccounted_documents": metric(check["unaccounted_documents"], "count"),
+        "unqueued_reviews": metric(check["unqueued_reviews"], "count"),
+    }
+
+
+def print_report(report):
+    """Print the backfill summary followed by the benchmark's checks."""
+    backfill_invoices.print_report(report)
+    total = report["total"]
+    print(f"Total: {total['duration_s']:.1f} s, "
+          f"{total['documents_per_s']:.1f} documents/s, "
+          f"{total['operations_submitted']} operations, "
+          f"{total['operation_polls']} polls, "
+          f"{total['bigquery_load_jobs']} BigQuery load jobs")
+    check = report["check"]
+    print(f"Resumed after interruption: {check['interrupted_and_resumed']}  "
+          f"Rows in table: {check['rows_in_table']}  "
+          f"Duplicates: {check['duplicate_rows']}  "
+          f"Unaccounted: {check['unaccounted_documents']}  "
+          f"Not queued for review: {check['unqueued_reviews']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark backfill_invoices.py against local fakes."
+    )
+    parser.add_argument("--documents", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--max-concurrent-operations", type=int, default=5)
+    parser.add_argument("--poll-interval", type=float, default=0.1)
+    parser.add_argument("--operation-latency", type=float, default=0.5,
+                        help="Fixed seconds each fake operation takes.")
+    parser.add_argument("--document-latency", type=float, default=0.01,
+                        help="Additional seconds per document in an operation.")
+    parser.add_argument("--shards", type=int, default=2,
+                        help="Output shards written per document.")
+    parser.add_argument("--failure-rate", type=float, default=0.01)
+    parser.add_argument("--low-confidence-rate", type=float, default=0.1)
+    parser.add_argument("--missing-normalized-rate", type=float, default=0.05)
+    parser.add_argument("--bigquery-latency", type=float, default=0.2)
+    parser.add_argument("--interrupt-after", type=int, default=0,
+                        help="Interrupt after this many batches, then resume.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", default=None,
+                        help="Optional path to write the results as JSON.")
+    benchmark_results.add_arguments(parser)
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+    benchmark_results.save_from_args(args, "run_backfill_benchmark", report,
+                                     key_metrics(report))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {os.path.abspath(args.report)}")
@@ -0,0 +1,497 @@
+"""Runs deploy.py's provisioning graph against fake cloud clients.
+
+The fakes keep the created resources in memory and add simulated
+latencies: creating a client, each API call, and the long-running
+operations that create the Document AI processor and the Eventarc trigger.
+The graph runs twice on fresh fakes, once one step at a time and once
+concurrently, so the two wall times can be compared. The concurrent run
+records its resources in a deployment state, and is repeated against the
+same fakes with that state, which should only verify. Then the trigger is
+deleted, a plan should show that only the trigger is created, and applying
+it should recreate it. A final redeploy without state shows the cost of
+calling every create API. The report checks that each resource exists once
+before that last redeploy, that every IAM binding is in the policy, and
+how many clients each deploy created. --fail makes one API method fail, to show which
+steps are skipped.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import types
+from collections import Counter
+
+import benchmark_results
+from benchmark_results import metric
+from google.api_core.exceptions import (
+    Aborted,
+    AlreadyExists,
+    Conflict,
+    InternalServerError,
+    NotFound,
+)
+from google.cloud import documentai_v1 as documentai
+from google.iam.v1 import policy_pb2
+from workflow_runner import REPO_ROOT
+
+sys.path.insert(0, REPO_ROOT)
+import deploy  # noqa: E402
+from grant_iam_roles import TRIGGER_SA_ROLES  # noqa: E402
+
+PROJECT_ID = "local-project"
+PROJECT_NUMBER = "123456789012"
+
+# Simulated seconds per API call or long-running operation, before scaling
+LATENCIES = {
+    "storage.create_bucket": 1.0,
+    "storage.get_bucket": 0.2,
+    "storage.lookup_bucket": 0.2,
+    "storage.patch_bucket": 0.5,
+    "bigquery.create_dataset": 0.5,
+    "bigquery.create_table": 0.5,
+    "bigquery.get_table": 0.2,
+    "documentai.create_processor": 0.3,
+    "documentai.create_processor.operation": 5.0,
+    "documentai.list_processors": 0.3,
+    "documentai.get_processor": 0.2,
+    "iam.create_service_account": 1.0,
+    "iam.get_service_account": 0.2,
+    "projects.get_project": 0.2,
+    "projects.get_iam_policy": 0.3,
+    "projects.set_iam_policy": 0.5,
+    "eventarc.create_trigger": 0.3,
+    "eventarc.create_trigger.operation": 6.0,
+    "eventarc.get_trigger": 0.2,
+    "monitoring.create_alert_policy": 0.5,
+    "monitoring.get_alert_policy": 0.2,
+}
+
+
+class FakeCloud:
+    """The resources of one fake project, shared by all its fake clients."""
+
+    def __init__(self, latency_scale, client_init_latency, fail=None):
+        self.latency_scale = latency_scale
+        self.client_init_latency = client_init_latency
+        self.fail = fail
+        self.buckets = {}
+        self.datasets = set()
+        self.tables = set()
+        self.processors = {}
+        self.service_accounts = {}
+        self.policy = policy_pb2.Policy(etag=b"0")
+        self.triggers = {}
+        self.alert_policies = []
+        self.calls = Counter()
+        self.clients_created = Counter()
+        self._lock = threading.Lock()
+
+    def call(self, method):
+        """Count a call of `method`, wait its latency and fail it if asked to."""
+        with self._lock:
+            self.calls[method] += 1
+        time.sleep(LATENCIES[method] * self.latency_scale)
+        if method == self.fail:
+            raise InternalServerError(f"Simulated failure of {method}")
+
+    def client_factory(self, name, project_id):
+        """Build the fake client `name`, after the client creation latency."""
+        time.sleep(self.client_init_latency)
+        with self._lock:
+            self.clients_created[name] += 1
+        return FAKE_CLIENTS[name](self)
+
+
+class FakeOperation:
+    """A long-running operation that finishes with a given result."""
+
+    def __init__(self, cloud, method, result):
+        self.cloud = cloud
+        self.method = method
+        self._result = result
+
+    def result(self, timeout=None):
+        """Wait for the operation and return its result."""
+        self.cloud.call(self.method)
+        return self._result
+
+
+class FakeBucket:
+    """The bucket properties that create_bucket sets."""
+
+    def __init__(self, cloud, name):
+        self.cloud = cloud
+        self.name = name
+        self.lifecycle_rules = []
+
+    def add_lifecycle_delete_rule(self, age, matches_prefix):
+        """Append a lifecycle delete rule, in the API's representation."""
+        self.lifecycle_rules.append({
+            "action": {"type": "Delete"},
+            "condition": {"age": age, "matchesPrefix": matches_prefix},
+        })
+
+    def patch(self):
+        """Save the bucket's changed properties."""
+        self.cloud.call("storage.patch_bucket")
+
+
+class FakeStorageClient:
+    """Buckets, kept in the fake cloud."""
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+
+    def bucket(self, name):
+        """Return an unsaved bucket object."""
+        return FakeBucket(self.cloud, name)
+
+    def create_bucket(self, bucket, location=None):
+        """Create a bucket; raise Conflict if it exists."""
+        self.cloud.call("storage.create_bucket")
+        with self.cloud._lock:
+            if bucket.name in self.cloud.buckets:
+                raise Conflict(f"Bucket {bucket.name} already exists")
+            self.cloud.buckets[bucket.name] = bucket
+        return bucket
+
+    def get_bucket(self, name):
+        """Return a bucket."""
+        self.cloud.call("storage.get_bucket")
+        return self.cloud.buckets[name]
+
+    def lookup_bucket(self, name):
+        """Return a bucket, or None."""
+        self.cloud.call("storage.lookup_bucket")
+        return self.cloud.buckets.get(name)
+
+
+class FakeBigQueryClient:
+    """Datasets and tables, kept in the fake cloud."""
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+
+    def create_dataset(self, dataset):
+        """Create a dataset; raise Conflict if it exists."""
+        self.cloud.call("bigquery.create_dataset")
+        with self.cloud._lock:
+            if dataset.dataset_id in self.cloud.datasets:
+                raise Conflict(f"Dataset {dataset.dataset_id} already exists")
+            self.cloud.datasets.add(dataset.dataset_id)
+        return dataset
+
+    def create_table(self, table):
+        """Create a table; raise Conflict if it exists."""
+        self.cloud.call("bigquery.create_table")
+        with self.cloud._lock:
+            if table.table_id in self.cloud.tables:
+                raise Conflict(f"Table {table.table_id} already exists")
+            self.cloud.tables.add(table.table_id)
+        return table
+
+    def get_table(self, table_id):
+        """Return a table; raise NotFound if there is none."""
+        self.cloud.call("bigquery.get_table")
+        if table_id.rsplit(".", 1)[-1] not in self.cloud.tables:
+            raise NotFound(f"Table {table_id} not found")
+        return types.SimpleNamespace(table_id=table_id)
+
+
+class FakeDocumentAIClient:
+    """Document AI processors, kept in the fake cloud."""
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+
+    def create_processor(self, parent, processor):
+        """Start creating a processor; raise AlreadyExists for a taken name."""
+        self.cloud.call("documentai.create_processor")
+        with self.cloud._lock:
+            if processor.display_name in self.cloud.processors:
+                raise AlreadyExists(f"Processor {processor.display_name} exists")
+            created = documentai.Processor(
+                name=f"{parent}/processors/{len(self.cloud.processors) + 1:016x}",
+                display_name=processor.display_name,
+                type_=processor.type_,
+            )
+            self.cloud.processors[processor.display_name] = created
+        return FakeOperation(self.cloud, "documentai.create_processor.operation",
+                             created)
+
+    def list_processors(self, parent):
+        """Return every processor."""
+        self.cloud.call("documentai.list_processors")
+        return list(self.cloud.processors.values())
+
+    def get_processor(self, name):
+        """Return a processor; raise NotFound if there is none."""
+        self.cloud.call("documentai.get_processor")
+        for processor in self.cloud.processors.values():
+            if processor.name == name:
+                return processor
+        raise NotFound(f"Processor {name} not found")
+
+
+class FakeIAMClient:
+    """Service accounts, kept in the fake cloud."""
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+
+    def create_service_account(self, name, service_account_id, service_account):
+        """Create a service account; raise AlreadyExists if it exists."""
+        self.cloud.call("iam.create_service_account")
+        email = f"{service_account_id}@{PROJECT_ID}.iam.gserviceaccount.com"
+        with self.cloud._lock:
+            if email in self.cloud.service_accounts:
+                raise AlreadyExists(f"Service account {email} exists")
+            self.cloud.service_accounts[email] = service_account
+        return types.SimpleNamespace(email=email)
+
+    def get_service_account(self, name):
+        """Return a service account; raise NotFound if there is none."""
+        self.cloud.call("iam.get_service_account")
+        email = name.rsplit("/", 1)[-1]
+        if email not in self.cloud.service_accounts:
+            raise NotFound(f"Service account {email} not found")
+        return types.SimpleNamespace(email=email)
+
+
+class FakeProjectsClient:
+    """IAM policy reads and writes, with etag checks like the real API."""
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+
+    def get_project(self, name):
+        """Return the project, named by its number."""
+        self.cloud.call("projects.get_project")
+        return types.SimpleNamespace(name=f"projects/{PROJECT_NUMBER}")
+
+    def get_iam_policy(self, request):
+        """Return a copy of the project's IAM policy."""
+        self.cloud.call("projects.get_iam_policy")
+        policy = policy_pb2.Policy()
+        with self.cloud._lock:
+            policy.CopyFrom(self.cloud.policy)
+        return policy
+
+    def set_iam_policy(self, request):
+        """Replace the policy; raise Aborted if its etag is stale."""
+        self.cloud.call("projects.set_iam_policy")
+        with self.cloud._lock:
+            if request.policy.etag != self.cloud.policy.etag:
+                raise Aborted("The policy was changed since it was read")
+            self.cloud.policy.CopyFrom(request.policy)
+            self.cloud.policy.etag = str(int(self.cloud.policy.etag) + 1).encode()
+        return self.cloud.policy
+
+
+class FakeEventarcClient:
+    """Eventarc triggers, kept in the fake cloud."""
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+
+    def create_trigger(self, parent, trigger, trigger_id):
+        """Start creating a trigger; raise AlreadyExists if it exists."""
+        self.cloud.call("eventarc.create_trigger")
+        with self.cloud._lock:
+            if trigger.name in self.cloud.triggers:
+                raise AlreadyExists(f"Trigger {trigger_id} exists")
+            self.cloud.triggers[trigger.name] = trigger
+        return FakeOperation(self.cloud, "eventarc.create_trigger.operation", trigger)
+
+    def get_trigger(self, name):
+        """Return a trigger; raise NotFound if there is none."""
+        self.cloud.call("eventarc.get_trigger")
+        if name not in self.cloud.triggers:
+            raise NotFound(f"Trigger {name} not found")
+        return self.cloud.triggers[name]
+
+
+class FakeAlertPolicyClient:
+    """Alert policies, kept in the fake cloud."""
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+
+    def create_alert_policy(self, name, alert_policy):
+        """Create an alert policy and name it."""
+        self.cloud.call("monitoring.create_alert_policy")
+        with self.cloud._lock:
+            self.cloud.alert_policies.append(alert_policy)
+            alert_policy.name = (
+                f"{name}/alertPolicies/{len(self.cloud.alert_policies)}"
+            )
+        return alert_policy
+
+    def get_alert_policy(self, name):
+        """Return an alert policy; raise NotFound if there is none."""
+        self.cloud.call("monitoring.get_alert_policy")
+        for alert_policy in self.cloud.alert_policies:
+            if alert_policy.name == name:
+                return alert_policy
+        raise NotFound(f"Alert policy {name} not found")
+
+
+FAKE_CLIENTS = {
+    "storage": FakeStorageClient,
+    "bigquery": FakeBigQueryClient,
+    "documentai": FakeDocumentAIClient,
+    "iam": FakeIAMClient,
+    "projects": FakeProjectsClient,
+    "eventarc": FakeEventarcClient,
+    "monitoring": FakeAlertPolicyClient,
+}
+
+
+def missing_bindings(cloud):
+    """Return the expected (member, role) bindings that are not in the policy."""
+    service_account = f"serviceAccount:{deploy.SERVICE_ACCOUNT_ID}@{PROJECT_ID}" \
+        ".iam.gserviceaccount.com"
+    agent = f"serviceAccount:service-{PROJECT_NUMBER}@" \
+        "gcp-sa-prod-dai-core.iam.gserviceaccount.com"
+    expected = [(service_account, role) for role in TRIGGER_SA_ROLES]
+    expected.append((agent, "roles/storage.objectViewer"))
+    granted = {(member, binding.role)
+               for binding in cloud.policy.bindings for member in binding.members}
+    return [binding for binding in expected if binding not in granted]
+
+
+def deploy_once(cloud, max_workers, state=None, plan=False):
+    """Run the provisioning graph once and return its timings and API calls."""
+    clients_before = sum(cloud.clients_created.values())
+    calls_before = Counter(cloud.calls)
+    start = time.perf_counter()
+    _, timings = deploy.run_steps(
+        deploy.build_steps(PROJECT_ID),
+        deploy.Clients(PROJECT_ID, factory=cloud.client_factory),
+        max_workers, state=state, plan=plan,
+    )
+    return {
+        "duration_s": time.perf_counter() - start,
+        "step_seconds": sum(timing["duration_s"] for timing in timings.values()),
+        "statuses": dict(Counter(timing["status"] for timing in timings.values())),
+        "clients_created": sum(cloud.clients_created.values()) - clients_before,
+        "api_calls": dict(Counter(cloud.calls) - calls_before),
+        "steps": timings,
+    }
+
+
+def run(args):
+    """Deploy sequentially, concurrently, with state and after a deletion."""
+    def new_cloud():
+        return FakeCloud(args.latency_scale, args.client_init_latency, args.fail)
+
+    print("Deploying one step at a time...")
+    sequential = deploy_once(new_cloud(), 1)
+    cloud = new_cloud()
+    state = deploy.DeploymentState(None, PROJECT_ID)
+    print(f"\nDeploying with up to {args.max_workers} steps at once...")
+    concurrent = deploy_once(cloud, args.max_workers, state)
+    print("\nDeploying again with the recorded state...")
+    redeploy = deploy_once(cloud, args.max_workers, state)
+
+    # Someone deletes the trigger; plan should show it and apply recreate it
+    cloud.triggers.clear()
+    print("\nPlanning after the trigger was deleted...")
+    plan = deploy_once(cloud, args.max_workers, state, plan=True)
+    print("\nApplying the plan...")
+    apply = deploy_once(cloud, args.max_workers, state)
+    resources = {
+        "buckets": len(cloud.buckets),
+        "datasets": len(cloud.datasets),
+        "tables": len(cloud.tables),
+        "processors": len(cloud.processors),
+        "service_accounts": len(cloud.service_accounts),
+        "triggers": len(cloud.triggers),
+        "alert_policies": len(cloud.alert_policies),
+    }
+
+    # A redeploy without state calls every create API, as deploy.py used to
+    print("\nDeploying again without state...")
+    stateless_redeploy = deploy_once(cloud, args.max_workers)
+    return {
+        "config": {k: v for k, v in vars(args).items()
+                   if k not in ("report", "results_dir", "save_results")},
+        "sequential": sequential,
+        "concurrent": concurrent,
+        "redeploy": redeploy,
+        "plan": plan,
+        "apply": apply,
+        "stateless_redeploy": stateless_redeploy,
+        "speedup": sequential["duration_s"] / concurrent["duration_s"],
+        "resources": resources,
+        "missing_bindings": missing_bindings(cloud),
+        "state": state.resources,
+    }
+
+
+def create_calls(result):
+    """Return how many create API calls a deploy made."""
+    return sum(count for method, count in result["api_calls"].items()
+               if ".create_" in method)
+
+
+def key_metrics(report):
+    """Return the metrics compared between saved runs."""
+    steps = len(report["concurrent"]["steps"])
+    return {
+        "sequential_duration_s": metric(report["sequential"]["duration_s"], "s"),
+        "concurrent_duration_s": metric(report["concurrent"]["duration_s"], "s"),
+        "redeploy_duration_s": metric(report["redeploy"]["duration_s"], "s"),
+        "redeploy_create_calls": metric(create_calls(report["redeploy"]), "count"),
+        "failed_step_rate": metric(
+            1 - report["concurrent"]["statuses"].get("ok", 0) / steps, "ratio"
+        ),
+        "missing_bindings": metric(len(report["missing_bindings"]), "count"),
+        "clients_created": metric(report["concurrent"]["clients_created"], "count"),
+    }
+
+
+def print_report(report):
+    """Print the timings of every deploy and the checks."""
+    for name in ("sequential", "concurrent", "redeploy", "plan", "apply",
+                 "stateless_redeploy"):
+        result = report[name]
+        print(f"\n{name.capitalize().replace('_', ' ')}: "
+              f"{result['duration_s']:.2f} s, {create_calls(result)} create calls, "
+              f"{result['statuses']}")
+        deploy.print_timings(result["steps"], result["duration_s"])
+    print(f"\nSpeedup over one step at a time: {report['speedup']:.1f}x")
+    print(f"Resources before the stateless redeploy: {report['resources']}")
+    print(f"Missing IAM bindings: {len(report['missing_bindings'])}")
+    print("Clients created per deploy: " + ", ".join(
+        f"{name} {report[name]['clients_created']}"
+        for name in ("sequential", "concurrent", "redeploy")
+    ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run deploy.py's provisioning graph against fake clients."
+    )
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument("--latency-scale", type=float, default=0.25,
+                        help="Multiplier of the simulated API latencies.")
+    parser.add_argument("--client-init-latency", type=float, default=0.2,
+                        help="Simulated seconds to create each client.")
+    parser.add_argument("--fail", choices=sorted(LATENCIES), default=None,
+                        help="Make this fake API method fail.")
+    parser.add_argument("--report", default=None,
+                        help="Optional path to write the results as JSON.")
+    benchmark_results.add_arguments(parser)
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+    benchmark_results.save_from_args(args, "run_deploy_benchmark", report,
+                                     key_metrics(report))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"\nReport written to {os.path.abspath(args.report)}")
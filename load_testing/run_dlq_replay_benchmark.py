@@ -0,0 +1,191 @@
+"""Fails a share of invoices into the DLQ, then replays them with replay_dlq.py.
+
+Failures come from the local workflow runner and the replay runs against the
+same in-memory GCS.
+
+Uploads go to two buckets with the same object names, so files with the
+same name fail at the same moment. The report checks that every failure
+has its own DLQ entry and manifest line, that the replay ran at no more
+than the configured rate, that each invoice has a row afterwards, and that
+rerunning the replay with the same state file starts nothing.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import benchmark_results
+from benchmark_results import metric
+from run_trigger_benchmark import LocalExecutionsClient
+from workflow_runner import (
+    BIGQUERY_TABLE,
+    DEFAULT_WORKFLOW,
+    DLQ_URL,
+    LocalServices,
+    WorkflowRunner,
+    load_function_module,
+    make_event,
+)
+
+BUCKETS = ["local-invoices", "local-invoices-eu"]
+
+
+def missing_sources(services, events):
+    """Return the events whose invoice has no row in the table."""
+    rows = services.bigquery_client.rows(BIGQUERY_TABLE)
+    written = {row["source_file_path"] for row in rows}
+    return [event for event in events
+            if f"gs://{event['bucket']}/{event['name']}" not in written]
+
+
+def run(args):
+    """Fail invoices into the DLQ, replay them and check the outcome."""
+    replay_dlq = load_function_module("replay_dlq.py", "local_replay_dlq")
+    services = LocalServices(
+        doc_ai_latency=args.doc_ai_latency,
+        doc_ai_failure_rate=args.failure_rate,
+        writer_batch_delay=args.writer_batch_delay,
+        seed=args.seed,
+    )
+    runner = WorkflowRunner(args.workflow, services.connectors())
+    rng = random.Random(args.seed)
+    events = [
+        make_event(services.storage_client, bucket, f"invoice_{i + 1}.pdf",
+                   rng.randbytes(1000))
+        for i in range(args.events // len(BUCKETS))
+        for bucket in BUCKETS
+    ]
+
+    def argument(event):
+        return {"event": event, "project_id": "local-project",
+                "processor_id": "local-processor", "dlq_url": DLQ_URL}
+
+    since = datetime.datetime.now(datetime.timezone.utc)
+    print(f"Processing {len(events)} uploads with a "
+          f"{args.failure_rate:.0%} Document AI failure rate...")
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(lambda event: runner.execute(argument(event)), events))
+    failed = missing_sources(services, events)
+    dlq_entries = services.dlq_entries()
+    until = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+        seconds=1
+    )
+    storage_client = services.storage_client
+    manifests = storage_client.list_blobs(services.dlq_bucket, prefix="manifests/")
+    manifest_entries = list(replay_dlq.read_manifest(
+        storage_client, services.dlq_bucket, since, until
+    ))
+
+    # The replay finds Document AI healthy again
+    services.doc_ai.failure_rate = 0
+    state_path = os.path.join(tempfile.mkdtemp(), "replay_state.json")
+    executions = []
+    workflow_pool = ThreadPoolExecutor(max_workers=args.concurrency)
+    starter = replay_dlq.WorkflowStarter(
+        "local-project", "local-processor", DLQ_URL,
+        client=LocalExecutionsClient(runner, workflow_pool, 0, args.call_latency,
+                                     executions),
+    )
+    entries = replay_dlq.select_entries(manifest_entries)
+    print(f"Replaying {len(entries)} failures at {args.rate}/s "
+          f"with concurrency {args.replay_concurrency}...")
+    replay_report = replay_dlq.replay(
+        entries, storage_client, starter, concurrency=args.replay_concurrency,
+        rate=args.rate, burst=args.burst, state=replay_dlq.ReplayState(state_path),
+    )
+    states = [future.result()[0] for _, future in executions]
+    workflow_pool.shutdown()
+
+    rerun = replay_dlq.select_entries(
+        manifest_entries,
+        skip_ids=set(replay_dlq.ReplayState(state_path).replayed),
+    )
+    rows = services.bigquery_client.rows(BIGQUERY_TABLE)
+    return {
+        "config": {k: v for k, v in vars(args).items()
+                   if k not in ("report", "results_dir", "save_results")},
+        "uploads": len(events),
+        "failed": len(failed),
+        "dlq_entries": len(dlq_entries),
+        "manifest_objects": len(manifests),
+        "manifest_lines": len(manifest_entries),
+        "unindexed_entries": len(
+            {f"gs://{services.dlq_bucket}/{blob.name}" for blob in dlq_entries}
+            - {entry["dlq_path"] for entry in manifest_entries}
+        ),
+        "replay": replay_report,
+        "replay_execution_states": {s: states.count(s) for s in set(states)},
+        "rows_inserted": len(rows),
+        "missing_after_replay": len(missing_sources(services, events)),
+        "selected_on_rerun": len(rerun),
+    }
+
+
+def key_metrics(report):
+    """Return the metrics compared between saved runs."""
+    replay = report["replay"]
+    return {
+        "replay_duration_s": metric(replay["duration_s"], "s"),
+        "replays_per_s": metric(replay["replays_per_s"], "per_s", "higher"),
+        "failed_replays": metric(replay["failed"], "count"),
+        "unindexed_entries": metric(report["unindexed_entries"], "count"),
+        "missing_after_replay": metric(report["missing_after_replay"], "count"),
+        "selected_on_rerun": metric(report["selected_on_rerun"], "count"),
+    }
+
+
+def print_report(report):
+    """Print the failure, manifest and replay figures of a run."""
+    print(f"\nUploads: {report['uploads']}  Failed: {report['failed']}  "
+          f"DLQ entries: {report['dlq_entries']}")
+    print(f"Manifest: {report['manifest_lines']} lines in "
+          f"{report['manifest_objects']} objects, "
+          f"{report['unindexed_entries']} DLQ entries not indexed")
+    replay = report["replay"]
+    print(f"Replayed {replay['replayed']} of {replay['selected']} "
+          f"({replay['failed']} failed) in {replay['duration_s']:.2f} s "
+          f"({replay['replays_per_s']:.2f}/s, limit {report['config']['rate']}/s)")
+    print(f"Replay executions: {report['replay_execution_states']}  "
+          f"Rows: {report['rows_inserted']}  "
+          f"Missing: {report['missing_after_replay']}")
+    print(f"Selected again on rerun: {report['selected_on_rerun']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark DLQ indexing and replay_dlq.py locally."
+    )
+    parser.add_argument("--workflow", default=DEFAULT_WORKFLOW)
+    parser.add_argument("--events", type=int, default=400,
+                        help="Uploads, split evenly over two buckets.")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--failure-rate", type=float, default=0.3,
+                        help="Share of Document AI calls that fail.")
+    parser.add_argument("--rate", type=float, default=50.0,
+                        help="Replay executions started per second.")
+    parser.add_argument("--burst", type=int, default=None)
+    parser.add_argument("--replay-concurrency", type=int, default=8)
+    parser.add_argument("--call-latency", type=float, default=0.03,
+                        help="Simulated seconds per create_execution call.")
+    parser.add_argument("--doc-ai-latency", type=float, default=0.1)
+    parser.add_argument("--writer-batch-delay", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", default=None,
+                        help="Optional path to write the results as JSON.")
+    benchmark_results.add_arguments(parser)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    report = run(args)
+    print_report(report)
+    print(f"Total {time.perf_counter() - start:.1f} s")
+    benchmark_results.save_from_args(args, "run_dlq_replay_benchmark", report,
+                                     key_metrics(report))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {os.path.abspath(args.report)}")
@@ -1,58 +1,310 @@
 import argparse
-import requests
+import asyncio
+import json
+import math
 import time
+from collections import Counter
 
+import benchmark_results
+import httpx
+from benchmark_results import metric
 
-def run_load_test(api_url, num_requests, api_key):
-    """Runs a load test against the FastAPI backend.
+
+class LoadTestStats:
+    """Collects per-request outcomes for the measured part of a run."""
+
+    def __init__(self):
+        self.latencies = []
+        self.status_codes = Counter()
+        self.errors = Counter()
+        self.dropped = 0
+
+    def record(self, latency, status_code=None, error=None):
+        """Count one response or error; only 2xx latencies are kept."""
+        if error is not None:
+            self.errors[error] += 1
+            return
+        self.status_codes[status_code] += 1
+        if 200 <= status_code < 300:
+            self.latencies.append(latency)
+
+    @property
+    def successes(self):
+        """Number of 2xx responses."""
+        return sum(c for code, c in self.status_codes.items() if 200 <= code < 300)
+
+    @property
+    def failures(self):
+        """Number of non-2xx responses plus request errors."""
+        return sum(self.status_codes.values()) - self.successes + sum(
+            self.errors.values()
+        )
+
+
+def percentile(latencies, pct):
+    """Return the nearest-rank percentile of a list of latencies."""
+    if not latencies:
+        return None
+    ordered = sorted(latencies)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def latency_histogram(latencies):
+    """Buckets latencies (in seconds) into power-of-two millisecond buckets."""
+    buckets = Counter()
+    for latency in latencies:
+        upper_ms = 1
+        while upper_ms < latency * 1000:
+            upper_ms *= 2
+        buckets[upper_ms] += 1
+    return [{"le_ms": upper, "count": buckets[upper]} for upper in sorted(buckets)]
+
+
+def build_request(i, batch_size):
+    """Return the (path, kwargs) for the i-th simulated upload request."""
+    if batch_size:
+        files = [
+            {
+                "file_name": f"test_invoice_{i}_{j}.pdf",
+                "content_type": "application/pdf",
+            }
+            for j in range(batch_size)
+        ]
+        return "/generate-signed-urls/", {"json": {"files": files}}
+    params = {"file_name": f"test_invoice_{i}.pdf", "content_type": "application/pdf"}
+    return "/generate-signed-url/", {"params": params}
+
+
+async def send(client, i, batch_size, stats, scheduled_at):
+    """Send one request; latency is measured from its scheduled start time."""
+    path, kwargs = build_request(i, batch_size)
+    try:
+        response = await client.post(path, **kwargs)
+        latency = time.perf_counter() - scheduled_at
+        if stats is not None:
+            stats.record(latency, status_code=response.status_code)
+    except httpx.HTTPError as e:
+        if stats is not None:
+            stats.record(None, error=type(e).__name__)
+
+
+async def run_open_loop(client, rps, warmup, duration, max_in_flight, batch_size):
+    """Issue requests at a fixed arrival rate, however quickly the server answers.
+
+    Queueing then shows up as latency instead of lower load.
+    """
+    stats = LoadTestStats()
+    in_flight = set()
+    interval = 1.0 / rps
+    start = time.perf_counter()
+    end = start + warmup + duration
+    i = 0
+
+    while True:
+        scheduled_at = start + i * interval
+        if scheduled_at >= end:
+            break
+        delay = scheduled_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        measured = scheduled_at >= start + warmup
+        if len(in_flight) >= max_in_flight:
+            if measured:
+                stats.dropped += 1
+        else:
+            task = asyncio.ensure_future(
+                send(client, i, batch_size, stats if measured else None, scheduled_at)
+            )
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        i += 1
+
+    if in_flight:
+        await asyncio.gather(*in_flight)
+    return stats
+
+
+async def run_closed_loop(client, concurrency, warmup, duration, batch_size):
+    """Keep a fixed number of requests in flight.
+
+    Each worker sends its next request as soon as the previous one completes.
     """
-    headers = {"X-API-Key": api_key}
-    success_count = 0
-    failure_count = 0
-    start_time = time.time()
-
-    print(f"Starting load test with {num_requests} requests to {api_url}")
-
-    for i in range(num_requests):
-        try:
-            # Simulate a file upload by generating a signed URL
-            file_name = f"test_invoice_{i}.pdf"
-            content_type = "application/pdf"
-            response = requests.post(
-                f"{api_url}/generate-signed-url/",
-                json={
-                    "file_name": file_name,
-                    "content_type": content_type
-                },
-                headers=headers
+    stats = LoadTestStats()
+    start = time.perf_counter()
+    end = start + warmup + duration
+    counter = iter(range(10**12))
+
+    async def worker():
+        while True:
+            scheduled_at = time.perf_counter()
+            if scheduled_at >= end:
+                return
+            measured = scheduled_at >= start + warmup
+            await send(
+                client, next(counter), batch_size, stats if measured else None,
+                scheduled_at,
             )
-            response.raise_for_status()
-            success_count += 1
-            print(f"Request {i+1}/{num_requests}: Success")
-        except requests.exceptions.RequestException as e:
-            failure_count += 1
-            print(f"Request {i+1}/{num_requests}: Failure - {e}")
 
-    end_time = time.time()
-    duration = end_time - start_time
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return stats
+
+
+def make_client(api_url, token, http2, in_process, max_connections):
+    """Build the HTTP client, either for a remote API or the in-process app."""
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    limits = httpx.Limits(
+        max_connections=max_connections, max_keepalive_connections=max_connections
+    )
+    if in_process is not None:
+        # Auth and signing are stubbed out, see benchmark_signing.load_app
+        from benchmark_signing import load_app
+
+        app = load_app(sign_delay=in_process).app
+        return httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app),
+            base_url="http://in-process",
+            headers=headers,
+        )
+    return httpx.AsyncClient(
+        base_url=api_url.rstrip("/"),
+        headers=headers,
+        http2=http2,
+        limits=limits,
+        timeout=httpx.Timeout(30.0),
+    )
+
+
+def build_report(config, stats, elapsed):
+    """Return the machine-readable summary of a run."""
+    latencies_ms = [latency * 1000 for latency in stats.latencies]
+    completed = sum(stats.status_codes.values()) + sum(stats.errors.values())
+    return {
+        "config": config,
+        "duration_s": elapsed,
+        "requests": completed,
+        "successes": stats.successes,
+        "failures": stats.failures,
+        "dropped": stats.dropped,
+        "error_rate": stats.failures / completed if completed else 0.0,
+        "throughput_rps": stats.successes / elapsed if elapsed else 0.0,
+        "status_codes": {str(k): v for k, v in sorted(stats.status_codes.items())},
+        "errors": dict(stats.errors),
+        "latency_ms": {
+            "p50": percentile(latencies_ms, 50),
+            "p90": percentile(latencies_ms, 90),
+            "p99": percentile(latencies_ms, 99),
+            "max": max(latencies_ms) if latencies_ms else None,
+            "mean": sum(latencies_ms) / len(latencies_ms) if latencies_ms else None,
+        },
+        "histogram": latency_histogram(stats.latencies),
+    }
 
+
+async def run_load_test(args):
+    """Run a load test against the FastAPI backend."""
+    config = {
+        "api_url": None if args.in_process is not None else args.api_url,
+        "in_process": args.in_process is not None,
+        "mode": args.mode,
+        "rps": args.rps,
+        "concurrency": args.concurrency,
+        "warmup_s": args.warmup,
+        "duration_s": args.duration,
+        "batch_size": args.batch_size,
+        "http2": args.http2,
+    }
+    print(f"Starting load test: {json.dumps(config)}")
+
+    max_connections = args.concurrency if args.mode == "closed" else args.max_in_flight
+    async with make_client(
+        args.api_url, args.token, args.http2, args.in_process, max_connections
+    ) as client:
+        start = time.perf_counter()
+        if args.mode == "open":
+            stats = await run_open_loop(
+                client, args.rps, args.warmup, args.duration, args.max_in_flight,
+                args.batch_size,
+            )
+        else:
+            stats = await run_closed_loop(
+                client, args.concurrency, args.warmup, args.duration, args.batch_size
+            )
+        elapsed = time.perf_counter() - start - args.warmup
+
+    return build_report(config, stats, elapsed)
+
+
+def key_metrics(report):
+    """Return the metrics compared between saved runs."""
+    latency = report["latency_ms"]
+    return {
+        "latency_p50_ms": metric(latency["p50"], "ms"),
+        "latency_p90_ms": metric(latency["p90"], "ms"),
+        "latency_p99_ms": metric(latency["p99"], "ms"),
+        "throughput_rps": metric(report["throughput_rps"], "per_s", "higher"),
+        "error_rate": metric(report["error_rate"], "ratio"),
+        "dropped": metric(report["dropped"], "count"),
+    }
+
+
+def print_report(report):
+    """Print the human-readable summary of a run."""
+    latency = report["latency_ms"]
     print("\nLoad test complete.")
-    print(f"Total requests: {num_requests}")
-    print(f"Successful requests: {success_count}")
-    print(f"Failed requests: {failure_count}")
-    print(f"Duration: {duration:.2f} seconds")
+    print(f"Total requests: {report['requests']}")
+    print(f"Successful requests: {report['successes']}")
+    print(f"Failed requests: {report['failures']}")
+    print(f"Dropped (in-flight limit): {report['dropped']}")
+    print(f"Duration: {report['duration_s']:.2f} seconds")
+    print(f"Throughput: {report['throughput_rps']:.1f} req/s")
+    if latency["p50"] is not None:
+        print(
+            f"Latency: p50={latency['p50']:.1f} ms  p90={latency['p90']:.1f} ms  "
+            f"p99={latency['p99']:.1f} ms  max={latency['max']:.1f} ms"
+        )
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Run a load test against the FastAPI backend."
     )
-    parser.add_argument("api_url", type=str,
+    parser.add_argument("api_url", type=str, nargs="?", default="http://localhost:8080",
                         help="The URL of the FastAPI backend.")
-    parser.add_argument("num_requests", type=int,
-                        help="The number of requests to send.")
-    parser.add_argument("api_key", type=str,
-                        help="The API key for authentication.")
+    parser.add_argument("--token", type=str, default=None,
+                        help="Firebase ID token sent as a Bearer token.")
+    parser.add_argument("--mode", choices=["open", "closed"], default="open",
+                        help="open: fixed arrival rate; closed: fixed concurrency.")
+    parser.add_argument("--rps", type=float, default=50,
+                        help="Target requests per second in open-loop mode.")
+    parser.add_argument("--concurrency", type=int, default=10,
+                        help="Number of in-flight requests in closed-loop mode.")
+    parser.add_argument("--max-in-flight", type=int, default=1000,
+                        help="Open-loop cap on in-flight requests; extra are dropped.")
+    parser.add_argument("--warmup", type=float, default=5,
+                        help="Seconds of load sent before measurement starts.")
+    parser.add_argument("--duration", type=float, default=30,
+                        help="Seconds of measured load.")
+    parser.add_argument("--batch-size", type=int, default=0,
+                        help="Use /generate-signed-urls/ with this many files.")
+    parser.add_argument("--no-http2", dest="http2", action="store_false",
+                        help="Disable HTTP/2 for remote targets.")
+    parser.add_argument("--in-process", type=float, nargs="?", const=0.005,
+                        default=None, metavar="SIGN_DELAY",
+                        help="Run against the in-process app with auth and "
+                             "signing stubbed out (optional fake sign delay).")
+    parser.add_argument("--report", default=None,
+                        help="Path of the JSON report to write.")
+    benchmark_results.add_arguments(parser)
     args = parser.parse_args()
 
-    run_load_test(args.api_url, args.num_requests, args.api_key)
+    report = asyncio.run(run_load_test(args))
+    print_report(report)
+    benchmark_results.save_from_args(args, "run_load_test", report,
+                                     key_metrics(report))
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.report}")
@@ -0,0 +1,499 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import benchmark_results
+import httpx
+from benchmark_results import metric
+from run_load_test import percentile
+
+DEFAULT_BUCKET = "ai-invoice-processor-0707-invoices"
+DEFAULT_TABLE = "automation_outputs.processed_invoices"
+
+
+class PipelineTracker:
+    """Correlates each uploaded file with its outcome.
+
+    Files are keyed by source_file_path (gs://bucket/name) and end as a
+    processed_invoices row or a DLQ entry.
+    """
+
+    def __init__(self):
+        self.upload_started = {}
+        self.uploaded = {}
+        self.upload_errors = {}
+        self.completed = {}
+        self.dlq = {}
+        self._lock = threading.Lock()
+
+    def record_upload_start(self, uri, at):
+        """Record when the upload of `uri` started."""
+        with self._lock:
+            self.upload_started[uri] = at
+
+    def record_upload(self, uri, at):
+        """Record when the upload of `uri` finished."""
+        with self._lock:
+            self.uploaded[uri] = at
+
+    def record_upload_error(self, uri, error):
+        """Record that the upload of `uri` failed."""
+        with self._lock:
+            self.upload_errors[uri] = error
+
+    def record_row(self, uri, at):
+        """Record the first BigQuery row seen for `uri`."""
+        with self._lock:
+            self.completed.setdefault(uri, at)
+
+    def record_dlq(self, uri, at):
+        """Record the first DLQ entry seen for `uri`."""
+        with self._lock:
+            self.dlq.setdefault(uri, at)
+
+    def outstanding(self):
+        """Return the uploaded files that have no row or DLQ entry yet."""
+        with self._lock:
+            return [
+                uri for uri in self.uploaded
+                if uri not in self.completed and uri not in self.dlq
+            ]
+
+
+class SimulatedWorkflow:
+    """Stands in for invoice-processing-workflow.yaml.
+
+    It reads the object, waits for a simulated Document AI call, then inserts
+    a row or writes a DLQ entry the way move_to_dlq_helper does.
+    """
+
+    def __init__(self, storage_client, bigquery_client, table, dlq_bucket,
+                 doc_ai_latency, failure_rate, seed):
+        self.storage_client = storage_client
+        self.bigquery_client = bigquery_client
+        self.table = table
+        self.dlq_bucket = dlq_bucket
+        self.doc_ai_latency = doc_ai_latency
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    def __call__(self, event):
+        """Process one finalize event."""
+        gcs_input_uri = f"gs://{event['bucket']}/{event['name']}"
+        try:
+            data = self.storage_client.bucket(event["bucket"]).blob(
+                event["name"]
+            ).download_as_bytes()
+            with self._rng_lock:
+                # Larger documents take longer; roughly +50% per MB
+                latency = self._rng.expovariate(1 / self.doc_ai_latency) * (
+                    1 + len(data) / 2_000_000
+                )
+                failed = self._rng.random() < self.failure_rate
+            time.sleep(latency)
+            if failed:
+                raise RuntimeError("Simulated Document AI failure")
+
+            record = {
+                "vendor_name": {"value": "Simulated Vendor", "confidence": 0.99},
+                "invoice_date": "2025-01-31",
+                "due_date": "2025-02-28",
+                "total_amount": {"value": 100.0, "confidence": 0.99},
+                "processed_timestamp": time.time(),
+                "source_file_path": gcs_input_uri,
+            }
+            self.bigquery_client.insert_rows_json(self.table, [record])
+        except Exception as e:
+            dlq_content = {"original_event": event, "error_details": str(e)}
+            self.storage_client.bucket(self.dlq_bucket).blob(
+                f"failed_event_{int(time.time())}_{event['name']}"
+            ).upload_from_string(
+                json.dumps(dlq_content), content_type="application/json"
+            )
+
+
+def setup_local(args, tracker):
+    """Wire the in-process backend API, GCS, workflow and BigQuery stand-ins.
+
+    Returns the API client and a function that PUTs to a signed URL.
+    """
+    from benchmark_signing import load_app
+    from local_gcp import LocalBigQueryClient, LocalStorageClient
+
+    storage_client = LocalStorageClient()
+    bigquery_client = LocalBigQueryClient()
+    main = load_app(sign_delay=0, storage_client=storage_client)
+    bucket = main.BUCKET_NAME
+
+    if args.workflow_yaml:
+        # Run the real workflow definition with the local executor
+        from workflow_runner import DLQ_URL, LocalServices, WorkflowRunner
+
+        services = LocalServices(
+            doc_ai_latency=args.doc_ai_latency,
+            doc_ai_failure_rate=args.failure_rate,
+            seed=args.seed,
+            storage_client=storage_client,
+            bigquery_client=bigquery_client,
+            dlq_bucket=args.dlq_bucket,
+        )
+        runner = WorkflowRunner(args.workflow_yaml, services.connectors())
+
+        def workflow(event):
+            runner.execute({
+                "event": event,
+                "project_id": storage_client.project,
+                "processor_id": "local-processor",
+                "dlq_url": DLQ_URL,
+            })
+    else:
+        workflow = SimulatedWorkflow(
+            storage_client, bigquery_client, args.table, args.dlq_bucket,
+            args.doc_ai_latency, args.failure_rate, args.seed,
+        )
+    workflow_executor = ThreadPoolExecutor(
+        max_workers=args.workflow_concurrency, thread_name_prefix="workflow"
+    )
+
+    def on_finalize(event):
+        if event["bucket"] == bucket:
+            # Like Eventarc, deliver the event without blocking the upload
+            workflow_executor.submit(workflow, event)
+        elif event["bucket"] == args.dlq_bucket and event["name"].startswith(
+            "failed_event_"
+        ):
+            content = json.loads(
+                storage_client.bucket(event["bucket"]).blob(event["name"])
+                .download_as_text()
+            )
+            original = content["original_event"]
+            tracker.record_dlq(
+                f"gs://{original['bucket']}/{original['name']}", time.time()
+            )
+
+    storage_client.on_finalize(on_finalize)
+    bigquery_client.on_insert(
+        lambda table, entry: tracker.record_row(
+            entry["row"]["source_file_path"], entry["inserted_at"]
+        )
+    )
+
+    api = httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=main.app), base_url="http://in-process"
+    )
+
+    async def put(url, data, content_type):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None, storage_client.put_signed_url, url, data, content_type
+        )
+
+    return api, put, bucket, lambda: workflow_executor.shutdown(wait=False)
+
+
+def setup_remote(args):
+    """Return the API client and a PUT function for a deployed backend."""
+    api = httpx.AsyncClient(
+        base_url=args.api_url.rstrip("/"),
+        headers={"Authorization": f"Bearer {args.token}"},
+        http2=True,
+        timeout=httpx.Timeout(60.0),
+    )
+    uploader = httpx.AsyncClient(http2=True, timeout=httpx.Timeout(300.0))
+
+    async def put(url, data, content_type):
+        response = await uploader.put(
+            url, content=data, headers={"Content-Type": content_type}
+        )
+        response.raise_for_status()
+
+    return api, put, args.bucket, lambda: None
+
+
+def poll_remote(args, tracker, started_at, stop):
+    """Poll BigQuery and the DLQ bucket for the uploaded files' outcomes.
+
+    Polling continues until `stop` is set.
+    """
+    from google.cloud import bigquery, storage
+
+    bigquery_client = bigquery.Client()
+    storage_client = storage.Client()
+    seen_dlq = set()
+
+    while not stop.wait(args.poll_interval):
+        pending = tracker.outstanding()
+        if pending:
+            job = bigquery_client.query(
+                f"SELECT source_file_path, processed_timestamp FROM `{args.table}` "
+                "WHERE source_file_path IN UNNEST(@paths)",
+                job_config=bigquery.QueryJobConfig(
+                    query_parameters=[
+                        bigquery.ArrayQueryParameter("paths", "STRING", pending)
+                    ]
+                ),
+            )
+            for row in job.result():
+                tracker.record_row(
+                    row.source_file_path, row.processed_timestamp.timestamp()
+                )
+
+        for blob in storage_client.list_blobs(args.dlq_bucket, prefix="failed_event_"):
+            if blob.name in seen_dlq or blob.time_created.timestamp() < started_at:
+                continue
+            seen_dlq.add(blob.name)
+            original = json.loads(blob.download_as_text())["original_event"]
+            tracker.record_dlq(
+                f"gs://{original['bucket']}/{original['name']}",
+                blob.time_created.timestamp(),
+            )
+
+
+async def upload_corpus(api, put, bucket, files, tracker, args):
+    """Request signed URLs in batches and upload the files concurrently.
+
+    At most `args.upload_concurrency` uploads run at once.
+    """
+    semaphore = asyncio.Semaphore(args.upload_concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def upload(path, signed_url):
+        uri = f"gs://{bucket}/{os.path.basename(path)}"
+        async with semaphore:
+            with open(path, "rb") as f:
+                data = f.read()
+            tracker.record_upload_start(uri, time.time())
+            try:
+                await put(signed_url, data, "application/pdf")
+                tracker.record_upload(uri, time.time())
+            except Exception as e:
+                tracker.record_upload_error(uri, str(e))
+
+    tasks = []
+    for start in range(0, len(files), args.sign_batch_size):
+        batch = files[start:start + args.sign_batch_size]
+        response = await api.post(
+            "/generate-signed-urls/",
+            json={
+                "files": [
+                    {
+                        "file_name": os.path.basename(path),
+                        "content_type": "application/pdf",
+                    }
+                    for path in batch
+                ]
+            },
+        )
+        response.raise_for_status()
+        body = response.json()
+        for error in body["errors"]:
+            path = batch[error["index"]]
+            tracker.record_upload_error(
+                f"gs://{bucket}/{os.path.basename(path)}", error["error"]
+            )
+        for result in body["results"]:
+            tasks.append(
+                loop.create_task(upload(batch[result["index"]], result["signed_url"]))
+            )
+
+    await asyncio.gather(*tasks)
+
+
+def build_report(args, tracker, files, started_at, finished_at):
+    """Return per-invoice and aggregate results for the run."""
+    upload_ms = [
+        (tracker.uploaded[uri] - tracker.upload_started[uri]) * 1000
+        for uri in tracker.uploaded
+    ]
+    per_invoice = []
+    end_to_end_ms = []
+    for uri, uploaded_at in sorted(tracker.uploaded.items()):
+        if uri in tracker.completed:
+            outcome, done_at = "processed", tracker.completed[uri]
+            end_to_end_ms.append((done_at - uploaded_at) * 1000)
+        elif uri in tracker.dlq:
+            outcome, done_at = "dlq", tracker.dlq[uri]
+        else:
+            outcome, done_at = "missing", None
+        per_invoice.append(
+            {
+                "source_file_path": uri,
+                "outcome": outcome,
+                "uploaded_at_s": uploaded_at - started_at,
+                "latency_ms": (done_at - uploaded_at) * 1000 if done_at else None,
+            }
+        )
+
+    def distribution(values):
+        return {
+            "p50": percentile(values, 50),
+            "p90": percentile(values, 90),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "max": max(values) if values else None,
+        }
+
+    last_done = max(
+        list(tracker.completed.values()) + list(tracker.dlq.values()),
+        default=finished_at,
+    )
+    elapsed = last_done - started_at
+    return {
+        "config": {
+            "mode": "local" if args.local else "remote",
+            "corpus_dir": args.corpus_dir,
+            "invoices": len(files),
+            "upload_concurrency": args.upload_concurrency,
+            "workflow_concurrency": args.workflow_concurrency if args.local else None,
+        },
+        "invoices": len(files),
+        "uploaded": len(tracker.uploaded),
+        "upload_failures": len(tracker.upload_errors),
+        "processed": len(tracker.completed),
+        "dlq": len(tracker.dlq),
+        "missing": sum(1 for item in per_invoice if item["outcome"] == "missing"),
+        "duration_s": elapsed,
+        "throughput_invoices_per_s": (
+            len(tracker.completed) / elapsed if elapsed else 0.0
+        ),
+        "upload_latency_ms": distribution(upload_ms),
+        "end_to_end_latency_ms": distribution(end_to_end_ms),
+        "per_invoice": per_invoice,
+    }
+
+
+async def run_benchmark(args):
+    """Upload the corpus and wait until every file is processed or in the DLQ."""
+    files = sorted(glob.glob(os.path.join(args.corpus_dir, "*.pdf")))
+    if args.limit:
+        files = files[:args.limit]
+    if not files:
+        raise SystemExit(f"No PDF files found in {args.corpus_dir}")
+
+    tracker = PipelineTracker()
+    started_at = time.time()
+    stop = threading.Event()
+    if args.local:
+        api, put, bucket, shutdown = setup_local(args, tracker)
+    else:
+        api, put, bucket, shutdown = setup_remote(args)
+        poller = threading.Thread(
+            target=poll_remote, args=(args, tracker, started_at, stop), daemon=True
+        )
+        poller.start()
+
+    print(f"Uploading {len(files)} invoices from {args.corpus_dir}...")
+    async with api:
+        await upload_corpus(api, put, bucket, files, tracker, args)
+    print(
+        f"Uploaded {len(tracker.uploaded)} invoices "
+        f"({len(tracker.upload_errors)} failures); waiting for results..."
+    )
+
+    deadline = time.time() + args.timeout
+    while tracker.outstanding() and time.time() < deadline:
+        await asyncio.sleep(0.05 if args.local else args.poll_interval)
+    stop.set()
+    shutdown()
+
+    return build_report(args, tracker, files, started_at, time.time())
+
+
+def key_metrics(report):
+    """Return the metrics compared between saved runs."""
+    latency = report["end_to_end_latency_ms"]
+    invoices = report["invoices"]
+    return {
+        "end_to_end_p50_ms": metric(latency["p50"], "ms"),
+        "end_to_end_p90_ms": metric(latency["p90"], "ms"),
+        "end_to_end_p99_ms": metric(latency["p99"], "ms"),
+        "upload_p99_ms": metric(report["upload_latency_ms"]["p99"], "ms"),
+        "throughput_invoices_per_s": metric(
+            report["throughput_invoices_per_s"], "per_s", "higher"
+        ),
+        "upload_failure_rate": metric(report["upload_failures"] / invoices, "ratio"),
+        "dlq_rate": metric(report["dlq"] / invoices, "ratio"),
+        "missing": metric(report["missing"], "count"),
+    }
+
+
+def print_report(report):
+    """Print the human-readable summary of a run."""
+    latency = report["end_to_end_latency_ms"]
+    print("\nPipeline benchmark complete.")
+    print(f"Invoices: {report['invoices']}")
+    print(f"Uploaded: {report['uploaded']} ({report['upload_failures']} failures)")
+    print(f"Processed: {report['processed']}")
+    print(f"DLQ: {report['dlq']}")
+    print(f"Missing: {report['missing']}")
+    print(f"Duration: {report['duration_s']:.2f} seconds")
+    print(f"Throughput: {report['throughput_invoices_per_s']:.2f} invoices/s")
+    if latency["p50"] is not None:
+        print(
+            f"End-to-end latency: p50={latency['p50']:.0f} ms  "
+            f"p90={latency['p90']:.0f} ms  p99={latency['p99']:.0f} ms  "
+            f"max={latency['max']:.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure upload-to-BigQuery latency for a generated corpus."
+    )
+    parser.add_argument("corpus_dir",
+                        help="Directory of invoices from generate_test_data.py.")
+    parser.add_argument("--local", action="store_true",
+                        help="Run offline against in-process stand-ins.")
+    parser.add_argument("--api-url", default="http://localhost:8080",
+                        help="Backend API URL (remote mode).")
+    parser.add_argument("--token", default=None,
+                        help="Firebase ID token (remote mode).")
+    parser.add_argument("--bucket", default=DEFAULT_BUCKET,
+                        help="Invoice bucket the API signs URLs for (remote mode).")
+    parser.add_argument("--table", default=DEFAULT_TABLE,
+                        help="BigQuery table holding processed invoices.")
+    parser.add_argument("--dlq-bucket",
+                        default="ai-invoice-processor-0707-invoices-dlq",
+                        help="DLQ bucket written by move_to_dlq_helper.")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="Upload only the first N files of the corpus.")
+    parser.add_argument("--upload-concurrency", type=int, default=32,
+                        help="Number of uploads in flight.")
+    parser.add_argument("--sign-batch-size", type=int, default=100,
+                        help="Files per /generate-signed-urls/ request.")
+    parser.add_argument("--workflow-concurrency", type=int, default=50,
+                        help="Concurrent workflow executions (local mode).")
+    parser.add_argument("--workflow-yaml", default=None,
+                        help="Run this workflow definition with the local "
+                             "executor instead of the simple simulation (local).")
+    parser.add_argument("--doc-ai-latency", type=float, default=0.2,
+                        help="Mean simulated Document AI latency in seconds (local).")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="Share of simulated executions that fail (local).")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed for the simulated latencies and failures.")
+    parser.add_argument("--poll-interval", type=float, default=5.0,
+                        help="Seconds between BigQuery/DLQ polls (remote mode).")
+    parser.add_argument("--timeout", type=float, default=900,
+                        help="Seconds to wait for results after uploading.")
+    parser.add_argument("--report", default=None,
+                        help="Path of the JSON report to write.")
+    benchmark_results.add_arguments(parser)
+    args = parser.parse_args()
+
+    report = asyncio.run(run_benchmark(args))
+    print_report(report)
+    benchmark_results.save_from_args(args, "run_pipeline_benchmark", report,
+                                     key_metrics(report))
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.report}")
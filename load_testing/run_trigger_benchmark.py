@@ -0,0 +1,211 @@
+"""Drives the real trigger_workflow function (root main.py) with a burst of events.
+
+The executions it starts are run with the local workflow executor. A fake
+ExecutionsClient records every client created and execution requested, with
+simulated latencies for creating a client (a new gRPC channel) and for each
+create_execution call. The report compares how many executions and clients a
+burst costs, how long each trigger invocation takes, and checks that every
+uploaded invoice produced a row. Use --coalesce-window to turn on coalescing
+and --no-client-reuse to rebuild the client on every event, as the function
+used to.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import benchmark_results
+from benchmark_results import metric
+from run_load_test import percentile
+from workflow_runner import (
+    BIGQUERY_TABLE,
+    DEFAULT_WORKFLOW,
+    DLQ_URL,
+    LocalServices,
+    WorkflowRunner,
+    load_function_module,
+    make_event,
+)
+
+
+class LocalExecutionsClient:
+    """Starts executions of the local workflow runner on a thread pool."""
+
+    created = 0
+    _lock = threading.Lock()
+
+    def __init__(self, runner, pool, init_latency, call_latency, executions):
+        time.sleep(init_latency)
+        with LocalExecutionsClient._lock:
+            LocalExecutionsClient.created += 1
+        self.runner = runner
+        self.pool = pool
+        self.call_latency = call_latency
+        self.executions = executions
+        self._ids = itertools.count(1)
+
+    def create_execution(self, parent, execution):
+        """Run the execution in the background and return its name."""
+        time.sleep(self.call_latency)
+        argument = json.loads(execution.argument)
+        name = f"{parent}/executions/{next(self._ids)}-{id(argument)}"
+        self.executions.append(
+            (len(argument.get("events", [None])),
+             self.pool.submit(self.runner.execute, argument))
+        )
+        return types.SimpleNamespace(name=name)
+
+
+def run(args):
+    """Send the burst of events to trigger_workflow and collect the results."""
+    services = LocalServices(
+        doc_ai_latency=args.doc_ai_latency,
+        bigquery_latency=args.bigquery_latency,
+        writer_batch_delay=args.writer_batch_delay,
+        seed=args.seed,
+        trace_file=args.trace_file,
+    )
+    runner = WorkflowRunner(args.workflow, services.connectors())
+    rng = random.Random(args.seed)
+    events = [
+        make_event(services.storage_client, "local-invoices",
+                   f"invoice_{i + 1}.pdf", rng.randbytes(1000))
+        for i in range(args.events)
+    ]
+
+    trigger = load_function_module("main.py", "local_trigger_workflow")
+    trigger.PROJECT_ID = "local-project"
+    trigger.PROCESSOR_ID = "local-processor"
+    trigger.DLQ_URL = DLQ_URL
+    trigger.COALESCE_WINDOW_SECONDS = args.coalesce_window
+    trigger.COALESCE_MAX_EVENTS = args.coalesce_max_events
+    trigger.stage_timing.TRACE_FILE = args.trace_file or os.devnull
+
+    executions = []
+    workflow_pool = ThreadPoolExecutor(max_workers=args.workflow_concurrency)
+    LocalExecutionsClient.created = 0
+    trigger.executions_v1 = types.SimpleNamespace(
+        ExecutionsClient=lambda: LocalExecutionsClient(
+            runner, workflow_pool, args.client_init_latency, args.call_latency,
+            executions,
+        )
+    )
+
+    trigger_ms = []
+    lock = threading.Lock()
+
+    if args.no_client_reuse:
+        trigger.get_execution_client = lambda: trigger.executions_v1.ExecutionsClient()
+
+    def deliver(event):
+        start = time.perf_counter()
+        trigger.trigger_workflow(event, None)
+        with lock:
+            trigger_ms.append((time.perf_counter() - start) * 1000)
+
+    # Instance concurrency: how many events one function instance handles at once
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.instance_concurrency) as pool:
+        list(pool.map(deliver, events))
+    triggered = time.perf_counter() - start
+    states = [future.result()[0] for _, future in executions]
+    finished = time.perf_counter() - start
+    workflow_pool.shutdown()
+
+    rows = services.bigquery_client.rows(BIGQUERY_TABLE)
+    group_sizes = [size for size, _ in executions]
+    return {
+        "config": {k: v for k, v in vars(args).items()
+                   if k not in ("report", "results_dir", "save_results")},
+        "events": len(events),
+        "executions": len(executions),
+        "mean_group_size": sum(group_sizes) / len(group_sizes),
+        "clients_created": LocalExecutionsClient.created,
+        "execution_states": {state: states.count(state) for state in set(states)},
+        "rows_inserted": len(rows),
+        "missing_rows": len(events) - len({row["source_file_path"] for row in rows}),
+        "trigger_latency_ms": {
+            "p50": percentile(trigger_ms, 50),
+            "p95": percentile(trigger_ms, 95),
+            "max": max(trigger_ms),
+        },
+        "trigger_duration_s": triggered,
+        "total_duration_s": finished,
+    }
+
+
+def key_metrics(report):
+    """Return the metrics compared between saved runs."""
+    latency = report["trigger_latency_ms"]
+    states = report["execution_states"]
+    return {
+        "trigger_p50_ms": metric(latency["p50"], "ms"),
+        "trigger_p95_ms": metric(latency["p95"], "ms"),
+        "events_triggered_per_s": metric(
+            report["events"] / report["trigger_duration_s"], "per_s", "higher"
+        ),
+        "total_duration_s": metric(report["total_duration_s"], "s"),
+        "failed_execution_rate": metric(
+            1 - states.get("SUCCEEDED", 0) / report["executions"], "ratio"
+        ),
+        "missing_rows": metric(report["missing_rows"], "count"),
+    }
+
+
+def print_report(report):
+    """Print the execution, client and latency figures of a run."""
+    print(f"\nEvents: {report['events']}  Executions: {report['executions']} "
+          f"(mean group {report['mean_group_size']:.1f})  "
+          f"Clients created: {report['clients_created']}")
+    print(f"Execution states: {report['execution_states']}  "
+          f"Rows: {report['rows_inserted']}  Missing: {report['missing_rows']}")
+    latency = report["trigger_latency_ms"]
+    print(f"Trigger latency: p50={latency['p50']:.1f} ms  p95={latency['p95']:.1f} ms"
+          f"  max={latency['max']:.1f} ms")
+    print(f"All events triggered in {report['trigger_duration_s']:.2f} s; "
+          f"all executions finished in {report['total_duration_s']:.2f} s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark trigger_workflow's client reuse and coalescing."
+    )
+    parser.add_argument("--workflow", default=DEFAULT_WORKFLOW)
+    parser.add_argument("--events", type=int, default=500)
+    parser.add_argument("--instance-concurrency", type=int, default=80,
+                        help="Events one function instance handles at once.")
+    parser.add_argument("--workflow-concurrency", type=int, default=100,
+                        help="Executions the local runner runs at once.")
+    parser.add_argument("--coalesce-window", type=float, default=0.0,
+                        help="Seconds to group events; 0 disables coalescing.")
+    parser.add_argument("--coalesce-max-events", type=int, default=20)
+    parser.add_argument("--no-client-reuse", action="store_true",
+                        help="Create a new ExecutionsClient for every event.")
+    parser.add_argument("--client-init-latency", type=float, default=0.05,
+                        help="Simulated seconds to create a client and channel.")
+    parser.add_argument("--call-latency", type=float, default=0.03,
+                        help="Simulated seconds per create_execution call.")
+    parser.add_argument("--doc-ai-latency", type=float, default=0.2)
+    parser.add_argument("--bigquery-latency", type=float, default=0.2)
+    parser.add_argument("--writer-batch-delay", type=float, default=0.5)
+    parser.add_argument("--trace-file", default=None,
+                        help="Append stage timing records here for trace_report.py.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", default=None,
+                        help="Optional path to write the results as JSON.")
+    benchmark_results.add_arguments(parser)
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+    benchmark_results.save_from_args(args, "run_trigger_benchmark", report,
+                                     key_metrics(report))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {os.path.abspath(args.report)}")
@@ -0,0 +1,1186 @@
+"""Local, in-process executor for invoice-processing-workflow.yaml.
+
+It interprets the subset of the Cloud Workflows syntax the workflow uses
+(assign, call, switch, for, parallel for, subworkflows, try/except/retry,
+next, return, raise and ${...} expressions) and routes every connector and
+HTTP call to pluggable fakes, timing each step. This makes it possible to
+profile the workflow logic and drive thousands of synthetic executions without
+deploying anything.
+"""
+import argparse
+import base64
+import datetime
+import functools
+import importlib.util
+import io
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+import tokenize
+import urllib.parse
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import benchmark_results
+import yaml
+from benchmark_results import metric
+from local_gcp import LocalBigQueryClient, LocalStorageClient
+from run_load_test import percentile
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_WORKFLOW = os.path.join(REPO_ROOT, "invoice-processing-workflow.yaml")
+DATE_PARSER_URL = "YOUR_DATE_PARSER_FUNCTION_URL"
+BIGQUERY_WRITER_URL = "YOUR_BIGQUERY_WRITER_URL"
+EXTRACTION_CACHE_URL = "YOUR_EXTRACTION_CACHE_URL"
+BIGQUERY_TABLE = "local-project.automation_outputs.processed_invoices"
+DLQ_URL = "local://move-to-dlq-helper"
+EXPRESSION = re.compile(r"^\$\{(.*)\}$", re.DOTALL)
+# Workflows limits the memory of an execution's variables to 512 KB; a single
+# string or bytes value above it is enough to fail the execution
+VARIABLE_MEMORY_LIMIT = 512 * 1024
+
+
+class WorkflowError(Exception):
+    """An error raised inside a workflow, carrying a Workflows-style map."""
+
+    def __init__(self, error):
+        if not isinstance(error, dict):
+            error = {"message": str(error), "tags": ["RuntimeError"]}
+        super().__init__(error.get("message"))
+        self.error = error
+
+
+class _JumpError(Exception):
+    """Transfers control to a named step (`next:`) in an enclosing block."""
+
+    def __init__(self, target):
+        super().__init__(target)
+        self.target = target
+
+
+class _ReturnError(Exception):
+    """Ends a subworkflow (`return:`) with its value."""
+
+    def __init__(self, value):
+        super().__init__()
+        self.value = value
+
+
+class BranchScope(dict):
+    """Variables of one branch of a parallel step.
+
+    A branch gets a copy of the enclosing scope, except that `shared` names
+    read and write the enclosing scope.
+    """
+
+    def __init__(self, parent, shared):
+        super().__init__((k, v) for k, v in parent.items() if k not in shared)
+        self.parent = parent
+        self.shared = shared
+
+    def __getitem__(self, key):
+        if key in self.shared:
+            return self.parent[key]
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        if key in self.shared:
+            self.parent[key] = value
+        else:
+            super().__setitem__(key, value)
+
+    def __contains__(self, key):
+        return key in self.shared or super().__contains__(key)
+
+    def get(self, key, default=None):
+        """Return the value for key, or default."""
+        return self[key] if key in self else default
+
+
+class WfMap(dict):
+    """A dict that also supports `map.key` access, like Workflows maps."""
+
+    def __getattr__(self, key):
+        try:
+            return self[key]
+        except KeyError:
+            raise KeyError(f"key not found: {key}") from None
+
+
+def to_wf(value):
+    """Convert nested dicts to WfMaps so expressions can use dotted access."""
+    if isinstance(value, dict) and not isinstance(value, WfMap):
+        return WfMap((k, to_wf(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [to_wf(v) for v in value]
+    return value
+
+
+def _json_default(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _namespace(**functions):
+    return type("Namespace", (), {k: staticmethod(v) for k, v in functions.items()})
+
+
+def _map_get(m, key):
+    if m is None:
+        return None
+    for part in key if isinstance(key, list) else [key]:
+        if not isinstance(m, dict) or part not in m:
+            return None
+        m = m[part]
+    return m
+
+
+def _default(value, fallback):
+    return fallback if value is None else value
+
+
+def _default_retry_predicate(error):
+    """http.default_retry_predicate: 429, 502, 503, 504 and connection errors."""
+    if not isinstance(error, dict):
+        return False
+    tags = error.get("tags") or []
+    return error.get("code") in (429, 502, 503, 504) or any(
+        tag in ("ConnectionError", "ConnectionFailedError", "TimeoutError")
+        for tag in tags
+    )
+
+
+def _format_time(seconds):
+    return datetime.datetime.fromtimestamp(
+        seconds, datetime.timezone.utc
+    ).isoformat().replace("+00:00", "Z")
+
+
+# Standard library functions available to expressions
+EXPRESSION_GLOBALS = {
+    "__builtins__": {},
+    "double": float,
+    "int": int,
+    "string": str,
+    "len": len,
+    "keys": lambda m: list(m.keys()),
+    "default": _default,
+    "text": _namespace(
+        replace_all=lambda s, old, new: s.replace(old, new),
+        decode=lambda b: b.decode("utf-8") if isinstance(b, bytes) else b,
+        encode=lambda s: s.encode("utf-8"),
+        split=lambda s, sep: s.split(sep),
+        to_lower=lambda s: s.lower(),
+        to_upper=lambda s: s.upper(),
+        url_encode=lambda s: urllib.parse.quote(s, safe=""),
+        match_regex=lambda s, pattern: re.search(pattern, s) is not None,
+        find_all=lambda s, sub: [
+            {"index": m.start(), "match": sub} for m in re.finditer(re.escape(sub), s)
+        ],
+    ),
+    "json": _namespace(
+        encode=lambda v: json.dumps(v, default=_json_default).encode("utf-8"),
+        encode_to_string=lambda v: json.dumps(v, default=_json_default),
+        decode=lambda b: to_wf(json.loads(b)),
+    ),
+    "base64": _namespace(
+        encode=lambda b: base64.b64encode(b).decode("ascii"),
+        decode=lambda s: base64.b64decode(s),
+    ),
+    "sys": _namespace(
+        now=time.time,
+        get_env=lambda name: os.environ.get(name),
+    ),
+    "map": _namespace(get=_map_get),
+    "time": _namespace(format=_format_time),
+    "http": _namespace(
+        default_retry_predicate=_default_retry_predicate,
+        default_retry={
+            "predicate": _default_retry_predicate,
+            "max_retries": 5,
+            "backoff": {"initial_delay": 1, "max_delay": 60, "multiplier": 1.25},
+        },
+    ),
+    "list": _namespace(concat=lambda lst, v: list(lst) + [v]),
+}
+
+_LITERALS = {"null": "None", "true": "True", "false": "False"}
+
+
+@functools.lru_cache(maxsize=None)
+def compile_expression(source):
+    """Translate a Workflows expression to Python and compile it."""
+    tokens = []
+    for token in tokenize.generate_tokens(io.StringIO(source.strip()).readline):
+        if token.type == tokenize.NAME and token.string in _LITERALS:
+            token = token._replace(string=_LITERALS[token.string])
+        tokens.append((token.type, token.string))
+    python_source = tokenize.untokenize(tokens).strip()
+    return compile(python_source, f"<expression {source.strip()}>", "eval")
+
+
+class WorkflowExecution:
+    """Executes one run of a parsed workflow definition."""
+
+    def __init__(self, runner, arguments):
+        self.runner = runner
+        params = runner.definition["main"].get("params", [])
+        if len(params) == 1:
+            # The main workflow's single parameter receives the whole argument
+            self.variables = WfMap({params[0]: to_wf(dict(arguments))})
+        else:
+            self.variables = to_wf(dict(arguments))
+        self.step_timings = []
+        # Held while assigning to variables shared by parallel branches
+        self.shared_lock = threading.RLock()
+
+    # -- expressions -----------------------------------------------------
+
+    def evaluate(self, value):
+        """Evaluate `${...}` expressions in a value, recursing into maps and lists."""
+        if isinstance(value, str):
+            match = EXPRESSION.match(value.strip())
+            if not match:
+                return value
+            try:
+                return to_wf(
+                    eval(compile_expression(match.group(1)), EXPRESSION_GLOBALS,
+                         self.variables)
+                )
+            except WorkflowError:
+                raise
+            except Exception as e:
+                raise WorkflowError(
+                    {"message": f"{type(e).__name__}: {e}", "tags": [type(e).__name__]}
+                ) from e
+        if isinstance(value, dict):
+            return WfMap((k, self.evaluate(v)) for k, v in value.items())
+        if isinstance(value, list):
+            return [self.evaluate(v) for v in value]
+        return value
+
+    def assign(self, target, value):
+        """Assign to `name`, `name.key` or `name["key"]` / `name[0]`."""
+        if isinstance(value, (str, bytes)) and len(value) > VARIABLE_MEMORY_LIMIT:
+            raise WorkflowError(
+                {"message": f"Variable {target} of {len(value)} bytes exceeds the "
+                            f"{VARIABLE_MEMORY_LIMIT} byte memory limit",
+                 "tags": ["ResourceLimitError"]}
+            )
+        parts = re.findall(r"[A-Za-z_][A-Za-z0-9_]*|\[[^\]]+\]", target)
+        container = self.variables
+        for i, part in enumerate(parts):
+            key = part
+            if part.startswith("["):
+                key = self.evaluate("${" + part[1:-1] + "}")
+            if i == len(parts) - 1:
+                container[key] = value
+            else:
+                if isinstance(container, dict) and key not in container:
+                    container[key] = WfMap()
+                container = container[key]
+
+    # -- steps -------------------------------------------------------------
+
+    def run(self):
+        """Run the main workflow and return its result."""
+        return self.run_definition(self.runner.definition["main"])
+
+    def run_definition(self, definition):
+        """Run a workflow or subworkflow definition and return its result."""
+        try:
+            self.run_steps(definition["steps"])
+        except _ReturnError as r:
+            return r.value
+        except _JumpError as j:
+            if j.target != "end":
+                raise WorkflowError(f"Unknown step: {j.target}")
+        return None
+
+    def run_subworkflow(self, name, args):
+        """Call a subworkflow with its own variable scope."""
+        definition = self.runner.definition[name]
+        scope = WfMap()
+        for param in definition.get("params", []):
+            if isinstance(param, dict):
+                (key, default), = param.items()
+                scope[key] = args.get(key, default)
+            elif param in args:
+                scope[param] = args[param]
+            else:
+                raise WorkflowError(f"Missing argument {param} for {name}")
+        outer = self.variables
+        self.variables = scope
+        try:
+            return self.run_definition(definition)
+        finally:
+            self.variables = outer
+
+    def run_steps(self, steps):
+        """Run a list of steps, following `next:` jumps between them."""
+        names = [next(iter(step)) for step in steps]
+        index = 0
+        while index < len(steps):
+            name = names[index]
+            try:
+                target = self.run_step(name, steps[index][name])
+            except _JumpError as j:
+                if j.target in names:
+                    index = names.index(j.target)
+                    continue
+                raise
+            if target is None:
+                index += 1
+            elif target == "end":
+                raise _JumpError("end")
+            elif target in names:
+                index = names.index(target)
+            else:
+                raise _JumpError(target)
+
+    def run_step(self, name, body):
+        """Run one step, record its timing and return its `next:` target."""
+        start = time.perf_counter()
+        try:
+            return self._run_step(body)
+        finally:
+            self.step_timings.append((name, time.perf_counter() - start))
+
+    def _run_step(self, body):
+        if "try" in body:
+            return self.run_try(body)
+        if "parallel" in body:
+            self.run_parallel(body["parallel"])
+        elif "for" in body:
+            self.run_for(body["for"])
+        elif "switch" in body:
+            target = self.run_switch(body["switch"])
+            if target is not None:
+                return target
+        elif "call" in body:
+            self.run_call(body)
+        elif "steps" in body:
+            self.run_steps(body["steps"])
+
+        if "assign" in body:
+            self.run_assign(body["assign"])
+        if "raise" in body:
+            raise WorkflowError(self.evaluate(body["raise"]))
+        if "return" in body:
+            raise _ReturnError(self.evaluate(body["return"]))
+        return body.get("next")
+
+    def run_assign(self, assignments):
+        """Evaluate and assign each variable of an assign step in order."""
+        # Like Workflows, an assign step is atomic for shared variables
+        with self.shared_lock:
+            for assignment in assignments:
+                for target, value in assignment.items():
+                    self.assign(target, self.evaluate(value))
+
+    def run_call(self, body):
+        """Run a `call:` step through a subworkflow or a connector fake."""
+        call = body["call"]
+        args = self.evaluate(body.get("args", {}))
+        if call in self.runner.definition:
+            result = self.run_subworkflow(call, args)
+            if "result" in body:
+                self.assign(body["result"], to_wf(result))
+            return
+        handler = self.runner.connectors.get(call)
+        if handler is None:
+            raise WorkflowError(f"No fake registered for call: {call}")
+        try:
+            result = handler(args, self)
+        except WorkflowError:
+            raise
+        except Exception as e:
+            raise WorkflowError(
+                {"message": f"{call}: {e}", "tags": [type(e).__name__]}
+            ) from e
+        if "result" in body:
+            self.assign(body["result"], to_wf(result))
+
+    def run_switch(self, conditions):
+        """Run the first matching condition and return its `next:` target."""
+        for condition in conditions:
+            if self.evaluate(condition["condition"]):
+                if "steps" in condition:
+                    self.run_steps(condition["steps"])
+                self.run_assign(condition.get("assign", []))
+                if "raise" in condition:
+                    raise WorkflowError(self.evaluate(condition["raise"]))
+                if "return" in condition:
+                    raise _ReturnError(self.evaluate(condition["return"]))
+                return condition.get("next")
+        return None
+
+    def run_for(self, loop):
+        """Run a sequential `for:` loop over a list or a range."""
+        if "range" in loop:
+            low, high = self.evaluate(loop["range"])
+            items = range(int(low), int(high) + 1)
+        else:
+            items = self.evaluate(loop["in"])
+        for index, item in enumerate(items or []):
+            self.variables[loop["value"]] = item
+            if "index" in loop:
+                self.variables[loop["index"]] = index
+            self.run_steps(loop["steps"])
+
+    def run_parallel(self, parallel):
+        """Run each iteration of a parallel for loop in its own branch."""
+        loop = parallel["for"]
+        shared = set(parallel.get("shared", []))
+        items = list(self.evaluate(loop["in"]) or [])
+        errors = []
+
+        def branch(index, item):
+            child = WorkflowExecution.__new__(WorkflowExecution)
+            child.runner = self.runner
+            child.step_timings = self.step_timings
+            child.shared_lock = self.shared_lock
+            child.variables = BranchScope(self.variables, shared)
+            child.variables[loop["value"]] = item
+            if "index" in loop:
+                child.variables[loop["index"]] = index
+            try:
+                child.run_steps(loop["steps"])
+            except WorkflowError as e:
+                errors.append(e)
+
+        limit = parallel.get("concurrency_limit", 20)
+        with ThreadPoolExecutor(max_workers=max(1, min(limit, len(items)))) as pool:
+            list(pool.map(branch, range(len(items)), items))
+        if errors:
+            raise errors[0]
+
+    def run_try(self, body):
+        """Run a `try:` step with its retry policy and `except:` handler."""
+        block = body["try"]
+        if isinstance(block, dict) and "steps" in block:
+            block = block["steps"]
+        retry = self.evaluate(body["retry"]) if "retry" in body else None
+        attempt = 0
+        while True:
+            try:
+                if isinstance(block, list):
+                    self.run_steps(block)
+                else:
+                    target = self._run_step(block)
+                    if target is not None:
+                        return target
+                break
+            except WorkflowError as e:
+                if retry and self._should_retry(retry, e.error, attempt):
+                    backoff = retry.get("backoff", {})
+                    time.sleep(min(
+                        backoff.get("initial_delay", 1)
+                        * backoff.get("multiplier", 2) ** attempt,
+                        backoff.get("max_delay", 60),
+                    ))
+                    attempt += 1
+                    continue
+                self._handle_error(body, e)
+                break
+        return body.get("next")
+
+    @staticmethod
+    def _should_retry(retry, error, attempt):
+        if attempt >= retry.get("max_retries", 0):
+            return False
+        predicate = retry.get("predicate")
+        return predicate is None or bool(predicate(error))
+
+    def _handle_error(self, body, e):
+        handler = body.get("except")
+        if handler is None:
+            raise e
+        # Like Workflows, the error is only bound to the name the block declares
+        self.variables[handler["as"]] = to_wf(e.error)
+        self.run_steps(handler["steps"])
+
+
+def check_except_blocks(node, path="workflow"):
+    """Raise ValueError for an `except` that lacks `as` or `steps`.
+
+    Cloud Workflows rejects such a definition at deploy time, so the local
+    runner does too, instead of binding the error to an implicit name.
+    """
+    if isinstance(node, list):
+        for index, item in enumerate(node):
+            check_except_blocks(item, f"{path}[{index}]")
+    elif isinstance(node, dict):
+        if "try" in node and "except" in node:
+            handler = node["except"]
+            if (not isinstance(handler, dict) or not isinstance(handler.get("as"), str)
+                    or not isinstance(handler.get("steps"), list)):
+                raise ValueError(
+                    f"{path}: except must be a map with `as` and `steps`."
+                )
+        for key, value in node.items():
+            check_except_blocks(value, f"{path}.{key}")
+
+
+class WorkflowRunner:
+    """Parses a workflow definition once and runs executions of it.
+
+    Connector calls are dispatched to `connectors`, a map from the call name
+    (for example `http.post`) to a callable taking (args, execution).
+    """
+
+    def __init__(self, workflow_path, connectors):
+        with open(workflow_path) as f:
+            self.definition = yaml.safe_load(f)
+        check_except_blocks(self.definition)
+        self.connectors = connectors
+
+    def execute(self, arguments):
+        """Run one execution and return (state, result, step_timings)."""
+        execution = WorkflowExecution(self, arguments)
+        try:
+            result = execution.run()
+            return "SUCCEEDED", result, execution.step_timings
+        except WorkflowError as e:
+            return "FAILED", e.error, execution.step_timings
+
+
+def load_function_module(relative_path, module_name):
+    """Import a Cloud Function's main.py under a unique module name."""
+    # Modules that Cloud Build vendors into a function's source, such as
+    # stage_timing, are imported from the repo root
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    spec = importlib.util.spec_from_file_location(
+        module_name, os.path.join(REPO_ROOT, relative_path)
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeDocumentAI:
+    """Returns synthetic invoice entities after a simulated processing delay.
+
+    A share of documents gets a low-confidence entity to exercise review,
+    and a share of date entities comes back without a normalizedValue.
+    """
+
+    DATE_FORMATS = ["%Y-%m-%d", "%m/%d/%Y", "%B %d, %Y", "%d %b %Y"]
+
+    def __init__(self, latency, low_confidence_rate, failure_rate, seed,
+                 missing_normalized_rate=0.0):
+        self.latency = latency
+        self.low_confidence_rate = low_confidence_rate
+        self.failure_rate = failure_rate
+        self.missing_normalized_rate = missing_normalized_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _date_entity(self, entity_type, date, rng, confidence):
+        entity = {
+            "type": entity_type,
+            "mentionText": date.strftime(rng.choice(self.DATE_FORMATS)),
+            "confidence": confidence,
+        }
+        if rng.random() >= self.missing_normalized_rate:
+            entity["normalizedValue"] = {
+                "text": date.isoformat(),
+                "dateValue": {"year": date.year, "month": date.month, "day": date.day},
+            }
+        return entity
+
+    def __call__(self, args, execution):
+        """Handle a Document AI `processors.process` call."""
+        with self._lock:
+            rng = random.Random(self._rng.random())
+        time.sleep(rng.expovariate(1 / self.latency) if self.latency else 0)
+        if rng.random() < self.failure_rate:
+            raise RuntimeError("Simulated Document AI failure")
+
+        confidences = [rng.uniform(0.9, 1.0) for _ in range(4)]
+        if rng.random() < self.low_confidence_rate:
+            confidences[rng.randrange(4)] = rng.uniform(0.3, 0.89)
+
+        invoice_date = datetime.date(2025, 1, 1) + datetime.timedelta(
+            days=rng.randrange(365)
+        )
+        due_date = invoice_date + datetime.timedelta(days=30)
+        total = round(rng.uniform(50, 5000), 2)
+        entities = [
+            {"type": "vendor_name", "mentionText": "Acme Supplies Inc.",
+             "confidence": confidences[0]},
+            {"type": "total_amount", "mentionText": f"${total}",
+             "confidence": confidences[1],
+             "normalizedValue": {"text": str(total)}},
+            self._date_entity("invoice_date", invoice_date, rng, confidences[2]),
+            self._date_entity("due_date", due_date, rng, confidences[3]),
+        ]
+        document = {
+            "mimeType": "application/pdf",
+            "text": "INVOICE\n" + "Lorem ipsum dolor sit amet\n" * 200,
+            "pages": [
+                {"pageNumber": 1, "dimension": {"width": 612, "height": 792}}
+            ],
+            "entities": entities,
+        }
+        # Like the API, a field mask keeps only the listed document fields
+        field_mask = args.get("body", {}).get("field_mask")
+        if field_mask:
+            fields = {path.split(".")[0] for path in field_mask.split(",")}
+            document = {k: v for k, v in document.items() if k in fields}
+        return {"document": document}
+
+
+class LocalServices:
+    """The default set of fakes for the workflow's connectors and HTTP calls.
+
+    They are in-memory GCS and BigQuery, a simulated Document AI processor,
+    and the real date_parser_helper, bigquery_writer, extraction_cache (on
+    SQLite) and move_to_dlq_helper code. The review queue is backend_api's
+    store on SQLite.
+    """
+
+    def __init__(self, doc_ai_latency=0.2, http_latency=0.02, bigquery_latency=0.02,
+                 low_confidence_rate=0.0, doc_ai_failure_rate=0.0,
+                 seed=0, storage_client=None,
+                 bigquery_client=None, dlq_bucket="local-invoices-dlq",
+                 missing_normalized_rate=0.0, writer_batch_rows=500,
+                 writer_batch_delay=0.5, writer_max_pending_rows=10000,
+                 writer_method="insert_all", workflow_transfer_rate=None,
+                 gcs_read_rate=None, cache_max_entries=100000, trace_file=None):
+        self.storage_client = storage_client or LocalStorageClient()
+        self.bigquery_client = bigquery_client or LocalBigQueryClient(
+            job_latency=bigquery_latency
+        )
+        self.dlq_bucket = dlq_bucket
+        # Stage timing records of the workflow and helpers are appended here
+        self.trace_file = trace_file
+        self._trace_lock = threading.Lock()
+        self.http_latency = http_latency
+        # Bytes per second moved through the workflow engine (object downloads
+        # and inline request bodies) and read by Document AI from GCS. None
+        # means instantaneous.
+        self.workflow_transfer_rate = workflow_transfer_rate
+        self.gcs_read_rate = gcs_read_rate
+        self.doc_ai = FakeDocumentAI(
+            doc_ai_latency, low_confidence_rate, doc_ai_failure_rate, seed,
+            missing_normalized_rate=missing_normalized_rate,
+        )
+        self.doc_ai_calls = 0
+        self.log_records = 0
+        self.log_bytes = 0
+        # Totals of the workflow's "Date normalization" log records
+        self.date_normalization = defaultdict(int)
+        # Totals of the workflow's "Entities extracted" log records
+        self.extractions = defaultdict(int)
+        self.http_calls = defaultdict(int)
+        self._lock = threading.Lock()
+        self._date_parser = load_function_module(
+            "date_parser_helper/main.py", "local_date_parser_helper"
+        )
+        # Shared by the date parser and DLQ helper, as in their deploys
+        self._date_parser.stage_timing.TRACE_FILE = trace_file or os.devnull
+        self._bigquery_writer = load_function_module(
+            "bigquery_writer/main.py", "local_bigquery_writer"
+        )
+        sink_class = (self._bigquery_writer.LoadJobSink if writer_method == "load_job"
+                      else self._bigquery_writer.InsertAllSink)
+        self._bigquery_writer.writer = self._bigquery_writer.BatchWriter(
+            sink_class(self.bigquery_client, BIGQUERY_TABLE),
+            max_batch_rows=writer_batch_rows,
+            max_batch_delay=writer_batch_delay,
+            max_pending_rows=writer_max_pending_rows,
+            log_flushes=False,
+        )
+        self._extraction_cache = load_function_module(
+            "extraction_cache/main.py", "local_extraction_cache"
+        )
+        self._extraction_cache.cache = self._extraction_cache.ExtractionCache(
+            self._extraction_cache.SQLiteStore(":memory:"),
+            max_entries=cache_max_entries,
+        )
+        self._dlq_helper = load_function_module(
+            "move_to_dlq_helper/main.py", "local_move_to_dlq_helper"
+        )
+        self._dlq_helper.storage_client = self.storage_client
+        self._dlq_helper.DLQ_BUCKET_NAME = dlq_bucket
+        self.review_queue = load_function_module(
+            "backend_api/review_queue.py", "local_review_queue"
+        )
+        self.review_store = self.review_queue.SQLiteReviewStore(":memory:")
+        self._flask_app = None
+        self.http_routes = {
+            DATE_PARSER_URL: self.date_parser,
+            BIGQUERY_WRITER_URL: self.bigquery_writer,
+            EXTRACTION_CACHE_URL: self.extraction_cache,
+            DLQ_URL: self.move_to_dlq,
+        }
+
+    def writer_stats(self):
+        """Return the bigquery_writer's flush metrics."""
+        return self._bigquery_writer.writer.stats()
+
+    def cache_stats(self):
+        """Return the extraction cache's hit and eviction counters."""
+        return self._extraction_cache.cache.stats()
+
+    def connectors(self):
+        """Return the connector map to pass to WorkflowRunner."""
+        return {
+            "googleapis.storage.v1.objects.get": self.gcs_get,
+            "googleapis.documentai.v1.projects.locations.processors.process":
+                self.process_document,
+            "googleapis.bigquery.v2.tabledata.insertAll": self.bigquery_insert_all,
+            "http.post": self.http_post,
+            "sys.log": self.sys_log,
+            "googleapis.firestore.v1.projects.databases.documents.createDocument":
+                self.firestore_create_document,
+        }
+
+    @staticmethod
+    def _transfer(size, rate):
+        if rate:
+            time.sleep(size / rate)
+
+    def gcs_get(self, args, execution):
+        """Handle `objects.get`, returning the bytes with alt=media."""
+        blob = self.storage_client.bucket(args["bucket"]).blob(args["object"])
+        if args.get("alt") == "media":
+            data = blob.download_as_bytes()
+            self._transfer(len(data), self.workflow_transfer_rate)
+            return data
+        return {"bucket": args["bucket"], "name": args["object"], "size": blob.size}
+
+    def process_document(self, args, execution):
+        """Charge the cost of getting the document to Document AI, then process it.
+
+        Inline content is uploaded by the workflow engine; a gcs_document is read
+        by Document AI from the bucket. The request then goes to the fake
+        processor.
+        """
+        body = args.get("body", {})
+        if "raw_document" in body:
+            self._transfer(len(body["raw_document"]["content"]),
+                           self.workflow_transfer_rate)
+        elif "gcs_document" in body:
+            bucket, _, name = body["gcs_document"]["gcs_uri"][len("gs://"):] \
+                .partition("/")
+            data = self.storage_client.bucket(bucket).blob(name).download_as_bytes()
+            self._transfer(len(data), self.gcs_read_rate)
+        else:
+            raise ValueError("Request has no raw_document or gcs_document")
+        with self._lock:
+            self.doc_ai_calls += 1
+        return self.doc_ai(args, execution)
+
+    def bigquery_insert_all(self, args, execution):
+        """Handle `tabledata.insertAll` by streaming rows into the fake."""
+        rows = args["body"]["rows"]
+        self.bigquery_client.insert_rows_json(
+            f"{args['projectId']}.{args['datasetId']}.{args['tableId']}",
+            [row["json"] for row in rows],
+            row_ids=[row.get("insertId") for row in rows],
+        )
+        return {"kind": "bigquery#tableDataInsertAllResponse"}
+
+    def http_post(self, args, execution):
+        """Route an `http.post` call to the local handler for its URL."""
+        url = args["url"]
+        handler = self.http_routes.get(url)
+        if handler is None:
+            raise RuntimeError(f"No local route for {url}")
+        with self._lock:
+            self.http_calls[url] += 1
+        time.sleep(self.http_latency)
+        body, code = handler(args.get("body"), args.get("headers"))
+        if code >= 400:
+            raise WorkflowError(
+                {"message": f"HTTP server responded with error code {code}",
+                 "code": code, "body": body, "tags": ["HttpError"]}
+            )
+        return {"body": body, "code": code, "headers": {}}
+
+    def call_function(self, function, body, headers=None):
+        """Invoke an HTTP Cloud Function's handler with a JSON body."""
+        import flask
+
+        if self._flask_app is None:
+            self._flask_app = flask.Flask("local_functions")
+        with self._flask_app.test_request_context(method="POST", json=body,
+                                                  headers=headers):
+            response = function(flask.request)
+        if isinstance(response, tuple):
+            response, code = response[:2]
+        else:
+            code = response.status_code
+        return response.get_json(), code
+
+    def date_parser(self, body, headers=None):
+        """Call the date_parser_helper function."""
+        return self.call_function(self._date_parser.date_parser_helper, body, headers)
+
+    def bigquery_writer(self, body, headers=None):
+        """Call the bigquery_writer function."""
+        return self.call_function(self._bigquery_writer.bigquery_writer, body, headers)
+
+    def extraction_cache(self, body, headers=None):
+        """Call the extraction_cache function."""
+        return self.call_function(self._extraction_cache.extraction_cache, body,
+                                  headers)
+
+    def move_to_dlq(self, body, headers=None):
+        """Call the move_to_dlq_helper function with a JSON-safe body."""
+        body = json.loads(json.dumps(body, default=_json_default))
+        return self.call_function(self._dlq_helper.move_to_dlq_helper, body, headers)
+
+    def dlq_entries(self):
+        """Return the DLQ bucket's failed event objects."""
+        return self.storage_client.list_blobs(self.dlq_bucket, prefix="failed_event_")
+
+    def sys_log(self, args, execution):
+        """Count a `sys.log` record and keep the totals the report needs."""
+        text = args.get("text", args.get("json"))
+        record = text if isinstance(text, dict) else {}
+        if not isinstance(text, str):
+            text = json.dumps(text, default=_json_default)
+        with self._lock:
+            self.log_records += 1
+            self.log_bytes += len(text.encode("utf-8"))
+            if record.get("message") == "Date normalization":
+                self.date_normalization["invoices"] += 1
+                self.date_normalization["normalized_dates"] += record[
+                    "normalized_dates"
+                ]
+                self.date_normalization["date_parser_fallbacks"] += record[
+                    "date_parser_fallbacks"
+                ]
+            elif record.get("message") == "Entities extracted":
+                self.extractions["invoices"] += 1
+                self.extractions["cache_hits"] += int(bool(record.get("cache_hit")))
+        if record.get("message") == "Stage timings" and self.trace_file:
+            with self._trace_lock, open(self.trace_file, "a") as f:
+                f.write(text + "\n")
+
+    @staticmethod
+    def _firestore_value(value):
+        (kind, content), = value.items()
+        if kind == "timestampValue":
+            return datetime.datetime.fromisoformat(
+                content.replace("Z", "+00:00")
+            ).timestamp()
+        if kind == "integerValue":
+            return int(content)
+        if kind == "nullValue":
+            return None
+        return content
+
+    def firestore_create_document(self, args, execution):
+        """Add a review_queue document to the local review store."""
+        if args["collectionId"] != "review_queue":
+            raise ValueError(f"No local collection {args['collectionId']}")
+        item = {key: self._firestore_value(value)
+                for key, value in args["body"]["fields"].items()}
+        item["id"] = args["documentId"]
+        item["record"] = json.loads(item["record"])
+        item["entities"] = json.loads(item["entities"])
+        time.sleep(self.http_latency)
+        if not self.review_store.add(item):
+            raise WorkflowError(
+                {"message": f"Document already exists: {item['id']}",
+                 "code": 409, "tags": ["HttpError"]}
+            )
+        return {"name": f"{args['parent']}/review_queue/{item['id']}"}
+
+    def approve_reviews(self, reviewer="local-reviewer", batch_size=100):
+        """Claim and approve every queued item unchanged and return the count.
+
+        This is what a reviewer using backend_api would do.
+        """
+        approved = 0
+        while True:
+            items = self.review_store.claim(reviewer, batch_size, 900, time.time())
+            if not items:
+                return approved
+            ids, errors = self.review_queue.approve_items(
+                self.review_store, self.bigquery_client, BIGQUERY_TABLE,
+                [(item["id"], None) for item in items], reviewer,
+            )
+            if errors:
+                raise RuntimeError(f"Approving reviews failed: {errors}")
+            approved += len(ids)
+
+
+def summarize_steps(step_timings):
+    """Aggregate (step, seconds) samples into per-step statistics."""
+    by_step = defaultdict(list)
+    for name, seconds in step_timings:
+        by_step[name].append(seconds * 1000)
+    summary = {}
+    for name, samples in by_step.items():
+        summary[name] = {
+            "count": len(samples),
+            "total_ms": sum(samples),
+            "mean_ms": statistics.mean(samples),
+            "p50_ms": percentile(samples, 50),
+            "p95_ms": percentile(samples, 95),
+            "p99_ms": percentile(samples, 99),
+            "max_ms": max(samples),
+        }
+    return dict(sorted(summary.items(), key=lambda item: -item[1]["total_ms"]))
+
+
+def make_event(storage_client, bucket, name, data):
+    """Upload `data` and return the GCS finalize event for it."""
+    storage_client.bucket(bucket).blob(name).upload_from_string(
+        data, content_type="application/pdf"
+    )
+    return storage_client.finalize_event(bucket, name)
+
+
+def run(args):
+    """Run `args.events` synthetic executions and return a report."""
+    # Read by the workflow through sys.get_env, like a workflow env variable
+    os.environ["DEBUG_LOG_SAMPLE_RATE"] = str(args.debug_sample_rate)
+    os.environ["DOC_AI_INPUT_MODE"] = args.doc_ai_input_mode
+    services = LocalServices(
+        doc_ai_latency=args.doc_ai_latency,
+        http_latency=args.http_latency,
+        bigquery_latency=args.bigquery_latency,
+        low_confidence_rate=args.low_confidence_rate,
+        doc_ai_failure_rate=args.failure_rate,
+        seed=args.seed,
+        missing_normalized_rate=args.missing_normalized_rate,
+        writer_batch_rows=args.writer_batch_rows,
+        writer_batch_delay=args.writer_batch_delay,
+        writer_method=args.writer_method,
+        workflow_transfer_rate=args.workflow_transfer_rate * 1024 * 1024,
+        gcs_read_rate=args.gcs_read_rate * 1024 * 1024,
+        cache_max_entries=args.cache_max_entries,
+        trace_file=args.trace_file,
+    )
+    runner = WorkflowRunner(args.workflow, services.connectors())
+
+    rng = random.Random(args.seed)
+    bucket = "local-invoices"
+    documents = []
+    events = []
+    for i in range(args.events):
+        # A share of uploads are copies of an earlier file under a new name
+        if documents and rng.random() < args.duplicate_rate:
+            data = rng.choice(documents)
+        else:
+            data = rng.randbytes(args.document_bytes)
+            documents.append(data)
+        events.append(make_event(services.storage_client, bucket,
+                                 f"invoice_{i + 1}.pdf", data))
+    # Each execution gets a trace ID, as trigger_workflow would give it
+    arguments = [
+        {"event": event, "project_id": "local-project",
+         "processor_id": "local-processor", "dlq_url": DLQ_URL,
+         "trace_id": uuid.uuid4().hex}
+        for event in events
+    ]
+
+    durations = []
+    states = defaultdict(int)
+    step_timings = []
+    lock = threading.Lock()
+
+    def execute(argument):
+        start = time.perf_counter()
+        state, result, timings = runner.execute(argument)
+        with lock:
+            durations.append((time.perf_counter() - start) * 1000)
+            states[state] += 1
+            step_timings.extend(timings)
+
+    print(f"Running {len(arguments)} executions of {args.workflow} "
+          f"with concurrency {args.concurrency}...")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(execute, arguments))
+    elapsed = time.perf_counter() - start
+
+    table = BIGQUERY_TABLE
+    rows_inserted = len(services.bigquery_client.rows(table))
+    queued_for_review = services.review_store.count("pending")
+    approved = services.approve_reviews() if args.approve_reviews else 0
+    return {
+        "config": {k: v for k, v in vars(args).items()
+                   if k not in ("report", "results_dir", "save_results")},
+        "executions": len(arguments),
+        "states": dict(states),
+        "rows_inserted": rows_inserted,
+        "review_queue": {
+            "queued": queued_for_review,
+            "approved": approved,
+            "rows_after_approval": len(services.bigquery_client.rows(table)),
+        },
+        "dlq_entries": len(services.dlq_entries()),
+        "http_calls": dict(services.http_calls),
+        "date_normalization": dict(services.date_normalization),
+        "document_ai_calls": services.doc_ai_calls,
+        "extraction_cache": {
+            "invoices": services.extractions["invoices"],
+            "hits": services.extractions["cache_hits"],
+            "hit_rate": services.extractions["cache_hits"]
+            / services.extractions["invoices"] if services.extractions["invoices"]
+            else None,
+            "function": services.cache_stats(),
+        },
+        "bigquery_api_calls": services.bigquery_client.api_calls,
+        "bigquery_writer": services.writer_stats(),
+        "log_records": services.log_records,
+        "log_bytes": services.log_bytes,
+        "duration_s": elapsed,
+        "throughput_executions_per_s": len(arguments) / elapsed,
+        "execution_latency_ms": {
+            "p50": percentile(durations, 50),
+            "p95": percentile(durations, 95),
+            "p99": percentile(durations, 99),
+            "max": max(durations),
+        },
+        "steps": summarize_steps(step_timings),
+    }
+
+
+def key_metrics(report):
+    """Return the metrics compared between saved runs."""
+    latency = report["execution_latency_ms"]
+    executions = report["executions"]
+    return {
+        "execution_p50_ms": metric(latency["p50"], "ms"),
+        "execution_p95_ms": metric(latency["p95"], "ms"),
+        "execution_p99_ms": metric(latency["p99"], "ms"),
+        "throughput_executions_per_s": metric(
+            report["throughput_executions_per_s"], "per_s", "higher"
+        ),
+        "failed_execution_rate": metric(
+            1 - report["states"].get("SUCCEEDED", 0) / executions, "ratio"
+        ),
+        "dlq_rate": metric(report["dlq_entries"] / executions, "ratio"),
+    }
+
+
+def print_report(report):
+    """Print the human-readable summary of a run."""
+    print("\nWorkflow run complete.")
+    print(f"Executions: {report['executions']} {report['states']}")
+    print(f"Rows inserted: {report['rows_inserted']}")
+    review = report["review_queue"]
+    if review["queued"]:
+        print(f"Queued for review: {review['queued']}; approved "
+              f"{review['approved']}, {review['rows_after_approval']} rows after")
+    print(f"DLQ entries: {report['dlq_entries']}")
+    print(f"HTTP calls: {report['http_calls']}")
+    dates = report["date_normalization"]
+    if dates.get("invoices"):
+        print(f"Dates: {dates['normalized_dates']} normalized by Document AI, "
+              f"{dates['date_parser_fallbacks']} sent to the date parser "
+              f"({dates['date_parser_fallbacks'] / dates['invoices']:.2f} "
+              f"per invoice)")
+    cache = report["extraction_cache"]
+    if cache["invoices"]:
+        print(f"Extraction cache: {cache['hits']} of {cache['invoices']} invoices "
+              f"reused a cached extraction ({cache['hit_rate']:.1%}); "
+              f"{report['document_ai_calls']} Document AI calls, "
+              f"{cache['function']['evictions']} evictions")
+    writer = report["bigquery_writer"]
+    print(f"BigQuery: {report['bigquery_api_calls']} API calls, "
+          f"{writer['flushes']} flushes, mean batch "
+          f"{writer['batch_rows']['mean'] or 0:.1f} rows, flush p50="
+          f"{writer['flush_latency_ms']['p50'] or 0:.1f} ms, queue wait p95="
+          f"{writer['queue_wait_ms']['p95'] or 0:.1f} ms, "
+          f"{writer['duplicate_rows']} duplicates, {writer['rejected_rows']} rejected")
+    print(f"Logged: {report['log_records']} records, {report['log_bytes']} bytes")
+    print(f"Duration: {report['duration_s']:.2f} seconds "
+          f"({report['throughput_executions_per_s']:.1f} executions/s)")
+    latency = report["execution_latency_ms"]
+    print(f"Execution latency: p50={latency['p50']:.1f} ms  "
+          f"p95={latency['p95']:.1f} ms  p99={latency['p99']:.1f} ms")
+    print(f"\n{'step':<36}{'count':>8}{'total ms':>12}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, stats in report["steps"].items():
+        print(f"{name:<36}{stats['count']:>8}{stats['total_ms']:>12.1f}"
+              f"{stats['p50_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+
+
+def build_parser():
+    """Return the runner's command-line parser."""
+    parser = argparse.ArgumentParser(
+        description="Run invoice-processing-workflow.yaml locally against fakes."
+    )
+    parser.add_argument("--workflow", default=DEFAULT_WORKFLOW,
+                        help="Path of the workflow definition.")
+    parser.add_argument("--events", type=int, default=1000,
+                        help="Number of synthetic upload events to process.")
+    parser.add_argument("--concurrency", type=int, default=100,
+                        help="Number of concurrent executions.")
+    parser.add_argument("--document-bytes", type=int, default=50_000,
+                        help="Size of each synthetic document.")
+    parser.add_argument("--doc-ai-latency", type=float, default=0.2,
+                        help="Mean simulated Document AI latency in seconds.")
+    parser.add_argument("--http-latency", type=float, default=0.02,
+                        help="Simulated latency of each helper function call.")
+    parser.add_argument("--bigquery-latency", type=float, default=1.0,
+                        help="Simulated duration of each BigQuery insert "
+                             "request or load job.")
+    parser.add_argument("--low-confidence-rate", type=float, default=0.0,
+                        help="Share of documents with a low-confidence entity.")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="Share of Document AI calls that fail.")
+    parser.add_argument("--debug-sample-rate", type=float, default=0.0,
+                        help="Share of executions that log the full Document AI "
+                             "result.")
+    parser.add_argument("--writer-batch-rows", type=int, default=500,
+                        help="Rows per BigQuery writer batch.")
+    parser.add_argument("--writer-batch-delay", type=float, default=0.5,
+                        help="Longest a row waits for its BigQuery writer batch.")
+    parser.add_argument("--writer-method", choices=["insert_all", "load_job"],
+                        default="insert_all",
+                        help="How the BigQuery writer writes its batches.")
+    parser.add_argument("--missing-normalized-rate", type=float, default=0.05,
+                        help="Share of date entities without a normalizedValue.")
+    parser.add_argument("--doc-ai-input-mode", choices=["gcs", "inline"],
+                        default="gcs",
+                        help="Send Document AI a GCS reference or the inline bytes.")
+    parser.add_argument("--workflow-transfer-rate", type=float, default=10.0,
+                        help="Simulated MB/s for moving document bytes through "
+                             "the workflow engine.")
+    parser.add_argument("--gcs-read-rate", type=float, default=100.0,
+                        help="Simulated MB/s for Document AI reading from GCS.")
+    parser.add_argument("--duplicate-rate", type=float, default=0.1,
+                        help="Share of uploads that copy an earlier file.")
+    parser.add_argument("--cache-max-entries", type=int, default=100000,
+                        help="Entry cap of the extraction cache.")
+    parser.add_argument("--trace-file", default=None,
+                        help="Append stage timing records here for trace_report.py.")
+    parser.add_argument("--approve-reviews", action="store_true",
+                        help="Approve every queued review after the run.")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed for synthetic documents and latencies.")
+    parser.add_argument("--report", default=None,
+                        help="Path of the JSON report to write.")
+    benchmark_results.add_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+
+    report = run(args)
+    print_report(report)
+    benchmark_results.save_from_args(args, "workflow_runner", report,
+                                     key_metrics(report))
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.report}")
@@ -1,40 +1,184 @@
 from google.cloud import workflows_v1
 from google.cloud.workflows import executions_v1
 from google.cloud.workflows.executions_v1.types import Execution
+import datetime
 import os
 import json
+import threading
+import time
+import uuid
+
+import stage_timing
+
+# Parts of parallel composite uploads; only the composed object is processed
+UPLOAD_PARTS_PREFIX = "_upload_parts/"
+
+# Read once per instance rather than on every event
+PROJECT_ID = os.environ.get('GCP_PROJECT_ID')
+PROCESSOR_ID = os.environ.get('PROCESSOR_ID')
+DLQ_URL = os.environ.get('DLQ_URL')
+LOCATION = "us-east4"
+WORKFLOW_ID = "invoice-processing-workflow"
+
+# Events that arrive within COALESCE_WINDOW_SECONDS of the first one are sent
+# to a single execution, which processes up to COALESCE_MAX_EVENTS objects.
+# 0 starts one execution per event. Events can only be grouped when an
+# instance handles several invocations at once (2nd gen, --concurrency > 1).
+COALESCE_WINDOW_SECONDS = float(os.environ.get('COALESCE_WINDOW_SECONDS', 0))
+COALESCE_MAX_EVENTS = int(os.environ.get('COALESCE_MAX_EVENTS', 20))
+
+execution_client = None
+coalescer = None
+_lock = threading.Lock()
+
+
+def get_execution_client():
+    """Return the instance's ExecutionsClient, creating it on first use."""
+    global execution_client
+    with _lock:
+        if execution_client is None:
+            execution_client = executions_v1.ExecutionsClient()
+    return execution_client
+
+
+def event_age_ms(event, now):
+    """Milliseconds from the object's creation to `now`, if the event says."""
+    try:
+        created = datetime.datetime.fromisoformat(
+            event["timeCreated"].replace("Z", "+00:00")
+        )
+    except (KeyError, TypeError, ValueError):
+        return None
+    return (now - created.timestamp()) * 1000
+
+
+def start_execution(events, trace_id):
+    """Start one workflow execution for a list of GCS events."""
+    argument = {
+        "project_id": PROJECT_ID,
+        "processor_id": PROCESSOR_ID,
+        "dlq_url": DLQ_URL,
+        "trace_id": trace_id,
+    }
+    if len(events) == 1:
+        argument["event"] = events[0]
+    else:
+        argument["events"] = events
+    parent = f"projects/{PROJECT_ID}/locations/{LOCATION}/workflows/{WORKFLOW_ID}"
+    response = get_execution_client().create_execution(
+        parent=parent, execution=Execution(argument=json.dumps(argument))
+    )
+    return response.name
+
+
+class EventGroup:
+    """Events that will be processed by the same execution."""
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.events = []
+        self.closed = threading.Event()
+        self.started = threading.Event()
+        self.execution_name = None
+        self.error = None
+
+
+class EventCoalescer:
+    """Groups concurrent events into shared executions.
+
+    The first event of a group waits up to `window` seconds (less if the group
+    fills up), then starts one execution for the whole group. Every invocation
+    in the group returns, or raises, with that execution's outcome, so a
+    failure is retried per event.
+    """
+
+    def __init__(self, start, window, max_events):
+        self.start = start
+        self.window = window
+        self.max_events = max_events
+        self._open = None
+        self._lock = threading.Lock()
+
+    def submit(self, event):
+        """Add an event to the open group and wait for its execution.
+
+        Returns (execution_name, group_size, trace_id).
+        """
+        with self._lock:
+            group = self._open
+            leader = group is None
+            if leader:
+                group = self._open = EventGroup()
+            group.events.append(event)
+            if len(group.events) >= self.max_events:
+                self._open = None
+                group.closed.set()
+
+        if leader:
+            group.closed.wait(self.window)
+            with self._lock:
+                if self._open is group:
+                    self._open = None
+            try:
+                group.execution_name = self.start(group.events, group.trace_id)
+            except Exception as e:
+                group.error = e
+            finally:
+                group.started.set()
+        else:
+            group.started.wait()
+
+        if group.error is not None:
+            raise group.error
+        return group.execution_name, len(group.events), group.trace_id
+
+
+def get_coalescer():
+    """Return the instance's EventCoalescer, creating it on first use."""
+    global coalescer
+    with _lock:
+        if coalescer is None:
+            coalescer = EventCoalescer(
+                start_execution, COALESCE_WINDOW_SECONDS, COALESCE_MAX_EVENTS
+            )
+    return coalescer
+
 
 def trigger_workflow(event, context):
     """
     A simple Cloud Function that triggers the invoice processing workflow.
-    The event payload is passed directly to the workflow.
+    The event payload is passed directly to the workflow, alone or, in
+    coalescing mode, together with the other events of its group, along
+    with the trace ID of that execution.
     """
-    print(f"File {event['name']} uploaded to bucket {event['bucket']}. Triggering workflow.")
+    if event['name'].startswith(UPLOAD_PARTS_PREFIX):
+        print(f"Skipping upload part {event['name']}.")
+        return
 
-    project_id = os.environ.get('GCP_PROJECT_ID')
-    processor_id = os.environ.get('PROCESSOR_ID')
-    dlq_url = os.environ.get('DLQ_URL')
-    location = "us-east4"
-    workflow_id = "invoice-processing-workflow"
+    started_at = time.time()
+    print(f"File {event['name']} uploaded to bucket {event['bucket']}. Triggering workflow.")
 
-    if not all([project_id, processor_id, dlq_url]):
+    if not all([PROJECT_ID, PROCESSOR_ID, DLQ_URL]):
         raise EnvironmentError("Missing required environment variables: GCP_PROJECT_ID, PROCESSOR_ID, DLQ_URL")
 
-    execution_client = executions_v1.ExecutionsClient()
-    parent = f"projects/{project_id}/locations/{location}/workflows/{workflow_id}"
-
-    # Pass the GCS event and other parameters to the workflow
-    execution = Execution(argument=json.dumps({
-        "event": event,
-        "project_id": project_id,
-        "processor_id": processor_id,
-        "dlq_url": dlq_url
-    }))
-
+    trace_id = None
+    status = "ok"
     try:
-        response = execution_client.create_execution(parent=parent, execution=execution)
-        print(f"Workflow execution started: {response.name}")
+        if COALESCE_WINDOW_SECONDS > 0:
+            name, group_size, trace_id = get_coalescer().submit(event)
+            print(f"Workflow execution started: {name} ({group_size} files)")
+        else:
+            trace_id = uuid.uuid4().hex
+            name = start_execution([event], trace_id)
+            print(f"Workflow execution started: {name}")
     except Exception as e:
+        status = "error"
         print(f"Error triggering workflow: {e}")
         # Re-raise the exception to ensure the function execution is marked as a failure
         raise
+    finally:
+        stage_timing.log_stage_timing(
+            "trigger", trace_id, started_at, status,
+            source_file_path=f"gs://{event['bucket']}/{event['name']}",
+            event_age_ms=event_age_ms(event, started_at),
+        )
@@ -1,12 +1,85 @@
 import functions_framework
 import flask
 from google.cloud import storage
+import datetime
 import os
 import json
+import threading
+import time
+import uuid
 
+# Vendored from the repo root by Cloud Build; see stage_timing.py
+import stage_timing
 
-# Initialize Google Cloud Storage client
-storage_client = storage.Client()
+DLQ_BUCKET_NAME = os.environ.get("DLQ_BUCKET_NAME")
+# Each failure is indexed in a one-line JSONL object under its hour's prefix,
+# e.g. manifests/2025/07/19/14/<entry id>.jsonl; readers merge the hour
+MANIFEST_PREFIX = "manifests/"
+# Longest error message kept in a manifest line
+MANIFEST_MESSAGE_CHARS = 200
+
+storage_client = None
+_client_lock = threading.Lock()
+
+
+def get_storage_client():
+    """Return the instance's storage client, creating it on first use."""
+    global storage_client
+    with _client_lock:
+        if storage_client is None:
+            storage_client = storage.Client()
+    return storage_client
+
+
+def manifest_entry_path(failed_at, entry_id):
+    """Path of a failure's manifest object, under the prefix of its UTC hour."""
+    return failed_at.strftime(f"{MANIFEST_PREFIX}%Y/%m/%d/%H/") + f"{entry_id}.jsonl"
+
+
+def error_type_of(error_details):
+    """Classify a workflow error for the manifest.
+
+    The type is the error's first tag (for example "HttpError" or
+    "ResourceLimitError"), else "Unknown".
+    """
+    if isinstance(error_details, dict):
+        tags = error_details.get("tags")
+        if isinstance(tags, list) and tags:
+            return str(tags[0])
+    return "Unknown"
+
+
+def manifest_entry(entry_id, failed_at, dlq_path, event_data, error_details):
+    """Return the manifest line for one failure."""
+    message = error_details
+    code = None
+    if isinstance(error_details, dict):
+        message = error_details.get("message")
+        code = error_details.get("code")
+    return {
+        "id": entry_id,
+        "failed_at": failed_at.isoformat(),
+        "dlq_path": dlq_path,
+        "source": f"gs://{event_data['bucket']}/{event_data['name']}",
+        "generation": event_data.get("generation"),
+        "error_type": error_type_of(error_details),
+        "error_code": code,
+        "error_message": str(message)[:MANIFEST_MESSAGE_CHARS],
+    }
+
+
+def write_manifest_entry(bucket, entry, failed_at):
+    """Write one manifest line as an object of its own and return its path.
+
+    Every failure is a single small create, so a burst of failures never
+    contends for one object or rewrites earlier lines.
+    """
+    line = (json.dumps(entry, separators=(",", ":")) + "\n").encode("utf-8")
+    path = manifest_entry_path(failed_at, entry["id"])
+    bucket.blob(path).upload_from_string(
+        line, content_type="application/x-ndjson", if_generation_match=0
+    )
+    return path
 
 
 @functions_framework.http
@@ -15,11 +88,24 @@ def move_to_dlq_helper(request: flask.Request):
     HTTP Cloud Function that moves a failed event to a Dead Letter Queue (DLQ)
     bucket.
     This function is intended to be called by a Cloud Workflow or other
-    services when an event processing fails.
+    services when an event processing fails. Every failure is also indexed
+    in a JSONL manifest object under its hour, which replay_dlq.py reads,
+    and each request emits a stage timing record.
     """
-    # Get the DLQ bucket name from environment variables
-    dlq_bucket_name = os.environ.get("DLQ_BUCKET_NAME")
-    if not dlq_bucket_name:
+    started_at = time.time()
+    response, code = move_to_dlq(request)
+    event_data = (request.get_json(silent=True) or {}).get("event") or {}
+    stage_timing.log_stage_timing(
+        "move_to_dlq_helper", request.headers.get(stage_timing.TRACE_HEADER),
+        started_at, "ok" if code < 400 else "error",
+        source_file_path=f"gs://{event_data.get('bucket')}/{event_data.get('name')}",
+    )
+    return response, code
+
+
+def move_to_dlq(request):
+    """Save the failed event and index it; returns (response, status code)."""
+    if not DLQ_BUCKET_NAME:
         return flask.jsonify({
             "error": "DLQ_BUCKET_NAME environment variable not set."
         }), 500
@@ -47,15 +133,17 @@ def move_to_dlq_helper(request: flask.Request):
             "error": "Original bucket or file name missing in event data."
         }), 400
 
-    # Construct the DLQ file name
-    # Appending a timestamp and original file name to avoid overwrites
-    timestamp = flask.datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-    dlq_file_name = (
-        f"failed_event_{timestamp}_{original_file_name}"
-    )
+    # Construct the DLQ file name. The microsecond timestamp keeps names in
+    # time order and the random ID keeps simultaneous failures of files with
+    # the same name from overwriting each other.
+    failed_at = datetime.datetime.now(datetime.timezone.utc)
+    timestamp = failed_at.strftime("%Y%m%d%H%M%S%f")
+    entry_id = f"{timestamp}_{uuid.uuid4().hex[:12]}"
+    dlq_file_name = f"failed_event_{entry_id}_{original_file_name}"
+    dlq_path = f"gs://{DLQ_BUCKET_NAME}/{dlq_file_name}"
 
     try:
-        dlq_bucket = storage_client.bucket(dlq_bucket_name)
+        dlq_bucket = get_storage_client().bucket(DLQ_BUCKET_NAME)
         dlq_blob = dlq_bucket.blob(dlq_file_name)
 
         # Prepare content to write to DLQ (original event + error details)
@@ -67,17 +155,27 @@ def move_to_dlq_helper(request: flask.Request):
 
         dlq_blob.upload_from_string(
             json.dumps(dlq_content),
-            content_type="application/json"
+            content_type="application/json",
+            if_generation_match=0
         )
-
-        return flask.jsonify({
-            "status": "success",
-            "dlq_path": (
-                f"gs://{dlq_bucket_name}/{dlq_file_name}"
-            )
-        }), 200
-
     except Exception as e:
         return flask.jsonify({
             "error": f"Failed to move to DLQ: {e}"
         }), 500
+
+    # The entry itself is saved; a failed index write is reported, not retried
+    try:
+        manifest_path = write_manifest_entry(
+            dlq_bucket,
+            manifest_entry(entry_id, failed_at, dlq_path, event_data, error_details),
+            failed_at,
+        )
+    except Exception as e:
+        print(f"Failed to index {dlq_path} in the DLQ manifest: {e}")
+        manifest_path = None
+
+    return flask.jsonify({
+        "status": "success",
+        "dlq_path": dlq_path,
+        "manifest_path": manifest_path
+    }), 200
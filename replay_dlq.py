@@ -0,0 +1,322 @@
+"""Replays dead-lettered invoices from the DLQ manifests.
+
+Reads the JSONL manifest objects that move_to_dlq_helper writes for every
+failure, merged hour by hour. Filters the failures by time, error type,
+source object or error message, and starts a new workflow execution with
+each failure's original GCS event. A bounded pool of workers starts the
+executions and a token bucket paces them, so a large replay cannot flood
+Document AI or the workflow quota. Replayed entries are recorded in a state
+file, so an interrupted replay can be rerun without starting anything twice.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from google.cloud import storage
+from google.cloud.workflows import executions_v1
+from google.cloud.workflows.executions_v1.types import Execution
+
+MANIFEST_PREFIX = "manifests/"
+LOCATION = "us-east4"
+WORKFLOW_ID = "invoice-processing-workflow"
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average.
+
+    Bursts of up to `burst` are allowed. acquire() blocks until a token is
+    available.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait for a token and take it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def parse_time(value):
+    """Parse an ISO 8601 time; naive times are UTC."""
+    parsed = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+
+def manifest_hours(since, until):
+    """Yield the start of every UTC hour that overlaps [since, until)."""
+    hour = since.astimezone(datetime.timezone.utc).replace(
+        minute=0, second=0, microsecond=0
+    )
+    while hour < until:
+        yield hour
+        hour += datetime.timedelta(hours=1)
+
+
+def read_manifest(storage_client, dlq_bucket, since, until, workers=16):
+    """Yield the manifest entries of failures in [since, until).
+
+    Only the manifest objects of those hours are listed and read, never the
+    whole bucket, and each hour's objects are downloaded concurrently.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for hour in manifest_hours(since, until):
+            prefix = hour.strftime(f"{MANIFEST_PREFIX}%Y/%m/%d/%H/")
+            blobs = [blob for blob in storage_client.list_blobs(dlq_bucket,
+                                                                prefix=prefix)
+                     if blob.name.endswith(".jsonl")]
+            for text in pool.map(lambda blob: blob.download_as_text(), blobs):
+                for line in text.splitlines():
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    if since <= parse_time(entry["failed_at"]) < until:
+                        yield entry
+
+
+def select_entries(entries, error_types=None, source_prefix=None,
+                   message_contains=None, latest_only=True, skip_ids=()):
+    """Filter manifest entries.
+
+    With latest_only, a source that failed several times is replayed once,
+    from its most recent failure. Entries in skip_ids are dropped after that,
+    so a source whose latest failure was replayed is not replayed again from
+    an older one.
+    """
+    selected = []
+    for entry in entries:
+        if error_types and entry["error_type"] not in error_types:
+            continue
+        if source_prefix and not entry["source"].startswith(source_prefix):
+            continue
+        if message_contains and message_contains not in (
+            entry.get("error_message") or ""
+        ):
+            continue
+        selected.append(entry)
+
+    if latest_only:
+        latest = {}
+        for entry in selected:
+            current = latest.get(entry["source"])
+            if current is None or entry["failed_at"] > current["failed_at"]:
+                latest[entry["source"]] = entry
+        selected = list(latest.values())
+    selected = [entry for entry in selected if entry["id"] not in skip_ids]
+    return sorted(selected, key=lambda entry: entry["failed_at"])
+
+
+def load_original_event(storage_client, dlq_path):
+    """Read the original GCS event saved in a DLQ entry."""
+    bucket, _, name = dlq_path[len("gs://"):].partition("/")
+    content = json.loads(storage_client.bucket(bucket).blob(name).download_as_text())
+    return content["original_event"]
+
+
+class WorkflowStarter:
+    """Starts invoice-processing-workflow executions with one shared client."""
+
+    def __init__(self, project_id, processor_id, dlq_url, client=None):
+        self.client = client or executions_v1.ExecutionsClient()
+        self.parent = (
+            f"projects/{project_id}/locations/{LOCATION}/workflows/{WORKFLOW_ID}"
+        )
+        self.argument = {
+            "project_id": project_id,
+            "processor_id": processor_id,
+            "dlq_url": dlq_url,
+        }
+
+    def start(self, event):
+        """Start an execution for event and return its name."""
+        execution = Execution(argument=json.dumps({"event": event, **self.argument}))
+        return self.client.create_execution(
+            parent=self.parent, execution=execution
+        ).name
+
+
+class ReplayState:
+    """IDs of replayed manifest entries, saved as JSON."""
+
+    def __init__(self, path):
+        self.path = path
+        self.replayed = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.replayed = json.load(f)["replayed"]
+        self._lock = threading.Lock()
+
+    def mark(self, entry_id, execution_name):
+        """Record that entry_id was replayed as execution_name."""
+        with self._lock:
+            self.replayed[entry_id] = execution_name
+
+    def save(self):
+        """Write the state to its path, if it has one."""
+        if not self.path:
+            return
+        with self._lock:
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump({"replayed": self.replayed}, f)
+            os.replace(temp_path, self.path)
+
+
+def replay(entries, storage_client, starter, concurrency=4, rate=2.0, burst=None,
+           state=None, save_every=50):
+    """Start an execution for each entry and return a report."""
+    state = state or ReplayState(None)
+    bucket = TokenBucket(rate, burst or concurrency)
+    started = []
+    failed = []
+
+    def replay_one(entry):
+        bucket.acquire()
+        event = load_original_event(storage_client, entry["dlq_path"])
+        return starter.start(event)
+
+    start = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = {pool.submit(replay_one, entry): entry for entry in entries}
+            for future in as_completed(futures):
+                entry = futures[future]
+                try:
+                    execution_name = future.result()
+                except Exception as e:
+                    failed.append({"id": entry["id"], "source": entry["source"],
+                                   "error": str(e)})
+                    print(f"Failed to replay {entry['source']}: {e}")
+                    continue
+                state.mark(entry["id"], execution_name)
+                started.append(entry)
+                if len(started) % save_every == 0:
+                    state.save()
+                    print(f"Replayed {len(started)} of {len(entries)}")
+    finally:
+        state.save()
+    elapsed = time.monotonic() - start
+
+    return {
+        "selected": len(entries),
+        "replayed": len(started),
+        "failed": len(failed),
+        "failures": failed,
+        "by_error_type": dict(Counter(entry["error_type"] for entry in started)),
+        "duration_s": elapsed,
+        "replays_per_s": len(started) / elapsed if elapsed else 0,
+    }
+
+
+def print_selection(entries):
+    """Print the selected failures by error type, and the first of them."""
+    print(f"{len(entries)} failures selected")
+    for error_type, count in Counter(e["error_type"] for e in entries).most_common():
+        print(f"  {error_type}: {count}")
+    for entry in entries[:20]:
+        print(f"  {entry['failed_at']}  {entry['error_type']:<20} {entry['source']}")
+    if len(entries) > 20:
+        print(f"  ... and {len(entries) - 20} more")
+
+
+def print_report(report):
+    """Print how many entries were replayed, by error type."""
+    print(f"\nReplayed {report['replayed']} of {report['selected']} "
+          f"({report['failed']} failed) in {report['duration_s']:.1f} s "
+          f"({report['replays_per_s']:.2f}/s)")
+    for error_type, count in report["by_error_type"].items():
+        print(f"  {error_type}: {count}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay failed invoices from the DLQ manifests."
+    )
+    parser.add_argument("project_id")
+    parser.add_argument("--dlq-bucket", default=None,
+                        help="DLQ bucket (default: <project>-invoices-dlq).")
+    parser.add_argument("--processor-id", help="Required unless --dry-run.")
+    parser.add_argument("--dlq-url", help="Required unless --dry-run.")
+    parser.add_argument("--since", default=None,
+                        help="Earliest failure time, ISO 8601 (default: 24 h ago).")
+    parser.add_argument("--until", default=None,
+                        help="Latest failure time, ISO 8601 (default: now).")
+    parser.add_argument("--error-type", action="append", default=[],
+                        help="Only replay this error type; may be repeated.")
+    parser.add_argument("--source-prefix", default=None,
+                        help="Only replay sources under this gs:// prefix.")
+    parser.add_argument("--message-contains", default=None,
+                        help="Only replay failures whose message contains this.")
+    parser.add_argument("--all-attempts", action="store_true",
+                        help="Replay every failure, not only a source's latest.")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="Executions being started at once.")
+    parser.add_argument("--rate", type=float, default=2.0,
+                        help="Executions started per second.")
+    parser.add_argument("--burst", type=int, default=None,
+                        help="Token bucket size (default: --concurrency).")
+    parser.add_argument("--state", default="replay_state.json",
+                        help="Records replayed entries so reruns skip them.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only list the failures that would be replayed.")
+    parser.add_argument("--report", default=None,
+                        help="Optional path to write the report as JSON.")
+    args = parser.parse_args()
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    since = parse_time(args.since) if args.since else now - datetime.timedelta(days=1)
+    until = parse_time(args.until) if args.until else now
+    storage_client = storage.Client(project=args.project_id)
+    state = ReplayState(args.state)
+
+    entries = select_entries(
+        read_manifest(storage_client,
+                      args.dlq_bucket or f"{args.project_id}-invoices-dlq",
+                      since, until),
+        error_types=set(args.error_type),
+        source_prefix=args.source_prefix,
+        message_contains=args.message_contains,
+        latest_only=not args.all_attempts,
+        skip_ids=set(state.replayed),
+    )[:args.limit]
+    print_selection(entries)
+    if args.dry_run or not entries:
+        sys.exit(0)
+
+    if not args.processor_id or not args.dlq_url:
+        print("Error: --processor-id and --dlq-url are required to replay.")
+        sys.exit(1)
+
+    report = replay(
+        entries, storage_client,
+        WorkflowStarter(args.project_id, args.processor_id, args.dlq_url),
+        concurrency=args.concurrency, rate=args.rate, burst=args.burst, state=state,
+    )
+    print_report(report)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if report["failed"] else 0)
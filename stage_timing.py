@@ -0,0 +1,37 @@
+"""Stage timing records written by trigger_workflow and the helper functions.
+
+trace_report.py reads them back. Each function's deploy ships this file:
+trigger_workflow deploys from the repo root, and Cloud Build copies it into
+date_parser_helper/ and move_to_dlq_helper/ before deploying them, so every
+function writes the same record schema.
+"""
+import json
+import os
+import threading
+import time
+
+# Records are printed as JSON for Cloud Logging, or appended to TRACE_FILE
+# when it is set (local runs without cloud access)
+TRACE_FILE = os.environ.get("TRACE_FILE")
+# The workflow passes the trace ID created by trigger_workflow in this header
+TRACE_HEADER = "X-Trace-Id"
+
+_trace_lock = threading.Lock()
+
+
+def log_stage_timing(stage, trace_id, started_at, status, **fields):
+    """Emit one stage timing record; see trace_report.py."""
+    line = json.dumps({
+        "message": "Stage timing",
+        "stage": stage,
+        "trace_id": trace_id,
+        "start_time": started_at,
+        "duration_ms": (time.time() - started_at) * 1000,
+        "status": status,
+        **fields,
+    })
+    if TRACE_FILE:
+        with _trace_lock, open(TRACE_FILE, "a") as f:
+            f.write(line + "\n")
+    else:
+        print(line)
@@ -0,0 +1,6 @@
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "load_testing"))
+sys.path.insert(0, REPO_ROOT)
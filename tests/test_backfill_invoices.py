@@ -0,0 +1,263 @@
+import json
+
+import backfill_invoices
+import pytest
+from local_gcp import LocalBigQueryClient, LocalStorageClient
+from workflow_runner import load_function_module
+
+review_queue = load_function_module("backend_api/review_queue.py",
+                                    "test_backfill_review_queue")
+
+INPUT_URI = "gs://archive/invoices/"
+OUTPUT_URI = "gs://backfill-output/output/"
+TABLE = "local-project.automation_outputs.processed_invoices"
+
+
+def entities(confidence=0.95):
+    """Return the output entities of an invoice, all with `confidence`."""
+    return [
+        {"type": "vendor_name", "mentionText": "Acme", "confidence": confidence},
+        {"type": "invoice_date", "mentionText": "2024-01-31",
+         "normalizedValue": {"text": "2024-01-31"}, "confidence": confidence},
+        {"type": "due_date", "mentionText": "03/01/2024", "confidence": confidence},
+        {"type": "total_amount", "mentionText": "$1,250.00",
+         "confidence": confidence},
+    ]
+
+
+class FakeBatchDocumentAI:
+    """Finishes each operation on its first poll with the configured outcomes.
+
+    `outputs` maps a document URI to its entities, or to an error string.
+    `failures` operations fail as a whole before any succeeds, and polling
+    raises KeyboardInterrupt after `interrupt_after` finished operations.
+    Pass the `operations` of an interrupted client to resume its operations.
+    """
+
+    def __init__(self, storage_client, outputs, failures=0, interrupt_after=None,
+                 operations=None):
+        self.storage_client = storage_client
+        self.outputs = outputs
+        self.failures = failures
+        self.interrupt_after = interrupt_after
+        self.submitted = []
+        self.operations = {} if operations is None else operations
+
+    def submit(self, documents, output_uri):
+        """Record the batch and return an operation name."""
+        name = f"operations/{len(self.operations)}"
+        self.submitted.append([uri for uri, _ in documents])
+        self.operations[name] = (documents, output_uri)
+        return name
+
+    def poll(self, operation_name):
+        """Write the batch's output and return its statuses, or fail."""
+        if self.interrupt_after is not None:
+            if self.interrupt_after == 0:
+                raise KeyboardInterrupt
+            self.interrupt_after -= 1
+        if self.failures:
+            self.failures -= 1
+            raise backfill_invoices.OperationFailedError(
+                f"Operation {operation_name} failed: internal error"
+            )
+        documents, output_uri = self.operations[operation_name]
+        bucket_name, prefix = backfill_invoices.split_gcs_uri(output_uri)
+        bucket = self.storage_client.bucket(bucket_name)
+        statuses = []
+        for index, (uri, _) in enumerate(documents):
+            output = self.outputs[uri]
+            if isinstance(output, str):
+                statuses.append((uri, "", output))
+                continue
+            # Split across two shards, like the API does for large documents
+            for shard in range(2):
+                bucket.blob(f"{prefix}{index}/doc-{shard}.json").upload_from_string(
+                    json.dumps({"entities": output[shard::2]})
+                )
+            statuses.append((uri, f"gs://{bucket_name}/{prefix}{index}", None))
+        return statuses
+
+
+@pytest.fixture
+def storage_client():
+    """Return a local GCS with five invoices and a file that is not one."""
+    client = LocalStorageClient()
+    bucket = client.bucket("archive")
+    for i in range(5):
+        bucket.blob(f"invoices/invoice_{i}.pdf").upload_from_string(b"%PDF")
+    bucket.blob("invoices/notes.txt").upload_from_string(b"not an invoice")
+    return client
+
+
+class RecordingReviewStore(review_queue.SQLiteReviewStore):
+    """An in-memory review store that records the ID of every add()."""
+
+    def __init__(self):
+        super().__init__(":memory:")
+        self.added = []
+
+    def add(self, item):
+        """Record the item's ID and add it."""
+        self.added.append(item["id"])
+        return super().add(item)
+
+
+def invoice(i):
+    """Return the GCS URI of invoice `i`."""
+    return f"{INPUT_URI}invoice_{i}.pdf"
+
+
+def backfill(docai, storage_client, bigquery_client, tmp_path, **kwargs):
+    """Run a backfill with batches of two and no polling delay."""
+    return backfill_invoices.run_backfill(
+        docai, storage_client, bigquery_client, INPUT_URI, OUTPUT_URI, TABLE,
+        str(tmp_path / "checkpoint.json"), batch_size=2,
+        max_concurrent_operations=2, poll_interval=0, **kwargs,
+    )
+
+
+def loaded_sources(bigquery_client):
+    """Return the source of every loaded row, sorted."""
+    return sorted(row["source_file_path"] for row in bigquery_client.rows(TABLE))
+
+
+def test_backfill_loads_every_invoice(storage_client, tmp_path):
+    """Every invoice is extracted, normalized and loaded once."""
+    bigquery_client = LocalBigQueryClient()
+    docai = FakeBatchDocumentAI(storage_client,
+                                {invoice(i): entities() for i in range(5)})
+
+    report = backfill(docai, storage_client, bigquery_client, tmp_path)
+
+    assert (report["batches"], report["rows_loaded"]) == (3, 5)
+    assert loaded_sources(bigquery_client) == [invoice(i) for i in range(5)]
+    row = bigquery_client.rows(TABLE)[0]
+    assert row["invoice_date"] == "2024-01-31" and row["due_date"] == "2024-03-01"
+    assert row["total_amount"] == 1250.0
+
+
+def test_interrupted_backfill_resumes_without_reloading(storage_client, tmp_path):
+    """A rerun with the same checkpoint only submits the unfinished batches."""
+    bigquery_client = LocalBigQueryClient()
+    outputs = {invoice(i): entities() for i in range(5)}
+    first = FakeBatchDocumentAI(storage_client, outputs, interrupt_after=1)
+    with pytest.raises(KeyboardInterrupt):
+        backfill(first, storage_client, bigquery_client, tmp_path)
+    finished = first.submitted[0]
+
+    second = FakeBatchDocumentAI(storage_client, outputs,
+                                 operations=first.operations)
+    report = backfill(second, storage_client, bigquery_client, tmp_path)
+
+    # The operation still running at the interrupt is polled, not resubmitted
+    assert second.submitted == [[invoice(4)]]
+    assert finished not in second.submitted
+    assert report["rows_loaded"] == 5
+    assert loaded_sources(bigquery_client) == [invoice(i) for i in range(5)]
+
+
+def test_failed_operation_is_resubmitted(storage_client, tmp_path):
+    """An operation that fails as a whole is submitted again and then loads."""
+    bigquery_client = LocalBigQueryClient()
+    docai = FakeBatchDocumentAI(
+        storage_client, {invoice(i): entities() for i in range(5)}, failures=1
+    )
+
+    report = backfill(docai, storage_client, bigquery_client, tmp_path)
+
+    assert len(docai.submitted) == 4
+    assert (report["rows_loaded"], report["failed"]) == (5, 0)
+
+
+def test_operation_that_keeps_failing_does_not_block_the_rest(storage_client,
+                                                              tmp_path):
+    """After max_operation_attempts the batch is failed and the others finish."""
+    bigquery_client = LocalBigQueryClient()
+    outputs = {invoice(i): entities() for i in range(5)}
+    docai = FakeBatchDocumentAI(storage_client, outputs, failures=2)
+
+    report = backfill(docai, storage_client, bigquery_client, tmp_path,
+                      max_operation_attempts=1)
+
+    assert (report["rows_loaded"], report["failed"]) == (1, 4)
+    checkpoint = json.loads((tmp_path / "checkpoint.json").read_text())
+    assert [batch["state"] for batch in checkpoint["batches"]] == [
+        "failed", "failed", "done"
+    ]
+
+    # The next run submits the failed batches again
+    rerun = FakeBatchDocumentAI(storage_client, outputs)
+    report = backfill(rerun, storage_client, bigquery_client, tmp_path)
+    assert len(rerun.submitted) == 2
+    assert (report["rows_loaded"], report["failed"]) == (5, 0)
+    assert loaded_sources(bigquery_client) == [invoice(i) for i in range(5)]
+
+
+def test_document_errors_and_missing_statuses_are_failed(storage_client,
+                                                        tmp_path):
+    """Per-document errors, and documents without a status, are reported."""
+    bigquery_client = LocalBigQueryClient()
+    outputs = {invoice(i): entities() for i in range(5)}
+    outputs[invoice(0)] = "Unsupported file"
+    docai = FakeBatchDocumentAI(storage_client, outputs)
+    poll = docai.poll
+    # The operation for the last batch forgets its only document
+    docai.poll = lambda name: [] if name == "operations/2" else poll(name)
+
+    report = backfill(docai, storage_client, bigquery_client, tmp_path)
+
+    assert (report["rows_loaded"], report["failed"]) == (3, 2)
+    assert loaded_sources(bigquery_client) == [invoice(i) for i in range(1, 4)]
+
+
+def test_low_confidence_invoices_go_to_review(storage_client, tmp_path):
+    """Invoices below the confidence threshold are not loaded but reviewed."""
+    bigquery_client = LocalBigQueryClient()
+    outputs = {invoice(i): entities() for i in range(5)}
+    outputs[invoice(3)] = entities(confidence=0.5)
+    review_output = tmp_path / "needs_review.jsonl"
+    review_store = review_queue.SQLiteReviewStore(":memory:")
+    docai = FakeBatchDocumentAI(storage_client, outputs)
+
+    report = backfill(docai, storage_client, bigquery_client, tmp_path,
+                      review_output=str(review_output), review_store=review_store)
+
+    assert (report["rows_loaded"], report["needs_review"]) == (4, 1)
+    assert invoice(3) not in loaded_sources(bigquery_client)
+    [line] = [json.loads(line) for line in review_output.read_text().splitlines()]
+    assert line["record"]["source_file_path"] == invoice(3)
+    assert line["reason"] == "Low confidence score for vendor_name"
+    # Queued the way the workflow queues its low-confidence invoices
+    [item] = review_store.list(review_queue.PENDING, 10)
+    assert item["id"] == "gs%3A%2F%2Farchive%2Finvoices%2Finvoice_3.pdf%23"
+    assert (item["source_file_path"], item["review_reason"]) == (
+        invoice(3), "Low confidence score for vendor_name"
+    )
+    assert item["record"] == line["record"]
+    assert item["entities"]["invoice_date"] == {
+        "value": "2024-01-31", "confidence": 0.5, "normalized": "2024-01-31"
+    }
+
+
+def test_resumed_backfill_queues_each_review_once(storage_client, tmp_path):
+    """Reviews of batches finished before an interruption are not queued again."""
+    bigquery_client = LocalBigQueryClient()
+    outputs = {invoice(i): entities(confidence=0.5) for i in range(5)}
+    review_store = RecordingReviewStore()
+    first = FakeBatchDocumentAI(storage_client, outputs, interrupt_after=1)
+    with pytest.raises(KeyboardInterrupt):
+        backfill(first, storage_client, bigquery_client, tmp_path,
+                 review_store=review_store)
+    assert review_store.count(review_queue.PENDING) == 2
+
+    second = FakeBatchDocumentAI(storage_client, outputs,
+                                 operations=first.operations)
+    backfill(second, storage_client, bigquery_client, tmp_path,
+             review_store=review_store)
+
+    assert len(review_store.added) == len(set(review_store.added)) == 5
+    items = review_store.list(review_queue.PENDING, 10)
+    assert sorted(item["source_file_path"] for item in items) == [
+        invoice(i) for i in range(5)
+    ]
@@ -0,0 +1,186 @@
+import threading
+import time
+
+import flask
+import pytest
+from workflow_runner import load_function_module
+
+bigquery_writer = load_function_module("bigquery_writer/main.py",
+                                       "test_bigquery_writer_main")
+
+
+class FakeSink:
+    """Records written batches; can hold writes back or fail them."""
+
+    def __init__(self, failures=0):
+        self.batches = []
+        self.failures = failures
+        self.release = threading.Event()
+        self.release.set()
+
+    def write(self, rows, row_ids):
+        """Wait until released, then fail or record the batch."""
+        self.release.wait(5)
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("BigQuery is unavailable")
+        self.batches.append(list(row_ids))
+
+
+def make_writer(sink, **kwargs):
+    """Return a BatchWriter over `sink` that does not log flushes."""
+    kwargs.setdefault("max_batch_delay", 60)
+    return bigquery_writer.BatchWriter(sink, log_flushes=False, **kwargs)
+
+
+def rows_for(*row_ids):
+    """Return (rows, row_ids) for records named by their row IDs."""
+    return [{"source_file_path": row_id} for row_id in row_ids], list(row_ids)
+
+
+def wait_for(condition, timeout=5):
+    """Wait until condition() is true."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def call_function(writer, body):
+    """Call the HTTP function with `writer` installed and return its response."""
+    bigquery_writer.writer = writer
+    try:
+        with flask.Flask(__name__).test_request_context(method="POST", json=body):
+            response = flask.make_response(
+                bigquery_writer.bigquery_writer(flask.request)
+            )
+    finally:
+        bigquery_writer.writer = None
+    return response.get_json(), response.status_code, response.headers
+
+
+def test_full_batch_is_flushed_without_waiting():
+    """A batch is written as soon as it holds max_batch_rows rows."""
+    sink = FakeSink()
+    writer = make_writer(sink, max_batch_rows=3)
+    start = time.monotonic()
+    assert writer.write(*rows_for("a", "b", "c")) == {"written": 3, "duplicates": 0}
+    assert time.monotonic() - start < 5
+    assert sink.batches == [["a", "b", "c"]]
+
+
+def test_partial_batch_is_flushed_after_the_delay():
+    """A batch that never fills up is written once its oldest row waited long enough."""
+    sink = FakeSink()
+    writer = make_writer(sink, max_batch_rows=100, max_batch_delay=0.05)
+    start = time.monotonic()
+    writer.write(*rows_for("a", "b"))
+    assert time.monotonic() - start >= 0.05
+    assert sink.batches == [["a", "b"]]
+
+
+def test_concurrent_requests_share_a_batch():
+    """Rows from requests that arrive together are written in one batch."""
+    sink = FakeSink()
+    writer = make_writer(sink, max_batch_rows=4, max_batch_delay=5)
+    threads = [threading.Thread(target=writer.write, args=rows_for(f"{i}a", f"{i}b"))
+               for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(sink.batches) == 1 and sorted(sink.batches[0]) == [
+        "0a", "0b", "1a", "1b"
+    ]
+
+
+def test_recently_written_rows_are_not_written_again():
+    """Row IDs in the dedup window, or repeated in a request, are dropped."""
+    sink = FakeSink()
+    writer = make_writer(sink, max_batch_rows=1, max_batch_delay=0)
+    writer.write(*rows_for("a"))
+    assert writer.write(*rows_for("a", "b", "b")) == {"written": 1, "duplicates": 2}
+    assert sink.batches == [["a"], ["b"]]
+    assert writer.stats()["duplicate_rows"] == 2
+
+
+def test_dedup_window_forgets_old_rows():
+    """Rows older than the dedup window are written again."""
+    sink = FakeSink()
+    writer = make_writer(sink, max_batch_rows=1, max_batch_delay=0, dedup_window=1)
+    writer.write(*rows_for("a"))
+    writer.write(*rows_for("b"))
+    assert writer.write(*rows_for("a")) == {"written": 1, "duplicates": 0}
+
+
+def test_full_buffer_is_rejected_with_429():
+    """Rows beyond max_pending_rows raise BackpressureError, answered with 429."""
+    sink = FakeSink()
+    sink.release.clear()
+    writer = make_writer(sink, max_batch_rows=2, max_pending_rows=2)
+    blocked = threading.Thread(target=writer.write, args=rows_for("a", "b"))
+    blocked.start()
+    wait_for(lambda: writer.stats()["pending_rows"] == 2)
+
+    with pytest.raises(bigquery_writer.BackpressureError):
+        writer.write(*rows_for("c"))
+    body, status, headers = call_function(
+        writer, {"rows": [{"json": {}, "source": "gs://bucket/c.pdf#1"}]}
+    )
+    assert status == 429
+    assert headers["Retry-After"] == str(bigquery_writer.RETRY_AFTER_SECONDS)
+    assert writer.stats()["rejected_rows"] == 2
+
+    sink.release.set()
+    blocked.join(5)
+    assert sink.batches == [["a", "b"]]
+
+
+def test_failed_flush_is_reported_and_can_be_retried():
+    """A failed write raises to every waiting caller and keeps no row as written."""
+    sink = FakeSink(failures=1)
+    writer = make_writer(sink, max_batch_rows=2)
+
+    with pytest.raises(RuntimeError, match="unavailable"):
+        writer.write(*rows_for("a", "b"))
+    stats = writer.stats()
+    assert (stats["failed_flushes"], stats["rows_written"]) == (1, 0)
+    assert stats["pending_rows"] == 0
+
+    # The rows were not marked written, so a retry writes them
+    assert writer.write(*rows_for("a", "b")) == {"written": 2, "duplicates": 0}
+    assert sink.batches == [["a", "b"]]
+
+
+def test_failed_flush_answers_500():
+    """The HTTP function reports a failed write instead of succeeding."""
+    writer = make_writer(FakeSink(failures=1), max_batch_rows=1)
+    body, status, _ = call_function(
+        writer, {"rows": [{"json": {}, "source": "gs://bucket/a.pdf#1"}]}
+    )
+    assert status == 500 and "unavailable" in body["error"]
+
+
+def test_rows_waiting_on_a_failed_batch_are_reported():
+    """A request whose rows were already queued by another fails with that batch."""
+    sink = FakeSink(failures=1)
+    sink.release.clear()
+    writer = make_writer(sink, max_batch_rows=2, max_batch_delay=0.01)
+    errors = []
+
+    def write():
+        try:
+            writer.write(*rows_for("a"))
+        except RuntimeError as e:
+            errors.append(e)
+
+    first = threading.Thread(target=write)
+    first.start()
+    wait_for(lambda: writer.stats()["pending_rows"] == 1)
+    second = threading.Thread(target=write)
+    second.start()
+    time.sleep(0.05)
+    sink.release.set()
+    first.join(5)
+    second.join(5)
+    assert len(errors) == 2
@@ -0,0 +1,70 @@
+import create_gcs_bucket
+import pytest
+from google.api_core.exceptions import Conflict
+from google.cloud import storage
+
+
+class FakeStorageClient:
+    """Creates real Bucket objects and records patches instead of sending them."""
+
+    def __init__(self, existing=None):
+        self.existing = existing
+        self.created = []
+        self.patched = []
+
+    def bucket(self, name):
+        """Return an unsaved bucket object."""
+        return storage.Bucket(None, name)
+
+    def create_bucket(self, bucket, location=None):
+        """Create a bucket; raise Conflict if one already exists."""
+        if self.existing is not None:
+            raise Conflict(f"Bucket {bucket.name} already exists")
+        self.created.append(bucket)
+        return bucket
+
+    def get_bucket(self, name):
+        """Return the existing bucket, with patch() recorded."""
+        self.existing.patch = lambda: self.patched.append(
+            list(self.existing.lifecycle_rules)
+        )
+        return self.existing
+
+
+UPLOAD_PARTS_RULE = {
+    "action": {"type": "Delete"},
+    "condition": {"age": 1, "matchesPrefix": ["_upload_parts/"]},
+}
+
+
+def existing_bucket(*rules):
+    """Return a bucket that already exists with the given lifecycle rules."""
+    bucket = storage.Bucket(None, "invoices")
+    bucket.lifecycle_rules = rules
+    bucket._changes.clear()
+    return bucket
+
+
+def test_new_bucket_gets_the_rule():
+    """A created bucket deletes upload parts after a day."""
+    client = FakeStorageClient()
+    bucket = create_gcs_bucket.create_bucket("project", "invoices", "us", client)
+    assert list(bucket.lifecycle_rules) == [UPLOAD_PARTS_RULE]
+
+
+@pytest.mark.parametrize("other_rules", [(), ({
+    "action": {"type": "Delete"}, "condition": {"age": 365},
+},)])
+def test_existing_bucket_gets_the_missing_rule(other_rules):
+    """An existing bucket without the rule is patched and keeps its rules."""
+    client = FakeStorageClient(existing_bucket(*other_rules))
+    create_gcs_bucket.create_bucket("project", "invoices", "us", client)
+    assert client.patched == [[*other_rules, UPLOAD_PARTS_RULE]]
+
+
+def test_existing_bucket_with_the_rule_is_not_patched():
+    """Rerunning against a bucket that has the rule changes nothing."""
+    client = FakeStorageClient(existing_bucket(UPLOAD_PARTS_RULE))
+    bucket = create_gcs_bucket.create_bucket("project", "invoices", "us", client)
+    assert client.patched == []
+    assert list(bucket.lifecycle_rules) == [UPLOAD_PARTS_RULE]
@@ -0,0 +1,195 @@
+import json
+from collections import Counter
+
+import deploy
+import pytest
+from run_deploy_benchmark import PROJECT_ID, FakeCloud
+
+Clients = deploy.Clients
+
+
+def fake_cloud(fail=None):
+    """Return a fake project whose API calls and clients take no time."""
+    return FakeCloud(latency_scale=0, client_init_latency=0, fail=fail)
+
+
+def deploy_to(cloud, state=None, plan=False):
+    """Run the provisioning graph against `cloud` and return its timings."""
+    _, timings = deploy.run_steps(
+        deploy.build_steps(PROJECT_ID),
+        deploy.Clients(PROJECT_ID, factory=cloud.client_factory),
+        state=state, plan=plan,
+    )
+    return timings
+
+
+def statuses(timings):
+    """Return the status of each step."""
+    return {name: timing["status"] for name, timing in timings.items()}
+
+
+def writes(calls):
+    """Return the calls that create or change a resource."""
+    return {method: count for method, count in calls.items()
+            if not method.split(".")[1].startswith(("get_", "list_", "lookup_"))}
+
+
+def run_main(monkeypatch, cloud, *args):
+    """Run deploy.py's command line against `cloud`."""
+    monkeypatch.setattr(
+        deploy, "Clients",
+        lambda project_id: Clients(project_id, factory=cloud.client_factory),
+    )
+    monkeypatch.setattr("sys.argv", ["deploy.py", PROJECT_ID, *args])
+    deploy.main()
+
+
+def test_steps_start_after_their_dependencies():
+    """Each step starts only after every step it depends on has finished."""
+    cloud = fake_cloud()
+
+    timings = deploy_to(cloud)
+
+    assert set(statuses(timings).values()) == {"ok"}
+    for step in deploy.build_steps(PROJECT_ID):
+        for dependency in step.depends_on:
+            finished = timings[dependency]["start_s"] + timings[dependency][
+                "duration_s"
+            ]
+            assert timings[step.name]["start_s"] >= finished
+    assert len(cloud.triggers) == len(cloud.processors) == 1
+
+
+def test_dependency_order_with_one_worker():
+    """One worker runs the steps one at a time, dependencies first."""
+    started = []
+
+    def step(name, depends_on=()):
+        def func(clients, outputs):
+            assert set(depends_on) <= set(outputs)
+            started.append(name)
+            return {"name": name}
+        return deploy.Step(name, func, depends_on)
+
+    steps = [step("c", ["a", "b"]), step("b", ["a"]), step("a")]
+    outputs, _ = deploy.run_steps(steps, deploy.Clients(PROJECT_ID), max_workers=1)
+
+    assert started == ["a", "b", "c"]
+    assert outputs == {"a": {"name": "a"}, "b": {"name": "b"}, "c": {"name": "c"}}
+
+
+def test_unknown_dependency_is_rejected():
+    """A step depending on a step that does not exist is an error."""
+    steps = [deploy.Step("a", lambda clients, outputs: {}, ["missing"])]
+    with pytest.raises(ValueError, match="unknown steps"):
+        deploy.run_steps(steps, deploy.Clients(PROJECT_ID))
+
+
+def test_failed_step_skips_its_dependents():
+    """Steps depending on a failed step are skipped; the others still run."""
+    cloud = fake_cloud(fail="iam.create_service_account")
+    state = deploy.DeploymentState(None, PROJECT_ID)
+
+    timings = deploy_to(cloud, state)
+
+    assert statuses(timings) == {
+        "bucket": "ok",
+        "bigquery": "ok",
+        "documentai_processor": "ok",
+        "service_account": "failed",
+        "alert_policy": "ok",
+        "iam_roles": "skipped",
+        "eventarc_trigger": "skipped",
+    }
+    assert timings["eventarc_trigger"]["error"] == "Blocked by iam_roles"
+    assert cloud.calls["projects.set_iam_policy"] == 0
+    assert not cloud.triggers
+    assert state.get("service_account") is None
+    assert state.get("bucket") == {"bucket": deploy.BUCKET_NAME,
+                                   "updated_at": state.get("bucket")["updated_at"]}
+
+
+def test_plan_makes_no_writes(tmp_path):
+    """A plan only verifies recorded resources and saves nothing."""
+    cloud = fake_cloud()
+    state_path = tmp_path / "state.json"
+    state = deploy.DeploymentState(str(state_path), PROJECT_ID)
+    deploy_to(cloud, state)
+    saved = state_path.read_text()
+    cloud.triggers.clear()
+    calls_before = Counter(cloud.calls)
+
+    timings = deploy_to(cloud, deploy.DeploymentState(str(state_path), PROJECT_ID),
+                        plan=True)
+
+    assert statuses(timings)["eventarc_trigger"] == "create"
+    assert Counter(statuses(timings).values()) == {"in_place": 6, "create": 1}
+    assert writes(Counter(cloud.calls) - calls_before) == {}
+    assert not cloud.triggers
+    assert state_path.read_text() == saved
+
+
+def test_plan_without_state_calls_nothing():
+    """With nothing recorded, a plan creates every step without any API call."""
+    cloud = fake_cloud()
+
+    timings = deploy_to(cloud, deploy.DeploymentState(None, PROJECT_ID), plan=True)
+
+    assert set(statuses(timings).values()) == {"create"}
+    assert not cloud.calls and not cloud.clients_created
+
+
+def test_redeploy_with_state_only_verifies():
+    """Recorded resources that are still in place are not created again."""
+    cloud = fake_cloud()
+    state = deploy.DeploymentState(None, PROJECT_ID)
+    deploy_to(cloud, state)
+    calls_before = Counter(cloud.calls)
+
+    timings = deploy_to(cloud, state)
+
+    assert set(statuses(timings).values()) == {"in_place"}
+    assert writes(Counter(cloud.calls) - calls_before) == {}
+
+
+def test_refresh_reruns_every_step_and_updates_the_state(monkeypatch, tmp_path):
+    """--refresh ignores the records, runs every step and saves new records."""
+    cloud = fake_cloud()
+    state_path = tmp_path / "state.json"
+    report_path = tmp_path / "report.json"
+    run_main(monkeypatch, cloud, "--state", str(state_path))
+    content = json.loads(state_path.read_text())
+    processor = content["resources"]["documentai_processor"]["processor"]
+    # A record that no longer matches the processor
+    content["resources"]["documentai_processor"]["processor"] = "stale"
+    state_path.write_text(json.dumps(content))
+
+    run_main(monkeypatch, cloud, "--state", str(state_path), "--refresh",
+             "--report", str(report_path))
+
+    steps = json.loads(report_path.read_text())["steps"]
+    assert {timing["status"] for timing in steps.values()} == {"ok"}
+    resources = json.loads(state_path.read_text())["resources"]
+    assert set(resources) == set(steps)
+    assert resources["documentai_processor"]["processor"] == processor
+    assert resources["bucket"]["updated_at"] > content["resources"]["bucket"][
+        "updated_at"
+    ]
+
+
+def test_plan_with_refresh_saves_nothing(monkeypatch, tmp_path):
+    """--plan --refresh reports every step as created and keeps the state file."""
+    cloud = fake_cloud()
+    state_path = tmp_path / "state.json"
+    report_path = tmp_path / "report.json"
+    run_main(monkeypatch, cloud, "--state", str(state_path))
+    saved = state_path.read_text()
+    calls_before = Counter(cloud.calls)
+
+    run_main(monkeypatch, cloud, "--state", str(state_path), "--plan", "--refresh",
+             "--report", str(report_path))
+
+    steps = json.loads(report_path.read_text())["steps"]
+    assert {timing["status"] for timing in steps.values()} == {"create"}
+    assert Counter(cloud.calls) == calls_before
+    assert state_path.read_text() == saved
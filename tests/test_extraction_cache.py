@@ -0,0 +1,146 @@
+import flask
+import pytest
+from workflow_runner import load_function_module
+
+extraction_cache = load_function_module("extraction_cache/main.py",
+                                        "test_extraction_cache_main")
+
+
+class Clock:
+    """A settable stand-in for time.time()."""
+
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        """Return the current time."""
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replace the cache's clock with one the test advances."""
+    clock = Clock()
+    monkeypatch.setattr(extraction_cache.time, "time", clock)
+    return clock
+
+
+def make_cache(**kwargs):
+    """Return an ExtractionCache over an in-memory SQLite store."""
+    return extraction_cache.ExtractionCache(
+        extraction_cache.SQLiteStore(":memory:"), **kwargs
+    )
+
+
+def call_function(cache, method="POST", path="/", body=None):
+    """Call the HTTP function with `cache` installed and return its response."""
+    extraction_cache.cache = cache
+    try:
+        with flask.Flask(__name__).test_request_context(path, method=method,
+                                                        json=body):
+            response = flask.make_response(
+                extraction_cache.extraction_cache(flask.request)
+            )
+    finally:
+        extraction_cache.cache = None
+    return response.get_json(), response.status_code
+
+
+def test_hit_and_miss(clock):
+    """A stored value is returned; an unknown key is a miss."""
+    cache = make_cache()
+    cache.put("sha256:a", {"entities": [{"type": "vendor_name"}]})
+
+    assert cache.get("sha256:a") == {"entities": [{"type": "vendor_name"}]}
+    assert cache.get("sha256:b") is None
+
+
+def test_hit_records_last_use(clock):
+    """A hit moves the entry's last use forward."""
+    cache = make_cache()
+    cache.put("sha256:a", {})
+    clock.now += 60
+
+    cache.get("sha256:a")
+
+    assert cache.store.get("sha256:a")["last_used_at"] == clock.now
+
+
+def test_entries_expire_after_ttl(clock):
+    """An entry is a hit until its TTL and is deleted once expired."""
+    cache = make_cache(ttl_seconds=3600)
+    cache.put("sha256:a", {"total": 1})
+
+    clock.now += 3599
+    assert cache.get("sha256:a") == {"total": 1}
+    clock.now += 1
+    assert cache.get("sha256:a") is None
+    assert cache.store.get("sha256:a") is None
+    assert cache.stats()["expired"] == 1
+
+
+def test_cap_is_enforced_every_n_puts(clock):
+    """The least recently used entries are evicted on every Nth put only."""
+    cache = make_cache(max_entries=3, eviction_check_interval=5)
+    for i in range(4):
+        clock.now += 1
+        cache.put(f"sha256:{i}", {"i": i})
+    # Not checked yet: four entries over a cap of three
+    assert cache.store.count() == 4
+    clock.now += 1
+    cache.get("sha256:0")
+
+    clock.now += 1
+    cache.put("sha256:4", {"i": 4})
+
+    assert cache.store.count() == 3
+    assert cache.stats()["evictions"] == 2
+    # sha256:0 was used after sha256:1 and sha256:2 were stored
+    assert cache.get("sha256:0") == {"i": 0}
+    assert cache.get("sha256:1") is None
+    assert cache.get("sha256:2") is None
+
+
+def test_stats_count_lookups(clock):
+    """Hits, misses, expiries and puts are counted, with the hit rate."""
+    cache = make_cache(ttl_seconds=10)
+    assert cache.stats()["hit_rate"] is None
+
+    cache.put("sha256:a", {})
+    cache.put("sha256:b", {})
+    cache.get("sha256:a")
+    cache.get("sha256:a")
+    cache.get("sha256:c")
+    clock.now += 10
+    cache.get("sha256:b")
+
+    assert cache.stats() == {"hits": 2, "misses": 2, "hit_rate": 0.5,
+                             "expired": 1, "puts": 2, "evictions": 0}
+
+
+def test_http_get_put_and_stats(clock):
+    """The HTTP function stores, returns and reports entries."""
+    cache = make_cache()
+
+    assert call_function(cache, body={"action": "get", "key": "sha256:a"}) == (
+        {"hit": False, "value": None}, 200
+    )
+    assert call_function(cache, body={"action": "put", "key": "sha256:a",
+                                      "value": {"total": 1}})[1] == 200
+    assert call_function(cache, body={"action": "get", "key": "sha256:a"}) == (
+        {"hit": True, "value": {"total": 1}}, 200
+    )
+    stats, status = call_function(cache, method="GET", path="/stats")
+    assert status == 200
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+
+@pytest.mark.parametrize("body", [
+    None,
+    {"action": "get"},
+    {"action": "put", "key": "sha256:a", "value": [1]},
+    {"action": "delete", "key": "sha256:a"},
+])
+def test_http_rejects_invalid_requests(clock, body):
+    """Requests without a key, value object or known action are rejected."""
+    assert call_function(make_cache(), body=body)[1] == 400
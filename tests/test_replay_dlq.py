@@ -0,0 +1,134 @@
+import datetime
+import json
+import types
+
+import replay_dlq
+from local_gcp import LocalStorageClient
+from workflow_runner import load_function_module
+
+move_to_dlq_helper = load_function_module("move_to_dlq_helper/main.py",
+                                          "test_move_to_dlq_helper_main")
+
+DLQ_BUCKET = "local-project-invoices-dlq"
+SINCE = datetime.datetime(2025, 7, 19, 13, 30, tzinfo=datetime.timezone.utc)
+UNTIL = SINCE + datetime.timedelta(hours=2)
+
+
+class FakeExecutionsClient:
+    """Records the executions it is asked to create."""
+
+    def __init__(self):
+        self.arguments = []
+
+    def create_execution(self, parent, execution):
+        """Record the execution's argument and return its name."""
+        self.arguments.append(json.loads(execution.argument))
+        return types.SimpleNamespace(
+            name=f"{parent}/executions/{len(self.arguments)}"
+        )
+
+
+def fail(storage_client, entry_id, name, minutes, error_type="HttpError"):
+    """Dead-letter an upload of `name` as the DLQ helper does; return its entry."""
+    failed_at = SINCE + datetime.timedelta(minutes=minutes)
+    event = {"bucket": "local-invoices", "name": name, "generation": entry_id}
+    bucket = storage_client.bucket(DLQ_BUCKET)
+    dlq_name = f"failed/{entry_id}.json"
+    bucket.blob(dlq_name).upload_from_string(json.dumps({"original_event": event}))
+    entry = move_to_dlq_helper.manifest_entry(
+        entry_id, failed_at, f"gs://{DLQ_BUCKET}/{dlq_name}", event,
+        {"tags": [error_type], "message": f"{error_type} for {name}"},
+    )
+    move_to_dlq_helper.write_manifest_entry(bucket, entry, failed_at)
+    return entry
+
+
+def select(storage_client, state=None, **kwargs):
+    """Select the manifest entries of [SINCE, UNTIL), skipping replayed ones."""
+    return replay_dlq.select_entries(
+        replay_dlq.read_manifest(storage_client, DLQ_BUCKET, SINCE, UNTIL),
+        skip_ids=set(state.replayed) if state else (), **kwargs,
+    )
+
+
+def replay(storage_client, entries, state):
+    """Replay `entries` without pacing; return the report and started events."""
+    client = FakeExecutionsClient()
+    starter = replay_dlq.WorkflowStarter("local-project", "local-processor",
+                                         "http://dlq", client=client)
+    report = replay_dlq.replay(entries, storage_client, starter, rate=1000,
+                               state=state)
+    return report, [argument["event"]["name"] for argument in client.arguments]
+
+
+def ids(entries):
+    """Return the IDs of `entries`."""
+    return [entry["id"] for entry in entries]
+
+
+def test_read_manifest_only_returns_the_window():
+    """Entries are read from every hour of the window and nothing outside it."""
+    storage_client = LocalStorageClient()
+    fail(storage_client, "a", "invoice_a.pdf", minutes=-1)
+    fail(storage_client, "b", "invoice_b.pdf", minutes=0)
+    fail(storage_client, "c", "invoice_c.pdf", minutes=90)
+    fail(storage_client, "d", "invoice_d.pdf", minutes=120)
+
+    assert ids(select(storage_client)) == ["b", "c"]
+
+
+def test_select_filters_and_keeps_the_latest_failure():
+    """Filters apply, and a source that failed twice is selected once."""
+    storage_client = LocalStorageClient()
+    fail(storage_client, "a1", "invoice_a.pdf", minutes=1)
+    fail(storage_client, "b", "invoice_b.pdf", minutes=2,
+         error_type="ResourceLimitError")
+    fail(storage_client, "a2", "invoice_a.pdf", minutes=3)
+
+    assert ids(select(storage_client)) == ["b", "a2"]
+    assert ids(select(storage_client, latest_only=False)) == ["a1", "b", "a2"]
+    assert ids(select(storage_client, error_types={"HttpError"})) == ["a2"]
+    assert ids(select(storage_client, message_contains="invoice_b")) == ["b"]
+    assert ids(select(storage_client,
+                      source_prefix="gs://local-invoices/invoice_a")) == ["a2"]
+
+
+def test_replay_starts_the_original_events_and_rerun_starts_nothing(tmp_path):
+    """Each selected failure is replayed once, even across reruns."""
+    storage_client = LocalStorageClient()
+    fail(storage_client, "a", "invoice_a.pdf", minutes=1)
+    fail(storage_client, "b", "invoice_b.pdf", minutes=2)
+    state_path = str(tmp_path / "replay_state.json")
+
+    report, started = replay(storage_client, select(storage_client),
+                             replay_dlq.ReplayState(state_path))
+
+    assert (report["replayed"], report["failed"]) == (2, 0)
+    assert sorted(started) == ["invoice_a.pdf", "invoice_b.pdf"]
+    assert select(storage_client, replay_dlq.ReplayState(state_path)) == []
+
+
+def test_rerun_does_not_replay_an_older_failure(tmp_path):
+    """Once a source's latest failure is replayed, its older ones are not."""
+    storage_client = LocalStorageClient()
+    fail(storage_client, "a1", "invoice_a.pdf", minutes=1)
+    fail(storage_client, "a2", "invoice_a.pdf", minutes=2)
+    state_path = str(tmp_path / "replay_state.json")
+    replay(storage_client, select(storage_client),
+           replay_dlq.ReplayState(state_path))
+
+    state = replay_dlq.ReplayState(state_path)
+    assert list(state.replayed) == ["a2"]
+    assert select(storage_client, state) == []
+
+
+def test_new_failure_after_replay_is_selected(tmp_path):
+    """A source that fails again after its replay is selected on the rerun."""
+    storage_client = LocalStorageClient()
+    fail(storage_client, "a1", "invoice_a.pdf", minutes=1)
+    state_path = str(tmp_path / "replay_state.json")
+    replay(storage_client, select(storage_client),
+           replay_dlq.ReplayState(state_path))
+    fail(storage_client, "a2", "invoice_a.pdf", minutes=30)
+
+    assert ids(select(storage_client, replay_dlq.ReplayState(state_path))) == ["a2"]
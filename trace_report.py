@@ -0,0 +1,136 @@
+"""Per-stage latency report from stage timing records.
+
+trigger_workflow, the workflow and the date parser and DLQ helpers tag
+their timing records with the trace ID that trigger_workflow creates for
+each execution. This reads those records from JSON lines files written
+with TRACE_FILE set (local runs, no cloud access needed) or from a Cloud
+Logging export, for example:
+
+    gcloud logging read 'jsonPayload.message=~"^Stage timing"' \
+        --freshness=1d --format=json > stages.json
+
+and prints p50/p95/p99 for each stage, for the whole invoice and end to
+end per trace.
+"""
+import argparse
+import json
+import sys
+from collections import defaultdict
+
+# Report order; stages not listed here follow in alphabetical order
+STAGE_ORDER = [
+    "event_delivery", "trigger", "cache_lookup", "gcs_read", "document_ai",
+    "date_parser", "date_parser_helper", "bigquery_insert", "review_enqueue",
+    "dlq", "move_to_dlq_helper", "workflow", "end_to_end",
+]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def read_records(path):
+    """Yield timing records from a JSON lines file or a Cloud Logging export.
+
+    An export is a JSON array of log entries, whose records are in jsonPayload.
+    """
+    with open(path) as f:
+        content = f.read()
+    if content.lstrip().startswith("["):
+        entries = json.loads(content)
+    else:
+        entries = [json.loads(line) for line in content.splitlines() if line.strip()]
+    for entry in entries:
+        record = entry.get("jsonPayload", entry)
+        if str(record.get("message", "")).startswith("Stage timing"):
+            yield record
+
+
+def stage_samples(records):
+    """Split records into per-stage samples of (duration_ms, status).
+
+    Returns them with the end-to-end duration of every trace.
+    """
+    samples = defaultdict(list)
+    spans = defaultdict(list)
+    for record in records:
+        status = record.get("status", "ok")
+        if record["message"] == "Stage timings":
+            # One record per invoice from the workflow, with a map of stages.
+            # Its status is the invoice's, so it only counts against the total.
+            for stage, duration_ms in (record.get("stages") or {}).items():
+                samples[stage].append((duration_ms, "ok"))
+            samples["workflow"].append((record["total_ms"], status))
+            duration_ms = record["total_ms"]
+        else:
+            samples[record["stage"]].append((record["duration_ms"], status))
+            duration_ms = record["duration_ms"]
+            if record.get("event_age_ms") is not None:
+                samples["event_delivery"].append((record["event_age_ms"], status))
+        if record.get("trace_id") and record.get("start_time") is not None:
+            start = record["start_time"]
+            spans[record["trace_id"]].append((start, start + duration_ms / 1000))
+
+    for trace_spans in spans.values():
+        start = min(span[0] for span in trace_spans)
+        end = max(span[1] for span in trace_spans)
+        samples["end_to_end"].append(((end - start) * 1000, "ok"))
+    return samples, len(spans)
+
+
+def build_report(records):
+    """Return the trace count and latency percentiles for every stage."""
+    samples, traces = stage_samples(records)
+    stages = {}
+    ordered = [stage for stage in STAGE_ORDER if stage in samples]
+    ordered += sorted(stage for stage in samples if stage not in STAGE_ORDER)
+    for stage in ordered:
+        durations = [duration_ms for duration_ms, _ in samples[stage]]
+        stages[stage] = {
+            "count": len(durations),
+            "errors": sum(1 for _, status in samples[stage]
+                          if status in ("error", "failed")),
+            "p50_ms": percentile(durations, 50),
+            "p95_ms": percentile(durations, 95),
+            "p99_ms": percentile(durations, 99),
+            "max_ms": max(durations),
+        }
+    return {"traces": traces, "stages": stages}
+
+
+def print_report(report):
+    """Print the per-stage latency table."""
+    print(f"{report['traces']} traces\n")
+    print(f"{'stage':<22}{'count':>8}{'errors':>8}{'p50 ms':>11}{'p95 ms':>11}"
+          f"{'p99 ms':>11}{'max ms':>11}")
+    for stage, stats in report["stages"].items():
+        print(f"{stage:<22}{stats['count']:>8}{stats['errors']:>8}"
+              f"{stats['p50_ms']:>11.1f}{stats['p95_ms']:>11.1f}"
+              f"{stats['p99_ms']:>11.1f}{stats['max_ms']:>11.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Report p50/p95/p99 latency per pipeline stage."
+    )
+    parser.add_argument("files", nargs="+",
+                        help="JSON lines trace files or Cloud Logging JSON exports.")
+    parser.add_argument("--report", default=None,
+                        help="Optional path to write the report as JSON.")
+    args = parser.parse_args()
+
+    records = [record for path in args.files for record in read_records(path)]
+    if not records:
+        print("No stage timing records found.")
+        sys.exit(1)
+
+    report = build_report(records)
+    print_report(report)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
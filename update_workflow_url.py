@@ -1,12 +1,14 @@
 import sys
 
 def main():
-    if len(sys.argv) != 3:
-        print("Usage: python update_workflow_url.py <workflow_file> <url_file>")
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python update_workflow_url.py <workflow_file> <url_file> "
+              "[placeholder]")
         sys.exit(1)
 
     workflow_file = sys.argv[1]
     url_file = sys.argv[2]
+    placeholder = sys.argv[3] if len(sys.argv) == 4 else "YOUR_DATE_PARSER_FUNCTION_URL"
 
     with open(url_file, 'r') as f:
         url = f.read().strip()
@@ -14,7 +16,7 @@ def main():
     with open(workflow_file, 'r') as f:
         content = f.read()
 
-    content = content.replace("YOUR_DATE_PARSER_FUNCTION_URL", url)
+    content = content.replace(placeholder, url)
 
     with open(workflow_file, 'w') as f:
         f.write(content)